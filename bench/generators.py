@@ -0,0 +1,85 @@
+# Parametric inputs for the benchmarks. Grid size and face count scale independently: grids are built
+# from a cell count and an extent, meshes from a resolution, and both fit the same extent.
+#
+#   makeTfg     terrain-following grid over a DEM sloped along y (like examples/gourd/make_dem.py)
+#   makeSphere  closed UV sphere, for volume mapping
+#   makeWavy    open surface z = 7xy/exp(x^2+y^2) (like examples/wavy/make_obj.py), for surface mapping
+
+import os
+import sys
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+sys.path.append(ROOT_DIR)
+
+from src.pfbio import writePfb
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+
+def makeTfg(demPath, nx, ny, nz, extent=(-2.0, -2.0, 2.0, 2.0), zBottom=-2.0, zTop=2.0, slope=0.2):
+    """
+    Writes a DEM and builds a grid on it.
+    :param demPath: pfb file the DEM is written to
+    :param nx: number of columns along x. Likewise ny, and nz layers
+    :param extent: (xmin, ymin, xmax, ymax) of the grid
+    :param zBottom: elevation of the grid bottom at ymin. The DEM starts at zTop and rises by slope over
+        the y extent, layers are equally thick
+    """
+    x0, y0, x1, y1 = extent
+    dx, dy = (x1 - x0) / nx, (y1 - y0) / ny
+    dem = np.ones([1, ny, nx]) * (zTop + slope * np.linspace(0, 1, ny))[None, :, None]
+    writePfb(demPath, dem, x=x0, y=y0, dx=dx, dy=dy, dist=False)
+    return TFG(x0, y0, dx, dy, nx, ny, [(zTop - zBottom) / nz]*nz, demPath)
+
+def makeSphere(nLat, nLon, center=(0.0, 0.0, 0.0), radius=1.5):
+    """
+    Closed UV sphere with 2*nLon*(nLat-1) triangles.
+    :param nLat: number of latitude bands, at least 2
+    :param nLon: number of longitude segments, at least 3
+    """
+    theta = np.linspace(0, np.pi, nLat+1)[1:-1]
+    phi = np.linspace(0, 2*np.pi, nLon, endpoint=False)
+    theta, phi = np.meshgrid(theta, phi, indexing="ij")
+    ring = np.column_stack([
+        np.sin(theta).ravel() * np.cos(phi).ravel(),
+        np.sin(theta).ravel() * np.sin(phi).ravel(),
+        np.cos(theta).ravel(),
+    ])
+    verts = np.vstack([[0, 0, 1], ring, [0, 0, -1]]) * radius + center
+    south = len(verts) - 1
+
+    # vertex id of (band, segment) on the rings, bands 0..nLat-2
+    ringId = lambda band, seg: 1 + band*nLon + seg % nLon
+    seg = np.arange(nLon)
+    faces = [np.column_stack([np.zeros(nLon, dtype=np.int64), ringId(0, seg), ringId(0, seg+1)])]
+    for band in range(nLat-2):
+        a, b = ringId(band, seg), ringId(band, seg+1)
+        c, d = ringId(band+1, seg), ringId(band+1, seg+1)
+        faces.append(np.column_stack([a, c, d]))
+        faces.append(np.column_stack([a, d, b]))
+    faces.append(np.column_stack([ringId(nLat-2, seg), np.full(nLon, south), ringId(nLat-2, seg+1)]))
+    return TriangulatedSurface(verts, np.vstack(faces))
+
+def makeWavy(n, extent=(-2.0, -1.0, 2.0, 1.0), zOffset=0.0):
+    """
+    Open surface sampled on n by n vertices, 2*(n-1)^2 triangles.
+    """
+    x0, y0, x1, y1 = extent
+    xs, ys = np.meshgrid(np.linspace(x0, x1, n), np.linspace(y0, y1, n), indexing="ij")
+    zs = (7*xs*ys)/(np.exp(xs**2 + ys**2)) + zOffset
+    verts = np.column_stack([xs.ravel(), ys.ravel(), zs.ravel()])
+    ix, iy = np.meshgrid(np.arange(1, n), np.arange(1, n), indexing="ij")
+    v = lambda i, j: (i*n + j).ravel()
+    t1 = np.column_stack([v(ix-1, iy-1), v(ix, iy-1), v(ix, iy)])
+    t2 = np.column_stack([v(ix-1, iy-1), v(ix, iy), v(ix-1, iy)])
+    return TriangulatedSurface(verts, np.vstack([t1, t2]))
+
+def writeObj(path, ts):
+    """
+    Writes a triangulated surface as an OBJ file readable by TriangulatedSurface.fromObj.
+    """
+    with open(path, "w") as f:
+        f.write("".join("v %f %f %f\n" %tuple(v) for v in ts.verts))
+        f.write("".join("f %d %d %d\n" %tuple(t) for t in ts.faces + 1))
@@ -0,0 +1,57 @@
+# Compares candidate-triangle lookups on the examples: time to build the lookup and time to query
+# every column of the grid, for the rtree and grid-bin indexes.
+#
+# Run from the repository root:
+#   python bench/index_bench.py
+
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.pfgm import TriangulatedSurface
+from src.spatial import INDEX_KINDS
+from src.tfg import TFG
+
+EXAMPLES = [
+    ("dodecahedron", "dodecahedron.obj", "volume"),
+    ("gourd", "gourd.obj", "volume"),
+    ("wavy", "wavy.obj", "surface"),
+]
+
+def benchIndex(ts, tfg, kind, indexKind):
+    ts.indexKind = indexKind
+    ts.index = None
+    ts.columnIndexes = {}
+    t0 = time.perf_counter()
+    columns = ts.columnIndex(tfg, kind)
+    t1 = time.perf_counter()
+    nx, ny = (tfg.nx, tfg.ny) if kind == "volume" else (tfg.nx-1, tfg.ny-1)
+    ncandidates = 0
+    for ix in range(0, nx):
+        for iy in range(0, ny):
+            ncandidates += len(columns.candidates(ix, iy))
+    t2 = time.perf_counter()
+    return t1 - t0, t2 - t1, nx * ny, ncandidates
+
+def main():
+    print("%-14s %-6s %10s %10s %12s %12s" %("example", "index", "build (s)", "query (s)", "columns/s", "candidates"))
+    for name, obj, kind in EXAMPLES:
+        exampleDir = os.path.join(EXAMPLES_DIR, name)
+        os.chdir(exampleDir)
+        ts, err = TriangulatedSurface.fromObj(obj)
+        if err != None:
+            sys.exit(err)
+        tfg, err = TFG.fromJson("tfg.json")
+        if err != None:
+            sys.exit(err)
+        for indexKind in INDEX_KINDS:
+            build, query, ncolumns, ncandidates = benchIndex(ts, tfg, kind, indexKind)
+            print("%-14s %-6s %10.4f %10.4f %12.0f %12d" %(name, indexKind, build, query, ncolumns / query, ncandidates))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+# Mapping benchmark suite: throughput of every engine on the examples and on generated inputs, with a
+# correctness check against the reference ray engine.
+#
+# For every case it records OBJ parse time, candidate lookup build time for each index, seconds and
+# cells/s of each engine, pfb write time and peak traced memory of mapping plus writing. The ray engine is
+# the reference. It is too slow to run on whole grids, so it maps a check tile of columns around the
+# middle of the mesh, and every other engine must reproduce its indicators there exactly.
+#
+# Run from the repository root:
+#   python bench/mapping_bench.py -o results.json
+#   python bench/mapping_bench.py -o new.json -compare results.json
+#
+# With -compare, engines whose cells/s dropped by more than -tolerance against the baseline file are
+# reported. The exit status is 1 on any regression or mismatch.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+import generators
+from src.parallel import mapTiles
+from src.pfbio import writePfb
+from src.pfgm import ENGINES, INDICATOR_DTYPE, TriangulatedSurface
+from src.spatial import INDEX_KINDS
+from src.tfg import TFG
+
+REFERENCE_ENGINE = "ray"
+
+# Columns along each side of the check tile
+CHECK_TILE_SIZE = 8
+
+# (name, kind, inputs). Example inputs name a directory of examples/, generated inputs give the grid
+# (nx, ny, nz) and the mesh resolution separately. Cases marked large only run with -large.
+CASES = [
+    {"name": "dodecahedron", "kind": "volume", "example": ("dodecahedron", "dodecahedron.obj")},
+    {"name": "wavy", "kind": "surface", "example": ("wavy", "wavy.obj")},
+    {"name": "gourd", "kind": "volume", "example": ("gourd", "gourd.obj"), "large": True},
+    {"name": "sphere-grid64-mesh20", "kind": "volume", "grid": (64, 64, 64), "mesh": 20},
+    {"name": "sphere-grid64-mesh80", "kind": "volume", "grid": (64, 64, 64), "mesh": 80},
+    {"name": "sphere-grid128-mesh20", "kind": "volume", "grid": (128, 128, 64), "mesh": 20},
+    {"name": "sphere-grid256-mesh80", "kind": "volume", "grid": (256, 256, 128), "mesh": 80, "large": True},
+    {"name": "wavy-grid64-mesh30", "kind": "surface", "grid": (64, 64, 32), "mesh": 30},
+    {"name": "wavy-grid64-mesh120", "kind": "surface", "grid": (64, 64, 32), "mesh": 120},
+    {"name": "wavy-grid128-mesh30", "kind": "surface", "grid": (128, 128, 32), "mesh": 30},
+    {"name": "wavy-grid256-mesh120", "kind": "surface", "grid": (256, 256, 64), "mesh": 120, "large": True},
+]
+
+def timed(f, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = f(*args, **kwargs)
+    return result, time.perf_counter() - t0
+
+def loadCase(case, workDir):
+    """
+    :return: the surface, the grid and the OBJ parse time in seconds
+    """
+    if "example" in case:
+        exampleDir, obj = case["example"]
+        cwd = os.getcwd()
+        os.chdir(os.path.join(EXAMPLES_DIR, exampleDir))
+        try:
+            (ts, err), parse = timed(TriangulatedSurface.fromObj, obj)
+            if err != None:
+                sys.exit(err)
+            tfg, err = TFG.fromJson("tfg.json")
+            if err != None:
+                sys.exit(err)
+        finally:
+            os.chdir(cwd)
+        return ts, tfg, parse
+
+    nx, ny, nz = case["grid"]
+    demPath = os.path.join(workDir, "%s.dem.pfb" %case["name"])
+    if case["kind"] == "volume":
+        tfg = generators.makeTfg(demPath, nx, ny, nz)
+        mesh = generators.makeSphere(case["mesh"], 2*case["mesh"], center=(0.1, 0.05, 0.0))
+    else:
+        tfg = generators.makeTfg(demPath, nx, ny, nz, extent=(-2.5, -1.5, 2.5, 1.5))
+        mesh = generators.makeWavy(case["mesh"])
+    objPath = os.path.join(workDir, "%s.obj" %case["name"])
+    generators.writeObj(objPath, mesh)
+    (ts, err), parse = timed(TriangulatedSurface.fromObj, objPath)
+    if err != None:
+        sys.exit(err)
+    return ts, tfg, parse
+
+def columnRange(tfg, kind):
+    return (tfg.nx, tfg.ny) if kind == "volume" else (tfg.nx-1, tfg.ny-1)
+
+def checkTile(ts, tfg, kind):
+    """
+    Tile of at most CHECK_TILE_SIZE by CHECK_TILE_SIZE columns around the middle of the mesh.
+    """
+    nx, ny = columnRange(tfg, kind)
+    center = (np.min(ts.verts, axis=0) + np.max(ts.verts, axis=0)) / 2.0
+    ix = int(np.clip((center[0] - tfg.x0) // tfg.dx, 0, nx-1))
+    iy = int(np.clip((center[1] - tfg.y0) // tfg.dy, 0, ny-1))
+    ix0, iy0 = max(0, ix - CHECK_TILE_SIZE//2), max(0, iy - CHECK_TILE_SIZE//2)
+    return ix0, min(nx, ix0 + CHECK_TILE_SIZE), iy0, min(ny, iy0 + CHECK_TILE_SIZE)
+
+def mapArrays(ts, tfg, kind, engine, tile, jobs):
+    method = ENGINES[kind][engine]
+    narrays = 1 if kind == "volume" else 3
+    if jobs > 1:
+        return mapTiles(ts, tfg, kind, method, [INDICATOR_DTYPE]*narrays, jobs)
+    arrays = [np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=INDICATOR_DTYPE) for _ in range(narrays)]
+    getattr(ts, method)(tfg, *arrays, tile=tile)
+    return arrays
+
+def tileCells(tfg, kind, tile):
+    ix0, ix1, iy0, iy1 = tile
+    nz = tfg.nz if kind == "volume" else tfg.nz-1
+    return (ix1-ix0) * (iy1-iy0) * nz
+
+def runCase(case, workDir, jobs):
+    kind = case["kind"]
+    ts, tfg, parse = loadCase(case, workDir)
+    nx, ny = columnRange(tfg, kind)
+    result = {
+        "name": case["name"],
+        "kind": kind,
+        "grid": [tfg.nx, tfg.ny, tfg.nz],
+        "cells": tfg.nx * tfg.ny * tfg.nz,
+        "faces": len(ts.faces),
+        "parseSeconds": parse,
+        "index": {},
+        "engines": {},
+    }
+
+    for indexKind in INDEX_KINDS:
+        ts.indexKind = indexKind
+        _, build = timed(ts.columnIndex, tfg, kind)
+        result["index"][indexKind] = {"buildSeconds": build}
+    # engines use the default index, cached from above
+    ts.indexKind = INDEX_KINDS[0]
+
+    tile = checkTile(ts, tfg, kind)
+    reference, seconds = timed(mapArrays, ts, tfg, kind, REFERENCE_ENGINE, tile, 1)
+    result["checkTile"] = list(tile)
+    result["engines"][REFERENCE_ENGINE] = {
+        "cells": tileCells(tfg, kind, tile),
+        "seconds": seconds,
+        "cellsPerSecond": tileCells(tfg, kind, tile) / seconds,
+    }
+
+    ix0, ix1, iy0, iy1 = tile
+    window = (slice(None), slice(iy0, iy1), slice(ix0, ix1))
+    fastest, arrays = None, None
+    for engine in ENGINES[kind]:
+        if engine == REFERENCE_ENGINE:
+            continue
+        mapped, seconds = timed(mapArrays, ts, tfg, kind, engine, (0, nx, 0, ny), jobs)
+        matches = all(np.array_equal(m[window], r[window]) for m, r in zip(mapped, reference))
+        result["engines"][engine] = {
+            "cells": tileCells(tfg, kind, (0, nx, 0, ny)),
+            "seconds": seconds,
+            "cellsPerSecond": tileCells(tfg, kind, (0, nx, 0, ny)) / seconds,
+            "matchesReference": matches,
+        }
+        if fastest is None or seconds < result["engines"][fastest]["seconds"]:
+            fastest, arrays = engine, mapped
+
+    if arrays is not None:
+        pfbPath = os.path.join(workDir, "%s.pfb" %case["name"])
+        _, write = timed(writePfb, pfbPath, arrays[0], x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
+        result["writeSeconds"] = write
+        result["writeCellsPerSecond"] = result["cells"] / write
+
+        # peak memory is traced in a separate run because tracing slows down allocation-heavy loops
+        del arrays
+        tracemalloc.start()
+        mapped = mapArrays(ts, tfg, kind, fastest, (0, nx, 0, ny), 1)
+        for i, indi in enumerate(mapped):
+            writePfb("%s.%d" %(pfbPath, i), indi, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
+        result["peakBytes"] = tracemalloc.get_traced_memory()[1]
+        result["peakEngine"] = fastest
+        tracemalloc.stop()
+    return result
+
+def compareResults(results, baselinePath, tolerance):
+    """
+    :return: list of regression messages
+    """
+    with open(baselinePath, "r") as f:
+        baseline = {case["name"]: case for case in json.load(f)["cases"]}
+    regressions = []
+    for case in results["cases"]:
+        before = baseline.get(case["name"])
+        if before is None:
+            continue
+        for engine, stats in case["engines"].items():
+            if engine not in before["engines"]:
+                continue
+            ratio = stats["cellsPerSecond"] / before["engines"][engine]["cellsPerSecond"]
+            print("%-24s %-8s %8.2fx" %(case["name"], engine, ratio))
+            if ratio < 1.0 - tolerance:
+                regressions.append("%s %s: %.0f cells/s, baseline %.0f" %(case["name"], engine,
+                    stats["cellsPerSecond"], before["engines"][engine]["cellsPerSecond"]))
+    return regressions
+
+def getArgs():
+    parser = argparse.ArgumentParser(description="Mapping throughput benchmarks")
+    parser.add_argument('-o', type=str, default="bench_results.json",
+                        help="json file the results are written to")
+    parser.add_argument('-cases', type=str, nargs="*",
+                        help="names of the cases to run. Defaults to every case that is not large")
+    parser.add_argument('-large', action="store_true",
+                        help="also run the large cases (full gourd example and 8M cell generated grids)")
+    parser.add_argument('-jobs', type=int, default=1,
+                        help="worker processes for the engines under test. The reference always runs serially")
+    parser.add_argument('-compare', type=str,
+                        help="baseline results file to compare cells/s against")
+    parser.add_argument('-tolerance', type=float, default=0.2,
+                        help="allowed fractional drop in cells/s before a case counts as a regression")
+    return parser.parse_args()
+
+def main():
+    args = getArgs()
+    cases = [c for c in CASES if (c["name"] in args.cases if args.cases else args.large or not c.get("large"))]
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "jobs": args.jobs,
+        "cases": [],
+    }
+
+    print("%-24s %-8s %10s %12s %s" %("case", "engine", "seconds", "cells/s", "check"))
+    with tempfile.TemporaryDirectory() as workDir:
+        for case in cases:
+            result = runCase(case, workDir, args.jobs)
+            results["cases"].append(result)
+            for engine, stats in result["engines"].items():
+                check = {True: "ok", False: "MISMATCH"}.get(stats.get("matchesReference"), "reference")
+                print("%-24s %-8s %10.3f %12.0f %s" %(case["name"], engine, stats["seconds"], stats["cellsPerSecond"], check))
+
+    with open(args.o, "w") as f:
+        json.dump(results, f, indent=4)
+
+    failed = ["%s %s: does not match the reference" %(case["name"], engine)
+              for case in results["cases"] for engine, stats in case["engines"].items()
+              if stats.get("matchesReference") is False]
+    if args.compare is not None:
+        failed += compareResults(results, args.compare, args.tolerance)
+    for msg in failed:
+        print(msg)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
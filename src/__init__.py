@@ -0,0 +1,28 @@
+# In-memory API. Surfaces are built from vertex and face arrays and grids from a DEM array, mapping
+# returns indicator arrays, and writing them to disk is a separate step:
+#
+#   from src import TFG, TriangulatedSurface
+#   tfg = TFG.fromDem(dem, x0, y0, dx, dy, dzs)
+#   indi = TriangulatedSurface(verts, faces).mapVolume(tfg, "voxel")
+#   TriangulatedSurface.writeVolume(tfg, indi, "out", vtkFormat="vtu")
+#
+# Names are imported on first use, so importing a single module of the package stays cheap.
+
+_EXPORTS = {
+    "TriangulatedSurface": "pfgm",
+    "ENGINES": "pfgm",
+    "INDICATOR_DTYPE": "pfgm",
+    "TFG": "tfg",
+    "readPfb": "pfbio",
+    "writePfb": "pfbio",
+    "writeApproxFaces": "export",
+    "writeVolumeVtk": "vtkio",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError("module %r has no attribute %r" %(__name__, name))
+    from importlib import import_module
+    return getattr(import_module("." + _EXPORTS[name], __name__), name)
@@ -0,0 +1,187 @@
+# Batch volume mapping of many geometries onto one grid.
+#
+# A manifest lists the geometries of a model (e.g. geologic units). All of them are merged into one
+# triangulated surface that remembers which geometry each face came from, so every column is visited
+# once: one candidate lookup, one z-mid array and one crossing pass serve all geometries. Crossings are
+# then split by geometry and classified with the same parity rule as the single-geometry column engine.
+#
+# The result is a labeled grid holding the id of the geometry that contains each cell center (0 where
+# none does). Where geometries overlap, the one with the highest priority wins; ties go to the geometry
+# listed first in the manifest.
+#
+# Manifest format:
+# {
+#     "geometries": [
+#         {"obj": "sand.obj", "id": 1, "priority": 1, "indicator": true},
+#         {"obj": "clay.obj", "id": 2}
+#     ]
+# }
+# "obj" paths are relative to the manifest and may name any mesh format of meshio.py. "id" defaults to
+# the position in the list (starting at 1), "priority" to 0, "name" to the obj file name without
+# extension, and "indicator" to false. Geometries with "indicator" set also get their own 0/1 indicator
+# output.
+
+import json
+import os
+
+import numpy as np
+from .parallel import mapTiles
+from .pfbio import writePfb
+from .pfgm import INDICATOR_DTYPE, TriangulatedSurface
+from .profiling import Profile
+from .vtkio import writeVolumeVtk
+
+def readManifest(infile):
+    """
+    Read a batch manifest.
+    :param infile: manifest filename
+    :return: list of geometry entries (dicts with obj, id, priority, name and indicator) on success, None
+        on failure. The second return value is None on success, and an error message on failure.
+    """
+    try:
+        with open(infile, "r") as f:
+            j = json.load(f)
+        entries = []
+        baseDir = os.path.dirname(os.path.abspath(infile))
+        for i, g in enumerate(j["geometries"]):
+            obj = os.path.join(baseDir, g["obj"])
+            entries.append({
+                "obj": obj,
+                "id": int(g.get("id", i+1)),
+                "priority": g.get("priority", 0),
+                "name": g.get("name", os.path.splitext(os.path.basename(obj))[0]),
+                "indicator": bool(g.get("indicator", False)),
+            })
+    except Exception as e:
+        return None, "error reading manifest %s: %s" %(infile, str(e))
+
+    if len(entries) == 0:
+        return None, "manifest %s lists no geometries" %infile
+    for e in entries:
+        if e["id"] == 0:
+            return None, "geometry %s: id 0 is reserved for cells outside every geometry" %e["name"]
+        if not os.path.exists(e["obj"]):
+            return None, "error: '%s' does not exist" %e["obj"]
+    # indicator outputs are keyed and written by name
+    names = set()
+    for e in entries:
+        if not e["indicator"]:
+            continue
+        if e["name"] in names:
+            return None, "manifest %s: several geometries with an indicator are named '%s'. Give them distinct " \
+                "names" %(infile, e["name"])
+        names.add(e["name"])
+    return entries, None
+
+class GeometryBatch(TriangulatedSurface):
+    def __init__(self, surfaces, entries, indexKind=None):
+        """
+        :param surfaces: one TriangulatedSurface per manifest entry
+        :param entries: manifest entries, as returned by readManifest
+        :param indexKind: candidate lookup for the merged surface, see TriangulatedSurface
+        """
+        offsets = np.cumsum([0] + [len(s.verts) for s in surfaces])
+        verts = np.concatenate([s.verts for s in surfaces])
+        faces = np.concatenate([s.faces + offset for s, offset in zip(surfaces, offsets)])
+        TriangulatedSurface.__init__(self, verts, faces, indexKind)
+        self.entries = entries
+        # geometry index of every face
+        self.owner = np.repeat(np.arange(len(surfaces)), [len(s.faces) for s in surfaces])
+        self.zMaxes = np.array([s.zMax for s in surfaces])
+        self.ids = np.array([e["id"] for e in entries])
+        # smallest integer type holding every id
+        self.labelDtype = np.result_type(np.min_scalar_type(self.ids.min()), np.min_scalar_type(self.ids.max()))
+        # rank 0 is the geometry that wins overlaps
+        order = sorted(range(len(entries)), key=lambda g: (-entries[g]["priority"], g))
+        self.byRank = np.array(order)
+        self.rank = np.argsort(self.byRank)
+        # position of each geometry's indicator array among the outputs, -1 when not requested
+        self.indicatorSlot = -np.ones(len(entries), dtype=np.int64)
+        slots = [g for g, e in enumerate(entries) if e["indicator"]]
+        self.indicatorSlot[slots] = np.arange(len(slots))
+
+    @staticmethod
+    def fromManifest(infile, indexKind=None, cache=None):
+        """
+        Read a manifest and every geometry it lists.
+        :param cache: optional Cache the geometries are read through
+        :return: the batch, or None and an error message if reading failed
+        """
+        entries, err = readManifest(infile)
+        if err != None:
+            return None, err
+        surfaces = []
+        for e in entries:
+            ts, err = cache.loadSurface(e["obj"]) if cache is not None else TriangulatedSurface.fromFile(e["obj"])
+            if err != None:
+                return None, err
+            surfaces.append(ts)
+        return GeometryBatch(surfaces, entries, indexKind), None
+
+    def mapLabelsColumns(self, tfg, labels, *indicators, tile, profile=None):
+        """
+        Labels every cell of a tile with the id of the winning geometry, one crossing pass per column.
+        :param tfg: the terrain-following grid
+        :param labels: (nz, ny, nx) label array, filled in place
+        :param indicators: (nz, ny, nx) indicator arrays of the geometries that requested one, in
+            manifest order, filled in place
+        :param tile: (ix0, ix1, iy0, iy1) range of columns to map, upper bounds exclusive
+        :param profile: optional Profile counting cells, candidates and ray-triangle tests
+        """
+        ix0, ix1, iy0, iy1 = tile
+        columns = self.columnIndex(tfg, "volume")
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                tIds = columns.candidates(ix, iy)
+                zCrossings, absDets, hitIds = self.columnCrossings(tfg.x_mid[ix], tfg.y_mid[iy], tIds)
+                if len(zCrossings) > 0:
+                    zMids = tfg.zMidColumn(ix, iy)
+                    owners = self.owner[hitIds]
+                    labeled = np.zeros(tfg.nz, dtype=bool)
+                    for g in self.byRank[np.unique(self.rank[owners])]:
+                        mine = owners == g
+                        inside = self.classifyColumn(zCrossings[mine], absDets[mine], zMids, self.zMaxes[g])
+                        if self.indicatorSlot[g] >= 0:
+                            indicators[self.indicatorSlot[g]][inside, iy, ix] = 1
+                        labels[inside & ~labeled, iy, ix] = self.ids[g]
+                        labeled |= inside
+                if profile is not None:
+                    profile.column(len(tIds), tfg.nz, len(tIds))
+
+    def mapLabels(self, tfg, jobs=1, profile=None):
+        """
+        Maps all geometries onto the grid.
+        :param tfg: the terrain-following grid
+        :param jobs: number of worker processes. Output does not depend on this value
+        :param profile: optional Profile recording the index build and mapping phases. Shows progress
+        :return: (nz, ny, nx) label array of type labelDtype and a dict of (nz, ny, nx) indicator arrays
+            keyed by the names of geometries that requested one
+        """
+        names = [e["name"] for e in self.entries if e["indicator"]]
+        dtypes = [self.labelDtype] + [INDICATOR_DTYPE]*len(names)
+        profile = profile if profile is not None else Profile()
+        with profile.phase("buildIndex"):
+            self.columnIndex(tfg, "volume")
+        profile.start(tfg.nx * tfg.ny * tfg.nz)
+        with profile.phase("map"), profile.hotLoop():
+            if jobs > 1:
+                arrays = mapTiles(self, tfg, "volume", "mapLabelsColumns", dtypes, jobs, profile)
+            else:
+                arrays = [np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=dtype) for dtype in dtypes]
+                self.mapLabelsColumns(tfg, *arrays, tile=(0, tfg.nx, 0, tfg.ny), profile=profile)
+        return arrays[0], dict(zip(names, arrays[1:]))
+
+    def processLabels(self, tfg, output_root, jobs=1, subgrids=(1, 1, 1), profile=None, vtkFormat="tcl", vtkInside=False):
+        p, q, r = subgrids
+        profile = profile if profile is not None else Profile()
+        ncells = tfg.nx * tfg.ny * tfg.nz
+        print("Processing %d geometries for %s. %d cells. %d faces" %(len(self.entries), output_root, ncells, len(self.faces)))
+        labels, indicators = self.mapLabels(tfg, jobs, profile)
+
+        pfbPath = "%s.pfb" %output_root
+        with profile.phase("writePfb"):
+            writePfb(pfbPath, labels, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1, p=p, q=q, r=r)
+            for name, indi in indicators.items():
+                writePfb("%s.%s.pfb" %(output_root, name), indi, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1, p=p, q=q, r=r)
+        with profile.phase("writeVtk"):
+            writeVolumeVtk(tfg, labels, output_root, vtkFormat, vtkInside, name="label")
@@ -0,0 +1,201 @@
+# On-disk cache of parsed inputs, keyed by content hash.
+#
+# Repeated runs on the same mesh and grid skip parsing and index building. A mesh entry holds the vertex
+# and face arrays of the parsed OBJ, plus the candidate lookups built for it: a disk-backed R-tree, and
+# the CSR arrays of grid bins for each grid layout it was mapped onto. A grid entry holds the DEM, so the
+# pfb is not read again. Arrays are stored as .npy files and memory-mapped on reload.
+#
+# Layout: one directory per entry, <root>/mesh-<sha256> or <root>/tfg-<sha256>, hashed over the input
+# file contents (and CACHE_VERSION). Files are written under temporary names and renamed into place, so
+# concurrent runs never read a partial entry. The modification time of an entry directory records its
+# last use; when the cache grows past its size cap, the least recently used entries are removed.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .pfgm import TriangulatedSurface
+from .spatial import BinnedColumns, buildRtree, openRtree
+from .tfg import TFG
+
+# Bump when the content of entries changes, so older entries are no longer found
+CACHE_VERSION = 1
+
+DEFAULT_MAX_BYTES = 4 << 30
+
+def contentDigest(paths, extra=""):
+    """
+    :return: sha256 hex digest of the contents of the files in paths, and an extra string
+    """
+    h = hashlib.sha256(("pfgm-cache-%d:%s" %(CACHE_VERSION, extra)).encode("utf-8"))
+    for path in paths:
+        h.update(b"\0")
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+class Cache:
+    def __init__(self, root, maxBytes=DEFAULT_MAX_BYTES):
+        """
+        :param root: cache directory, created if missing
+        :param maxBytes: size cap. Least recently used entries are evicted beyond it
+        """
+        self.root = root
+        self.maxBytes = maxBytes
+        os.makedirs(root, exist_ok=True)
+
+    def entryPath(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        """
+        :return: the entry directory, marked as just used, or None if the entry does not exist
+        """
+        path = self.entryPath(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)
+        return path
+
+    def store(self, key, arrays):
+        """
+        Writes a new entry.
+        :param arrays: dict of arrays, saved as <name>.npy
+        :return: the entry directory
+        """
+        tmp = tempfile.mkdtemp(prefix=".tmp-", dir=self.root)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, name + ".npy"), array)
+        try:
+            os.rename(tmp, self.entryPath(key))
+        except OSError:
+            # written meanwhile by another run
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+        return self.entryPath(key)
+
+    def load(self, path, name):
+        return np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+
+    def entrySize(self, path):
+        size = 0
+        for dirPath, _, files in os.walk(path):
+            for f in files:
+                try:
+                    size += os.path.getsize(os.path.join(dirPath, f))
+                except OSError:
+                    pass
+        return size
+
+    def evict(self, keep=None):
+        """
+        Removes least recently used entries until the cache fits its size cap. The entry named keep
+        is never removed.
+        """
+        entries = []
+        for key in os.listdir(self.root):
+            path = self.entryPath(key)
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), key, self.entrySize(path)))
+            except OSError:
+                # removed meanwhile by a concurrent eviction
+                pass
+        total = sum(size for _, _, size in entries)
+        for _, key, size in sorted(entries):
+            if total <= self.maxBytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entryPath(key), ignore_errors=True)
+            total -= size
+
+    def loadSurface(self, infile, indexKind=None):
+        """
+        TriangulatedSurface.fromFile through the cache.
+        :return: the triangulated surface or an possible error message if reading failed.
+        """
+        try:
+            key = "mesh-" + contentDigest([infile])
+        except OSError as e:
+            return None, "error reading %s: %s" %(infile, str(e))
+        path = self.lookup(key)
+        if path is not None:
+            ts = TriangulatedSurface(self.load(path, "verts"), self.load(path, "faces"), indexKind)
+        else:
+            ts, err = TriangulatedSurface.fromFile(infile)
+            if err != None:
+                return None, err
+            ts.indexKind = indexKind if indexKind is not None else ts.indexKind
+            self.store(key, {"verts": ts.verts, "faces": ts.faces})
+        ts.cacheKey = key
+        return ts, None
+
+    def loadTfg(self, infile):
+        """
+        TFG.fromJson through the cache.
+        :return: the terrain-following grid on success, and None and failure. The second return value is
+            None on success, and an error message on failure.
+        """
+        try:
+            with open(infile, "r") as f:
+                demPfb = json.load(f)["dem"]
+            key = "tfg-" + contentDigest([infile, demPfb])
+        except Exception as e:
+            return None, "error reading %s: %s" %(infile, str(e))
+        path = self.lookup(key)
+        if path is not None:
+            return TFG.fromJson(infile, dem=self.load(path, "dem"))
+        tfg, err = TFG.fromJson(infile)
+        if err != None:
+            return None, err
+        self.store(key, {"dem": tfg.dem})
+        return tfg, None
+
+    def prepareIndex(self, ts, tfg, kind):
+        """
+        Loads the candidate lookup of a surface for a grid from its cache entry, or builds and stores it.
+        The lookup is installed in the surface, so engines find it already built. Surfaces that were not
+        loaded through the cache build the lookup as usual.
+        """
+        path = self.lookup(ts.cacheKey) if ts.cacheKey is not None else None
+        if path is None:
+            ts.columnIndex(tfg, kind)
+            return
+
+        if ts.indexKind == "rtree":
+            base = os.path.join(path, "rtree")
+            if ts.index is None and os.path.exists(base + ".idx"):
+                ts.index = openRtree(base)
+            elif ts.index is None:
+                # the .idx file is renamed last, so its presence means the index is complete
+                tmp = os.path.join(path, ".tmp-%d-rtree" %os.getpid())
+                buildRtree(ts.bboxMin, ts.bboxMax, tmp).close()
+                os.replace(tmp + ".dat", base + ".dat")
+                os.replace(tmp + ".idx", base + ".idx")
+                ts.index = openRtree(base)
+                self.evict(keep=ts.cacheKey)
+            ts.columnIndex(tfg, kind)
+            return
+
+        layout = hashlib.sha256(repr(ts.columnIndexKey(tfg, kind)).encode("utf-8")).hexdigest()[:16]
+        base = os.path.join(path, "bins-%s" %layout)
+        if os.path.exists(base + "-offsets.npy"):
+            csr = (np.load(base + "-offsets.npy", mmap_mode="r"), np.load(base + "-ids.npy", mmap_mode="r"))
+            columns = BinnedColumns(ts.bboxMin, ts.bboxMax, tfg, kind, csr)
+        else:
+            columns = BinnedColumns(ts.bboxMin, ts.bboxMax, tfg, kind)
+            # offsets are renamed last, so their presence means the arrays are complete
+            tmp = os.path.join(path, ".tmp-%d-" %os.getpid())
+            np.save(tmp + "ids.npy", columns.ids)
+            np.save(tmp + "offsets.npy", columns.offsets)
+            os.replace(tmp + "ids.npy", base + "-ids.npy")
+            os.replace(tmp + "offsets.npy", base + "-offsets.npy")
+            self.evict(keep=ts.cacheKey)
+        ts.columnIndexes[ts.columnIndexKey(tfg, kind)] = columns
@@ -0,0 +1,88 @@
+# Command line of pfgm.py.
+#
+# Kept apart from the mapping code and free of numerical imports, so pfgm.py can answer --help and
+# report usage errors before it imports numpy and the engines. Values are checked in pfgm.getArgs.
+
+import argparse
+
+def makeParser():
+    """
+    :return: the argument parser of pfgm.py
+    """
+    parser = argparse.ArgumentParser(description="ParFlow Geometry Mapper. A tool for mapping .obj files onto "
+                                    + "a ParFlow-style terrain-following grid.")
+    parser.add_argument('-kind', metavar="k", type=str,
+                        help="Kind of analysis. Options are 'volume' or 'surface'")
+    parser.add_argument('-tfg', type=str,
+                        help="json-formatted metadata for terrain-following grid")
+    parser.add_argument('-obj', type=str,
+                        help="input mesh. The format is picked by extension: .obj, binary .stl or .ply, or .npz "
+                        + "(see meshio.py). Polygons are split into triangles")
+    parser.add_argument('-manifest', type=str,
+                        help="json manifest listing several obj files to map in one pass (volumes only, "
+                        + "replaces -obj). Writes one labeled grid; see batch.py for the format")
+    parser.add_argument('-o',
+                        help="root name of output file(s)")
+    parser.add_argument('-engine', type=str, default="ray",
+                        help="Mapping engine. Options are 'ray' (one ray per cell, default) or, for volumes, "
+                        + "'column' (one crossing pass per column) or 'voxel' (triangles rasterized onto the "
+                        + "columns, interior filled by parity along z) and, for surfaces, 'segment' (all neighbor "
+                        + "segments of a column tested in one batch) or 'triangle' (only the segments each "
+                        + "triangle can reach are tested, for thin sheets such as faults). 'numba' runs the column or segment loop "
+                        + "compiled by numba when it is installed and falls back to 'column' or 'segment' otherwise")
+    parser.add_argument('-jobs', type=int, default=1,
+                        help="Number of worker processes. The grid is mapped in tiles when greater than 1")
+    parser.add_argument('-index', type=str, default=None,
+                        help="Candidate triangle lookup. Options are 'rtree' (query per column, default when "
+                        + "rtree is installed) or 'bins' (triangles binned onto grid cells up front)")
+    parser.add_argument('-subgrids', type=int, nargs=3, metavar=("P", "Q", "R"),
+                        help="Number of subgrids along x, y and z in the output pfb files. Defaults to 1 1 1, "
+                        + "or with -merge to those of the plan")
+    parser.add_argument('-faces', type=str, default="obj",
+                        help="Format of the approximate face output for surfaces. Options are 'obj' (default) or "
+                        + "'ply' (binary, much smaller and faster for large results)")
+    parser.add_argument('-vtk', type=str, default="tcl",
+                        help="VTK output of volumes. Options are 'tcl' (default, a tcl script that has ParFlow's "
+                        + "pfvtksave build <o>.vtk), 'vtk' (binary legacy VTK) or 'vtu' (binary XML VTK), both "
+                        + "written directly with the cells draped on the DEM")
+    parser.add_argument('-vtkInside', action="store_true",
+                        help="with -vtk vtk or vtu, write only the cells inside the geometry (nonzero values), "
+                        + "which keeps files of sparse geologies small")
+    parser.add_argument('-profile', type=str,
+                        help="json file to write a run report to: phase timings, ray-triangle tests, "
+                        + "candidate triangles per column and cells/s")
+    parser.add_argument('-cprofile', action="store_true",
+                        help="with -profile, also capture a cProfile of the mapping loop to <report>.pstats. "
+                        + "Only the main process is captured when -jobs is greater than 1")
+    parser.add_argument('-cache', type=str,
+                        help="cache directory for parsed meshes, spatial indexes and DEMs. Repeat runs on the "
+                        + "same inputs load them memory-mapped instead of parsing and rebuilding")
+    parser.add_argument('-cacheSize', type=int, default=4096,
+                        help="size cap of the cache directory in MB. Least recently used entries are removed "
+                        + "beyond it. Defaults to 4096")
+    parser.add_argument('-previous', type=str,
+                        help="root name of the output of a previous run. Only columns affected by changes "
+                        + "between -previousObj/-previousTfg and -obj/-tfg are remapped, the rest is copied")
+    parser.add_argument('-previousObj', type=str,
+                        help="with -previous, the mesh the previous run mapped, in any -obj format")
+    parser.add_argument('-previousTfg', type=str,
+                        help="with -previous, the grid of the previous run. Defaults to -tfg, i.e. an "
+                        + "unchanged grid and DEM")
+    parser.add_argument('-plan', type=str, metavar="DIR",
+                        help="split the mapping of -obj onto -tfg into one job per column of -subgrids and write "
+                        + "the job files to DIR, see distributed.py. Nothing is mapped")
+    parser.add_argument('-job', type=str, metavar="FILE",
+                        help="map one job file of a plan. Writes its result next to it. Takes -engine, -jobs "
+                        + "and -index")
+    parser.add_argument('-merge', type=str, metavar="DIR",
+                        help="assemble the job results of the plan in DIR into the output file(s) -o")
+    parser.add_argument('-serve', type=str, metavar="PATH",
+                        help="run as a mapping server for -tfg: read the grid once and map the jobs client.py "
+                        + "sends to the Unix socket PATH on -jobs worker processes, see server.py")
+    parser.add_argument('-meshes', type=int, default=8,
+                        help="with -serve, number of meshes each worker keeps loaded with their candidate "
+                        + "lookups. Least recently used ones are dropped beyond it. Defaults to 8")
+    parser.add_argument('-queue', action="store_true",
+                        help="with -serve, take jobs from the job directory PATH instead of a Unix socket. "
+                        + "Always the case where Unix sockets are not available")
+    return parser
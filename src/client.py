@@ -0,0 +1,117 @@
+# Thin client of the mapping server, see server.py.
+#
+# Takes the options of a pfgm.py run plus -server PATH, and has a running server map the job instead of
+# starting a new process that reads the grid and the mesh again. Options such as -jobs, -index and -cache
+# are set when the server is started, and are refused here rather than ignored:
+#
+#   python src/pfgm.py -serve /tmp/pfgm.sock -tfg tfg.json -jobs 4 &
+#   python src/client.py -server /tmp/pfgm.sock -kind volume -obj dodecahedron.obj -o out
+#
+# A PATH that is a directory is used as a job queue, otherwise as a Unix socket. The client imports
+# neither numpy nor the engines, so it starts in a fraction of the time pfgm.py needs.
+
+import json
+import os
+import socket
+import sys
+import time
+import uuid
+
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    __package__ = "src"
+
+from .cli import makeParser
+
+# Seconds between checks for a result in a job queue, as in server.py
+QUEUE_POLL_SECONDS = 0.02
+
+# pfgm.py options a server does not run
+UNSUPPORTED = ["manifest", "previous", "previousObj", "previousTfg", "plan", "job", "merge", "serve", "profile",
+               "cprofile"]
+# pfgm.py options that are fixed when the server is started
+SERVER_OPTIONS = ["jobs", "index", "cache", "cacheSize", "meshes", "queue"]
+
+def makeRequest(args):
+    """
+    :param args: parsed command line
+    :return: the request for the options of a pfgm.py run, and None, or None and an error message
+    """
+    defaults = vars(makeParser().parse_args([]))
+    given = ["-" + name for name in UNSUPPORTED if getattr(args, name) != defaults[name]]
+    if given:
+        return None, "error: %s not supported by the server" %", ".join(given)
+    given = ["-" + name for name in SERVER_OPTIONS if getattr(args, name) != defaults[name]]
+    if given:
+        return None, "error: %s can only be set when the server is started (pfgm.py -serve)" %", ".join(given)
+    missing = ["-" + name for name in ["kind", "obj", "o"] if getattr(args, name) is None]
+    if missing:
+        return None, "error: the following arguments are required: %s" %", ".join(missing)
+    request = {"kind": args.kind, "obj": os.path.abspath(args.obj), "o": os.path.abspath(args.o),
+               "engine": args.engine, "subgrids": args.subgrids if args.subgrids is not None else [1, 1, 1],
+               "faces": args.faces, "vtk": args.vtk, "vtkInside": args.vtkInside}
+    if args.tfg is not None:
+        request["tfg"] = os.path.abspath(args.tfg)
+    return request, None
+
+def sendRequest(path, request, timeout=None):
+    """
+    Sends a request to the server at path and waits for the response.
+    :param path: Unix socket of the server, or its job directory
+    :param timeout: seconds to wait, or None to wait until the job is done
+    :return: the response and None, or None and an error message
+    """
+    if os.path.isdir(path):
+        return sendQueued(path, request, timeout)
+    if not hasattr(socket, "AF_UNIX"):
+        return None, "error: Unix sockets are not available. Run the server with -queue"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(timeout)
+            s.connect(path)
+            s.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            with s.makefile("rb") as f:
+                line = f.readline()
+    except OSError as e:
+        return None, "error: no response from the server at %s: %s" %(path, str(e))
+    try:
+        return json.loads(line), None
+    except ValueError:
+        return None, "error: no response from the server at %s" %path
+
+def sendQueued(path, request, timeout=None):
+    name = uuid.uuid4().hex
+    job = os.path.join(path, name + ".job")
+    result = os.path.join(path, name + ".result")
+    # written under a temporary name, so the server never reads a partial job
+    with open(job + ".tmp", "w") as f:
+        json.dump(request, f)
+    os.replace(job + ".tmp", job)
+
+    start = time.monotonic()
+    while not os.path.exists(result):
+        if timeout is not None and time.monotonic() - start > timeout:
+            return None, "error: no response from the server at %s" %path
+        time.sleep(QUEUE_POLL_SECONDS)
+    with open(result, "r") as f:
+        response = json.load(f)
+    os.remove(result)
+    return response, None
+
+if __name__ == "__main__":
+    parser = makeParser()
+    parser.add_argument('-server', type=str, metavar="PATH", required=True,
+                        help="Unix socket or job directory of a server started with pfgm.py -serve")
+    args = parser.parse_args()
+    request, err = makeRequest(args)
+    if err != None:
+        print(err)
+        sys.exit(1)
+    response, err = sendRequest(args.server, request)
+    if err != None:
+        print(err)
+        sys.exit(1)
+    if response["error"] != None:
+        print("error: %s" %response["error"])
+        sys.exit(1)
+    print("Mapped %s in %.2f s%s" %(args.o, response["seconds"], " (mesh already loaded)" if response["cached"] else ""))
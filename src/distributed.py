@@ -0,0 +1,185 @@
+# Distributed mapping: the grid is split into independent tile jobs that can run on separate nodes.
+#
+# The tiles are the P by Q columns of subgrids of a ParFlow run distributed over P x Q x R processes
+# (-subgrids P Q R), so every job maps exactly the columns of one column of output subgrids. There are
+# three steps:
+#
+#   plan   maps nothing. It writes <dir>/plan.json and one <dir>/job.<n>.npz per tile that the geometry
+#          reaches. A job file holds everything the job needs: its window of the DEM, the layering, and
+#          the triangles that are candidates for any of its columns. Tiles without candidates are all
+#          zeros and get no job
+#   job    maps one job file on any machine, without the OBJ, the grid json or the DEM pfb, and writes
+#          <dir>/result.<n>.npz next to it
+#   merge  assembles the results into the usual outputs: one pfb (or x, y, z pfbs and faces), split into
+#          subgrids with a .dist file when -subgrids asks for it
+#
+# Jobs compute cell coordinates from the origin of the full grid (see TFG.window), so their indicators
+# are identical to those of a single run. Surface jobs also carry the DEM of the next column and row,
+# which the neighbor segments of their last lattice columns end in.
+
+import json
+import os
+
+import numpy as np
+
+from .pfbio import subgridLayout
+from .pfgm import ENGINES, INDICATOR_DTYPE, TriangulatedSurface
+from .pipeline import columnBlocks
+from .profiling import Profile
+from .tfg import TFG
+
+PLAN_FILE = "plan.json"
+
+def resultPath(jobFile):
+    """
+    :return: name of the result file of a job file, <dir>/job.<n>.npz -> <dir>/result.<n>.npz
+    """
+    directory, name = os.path.split(jobFile)
+    return os.path.join(directory, "result." + name[len("job."):] if name.startswith("job.") else name + ".result.npz")
+
+def mappedBlock(tfg, kind, block):
+    """
+    :return: the (ix0, ix1, iy0, iy1) columns an engine maps for a block of grid columns. Surfaces map
+        lattice columns, so blocks on the last row or column map one less
+    """
+    ix0, ix1, iy0, iy1 = block
+    if kind == "volume":
+        return block
+    return (ix0, min(ix1, tfg.nx-1), iy0, min(iy1, tfg.ny-1))
+
+def planJobs(ts, tfg, kind, tfgPath, outdir, subgrids=(1, 1, 1), profile=None):
+    """
+    Splits a mapping into one job per column of output subgrids and writes the job files.
+    :param ts: the triangulated surface
+    :param tfg: the terrain-following grid
+    :param kind: 'volume' or 'surface'
+    :param tfgPath: json file of the grid, read again by the merge step with the DEM pfb of tfg
+    :param outdir: directory the plan and the job files are written to. Created if needed
+    :param subgrids: (P, Q, R) subgrids of the output pfb files. Jobs are their P by Q columns
+    :return: None on success, and an error message on failure
+    """
+    profile = profile if profile is not None else Profile()
+    p, q, r = subgrids
+    os.makedirs(outdir, exist_ok=True)
+    with profile.phase("buildIndex"):
+        columns = ts.columnIndex(tfg, kind)
+
+    jobs, skipped = [], 0
+    for block, _ in columnBlocks(subgridLayout(tfg.nx, tfg.ny, 1, p, q, 1)):
+        ix0, ix1, iy0, iy1 = mappedBlock(tfg, kind, block)
+        tIds = columns.tileCandidates((ix0, ix1, iy0, iy1)) if ix0 < ix1 and iy0 < iy1 else []
+        if len(tIds) == 0:
+            skipped += 1
+            continue
+        # the window of a surface job reaches one column further, where its last segments end
+        halo = 0 if kind == "volume" else 1
+        window = (ix0, min(ix1+halo, tfg.nx), iy0, min(iy1+halo, tfg.ny))
+        wx0, wx1, wy0, wy1 = window
+
+        # triangles of the job, renumbered onto the vertices they use
+        used, faces = np.unique(ts.faces[tIds], return_inverse=True)
+        name = "job.%d.npz" %len(jobs)
+        if os.path.exists(resultPath(os.path.join(outdir, name))):
+            # left over from an earlier plan in the same directory
+            os.remove(resultPath(os.path.join(outdir, name)))
+        with profile.phase("writeJobs"):
+            np.savez(os.path.join(outdir, name), kind=kind, verts=ts.verts[used], faces=faces.reshape(-1, 3),
+                     zMax=ts.zMax, dem=np.asarray(tfg.dem[0][wy0:wy1, wx0:wx1], dtype=np.float64),
+                     dzs=np.asarray(tfg.dzs, dtype=np.float64), origin=[tfg.x0, tfg.y0, tfg.dx, tfg.dy],
+                     window=window, block=block)
+        jobs.append({"job": name, "result": os.path.basename(resultPath(name)), "block": [int(i) for i in block],
+                     "faces": len(tIds)})
+
+    # the DEM pfb of the json may be relative to the directory the plan was made in, so the merge step gets
+    # it as an absolute path
+    plan = {"kind": kind, "tfg": os.path.abspath(tfgPath), "dem": os.path.abspath(tfg.demPfb) if tfg.demPfb else None,
+            "subgrids": [p, q, r], "shape": [tfg.nx, tfg.ny, tfg.nz], "jobs": jobs}
+    with open(os.path.join(outdir, PLAN_FILE), "w") as f:
+        json.dump(plan, f, indent=4)
+    print("Planned %d jobs in %s. %d of %d tiles have no triangles and are left out"
+          %(len(jobs), outdir, skipped, p*q))
+    return None
+
+def runJob(jobFile, engine="ray", jobs=1, indexKind=None, profile=None):
+    """
+    Maps the columns of one job file and writes its result file.
+    :param jobFile: a job file written by planJobs
+    :param engine: name of the engine, a key of ENGINES[kind] for the kind of the plan
+    :param jobs: number of worker processes on this machine
+    :param indexKind: candidate lookup, one of INDEX_KINDS
+    :return: None on success, and an error message on failure
+    """
+    profile = profile if profile is not None else Profile()
+    with profile.phase("readJob"):
+        try:
+            with np.load(jobFile) as job:
+                job = dict(job)
+        except (OSError, ValueError) as e:
+            return "error reading job file %s: %s" %(jobFile, str(e))
+    kind = str(job["kind"])
+    if engine not in ENGINES[kind]:
+        return "'%s' is not a valid %s engine. Choose from %s" %(engine, kind, ", ".join(ENGINES[kind]))
+
+    x0, y0, dx, dy = job["origin"]
+    wx0, wx1, wy0, wy1 = job["window"]
+    bx0, bx1, by0, by1 = job["block"]
+    tfg = TFG(x0, y0, dx, dy, int(wx1-wx0), int(wy1-wy0), list(job["dzs"]), dem=job["dem"], ix0=int(wx0), iy0=int(wy0))
+    ts = TriangulatedSurface(job["verts"], job["faces"], indexKind)
+    # the top of the whole geometry, where rays end in a single run
+    ts.zMax = float(job["zMax"])
+
+    print("Mapping %s: columns %d-%d by %d-%d. %d faces" %(jobFile, bx0, bx1-1, by0, by1-1, len(ts.faces)))
+    if kind == "volume":
+        arrays = {"indi": ts.mapVolume(tfg, engine, jobs, profile)}
+    else:
+        arrays = dict(zip(["x", "y", "z"], ts.mapSurface(tfg, engine, jobs, profile)))
+    # surface jobs leave out the extra column and row of their window
+    arrays = {key: indi[:, :by1-by0, :bx1-bx0] for key, indi in arrays.items()}
+    with profile.phase("writeResult"):
+        np.savez_compressed(resultPath(jobFile), block=job["block"], **arrays)
+    return None
+
+def mergeJobs(planDir, output_root, subgrids=None, faceFormat="obj", profile=None, vtkFormat="tcl",
+              vtkInside=False):
+    """
+    Assembles the results of the jobs of a plan and writes the same files as processVolume or
+    processSurface.
+    :param planDir: directory of the plan
+    :param output_root: root name of the output file(s)
+    :param subgrids: (P, Q, R) subgrids of the output pfb files. Defaults to those of the plan
+    :return: None on success, and an error message on failure
+    """
+    profile = profile if profile is not None else Profile()
+    try:
+        with open(os.path.join(planDir, PLAN_FILE), "r") as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as e:
+        return "error reading the plan in %s: %s" %(planDir, str(e))
+    with profile.phase("readTfg"):
+        tfg, err = TFG.fromJson(plan["tfg"], demPfb=plan.get("dem"))
+    if err != None:
+        return err
+    if [tfg.nx, tfg.ny, tfg.nz] != plan["shape"]:
+        return "the grid in %s no longer matches the plan" %plan["tfg"]
+
+    kind = plan["kind"]
+    keys = ["indi"] if kind == "volume" else ["x", "y", "z"]
+    arrays = {key: np.zeros((tfg.nz, tfg.ny, tfg.nx), dtype=INDICATOR_DTYPE) for key in keys}
+    with profile.phase("readResults"):
+        for job in plan["jobs"]:
+            path = os.path.join(planDir, job["result"])
+            if not os.path.exists(path):
+                return "result '%s' is missing. Run pfgm.py -job %s first" %(path, os.path.join(planDir, job["job"]))
+            ix0, ix1, iy0, iy1 = job["block"]
+            with np.load(path) as result:
+                for key in keys:
+                    arrays[key][:, iy0:iy1, ix0:ix1] = result[key]
+
+    subgrids = subgrids if subgrids is not None else plan["subgrids"]
+    print("Merged %d jobs into %s" %(len(plan["jobs"]), output_root))
+    if kind == "volume":
+        TriangulatedSurface.writeVolume(tfg, arrays["indi"], output_root, subgrids, profile, vtkFormat, vtkInside)
+    else:
+        TriangulatedSurface.writeSurface(tfg, arrays["x"], arrays["y"], arrays["z"], output_root, subgrids,
+                                         faceFormat, profile)
+    return None
@@ -0,0 +1,117 @@
+# Exporters for mapped surfaces.
+#
+# A surface mapping marks, for every cell, whether the flow barrier crosses to its x, y and z neighbors.
+# Each marked pair becomes one quad on the shared cell face. Quads are built for all marked cells at once
+# from the TFG geometry, vertices shared by neighboring quads are written once, and files are written in
+# large chunks. Quads keep the order of the original per-cell exporter: by ix, then iy, then iz, then
+# x, y and z direction.
+
+import numpy as np
+
+FACE_FORMATS = ["obj", "ply"]
+
+# Rows formatted per write
+CHUNK_ROWS = 1 << 16
+
+# Quad corners for each direction as (x, y, z) flags: 0 selects the cell's lower bound, 1 its upper bound
+QUAD_CORNERS = np.array([
+    [[1, 0, 0], [1, 0, 1], [1, 1, 1], [1, 1, 0]],  # x: face at xmax
+    [[0, 1, 0], [0, 1, 1], [1, 1, 1], [1, 1, 0]],  # y: face at ymax
+    [[0, 0, 1], [1, 0, 1], [1, 1, 1], [0, 1, 1]],  # z: face at zmax
+], dtype=bool)
+
+def approxFaces(tfg, indi_x, indi_y, indi_z):
+    """
+    Builds the quads approximating a mapped surface.
+    :param tfg: the terrain-following grid
+    :param indi_x: (nz, ny, nx) x-direction indicator array. Likewise indi_y and indi_z
+    :return: (V, 3) unique vertex coordinates in order of first use, and (F, 4) zero-based vertex indices
+        of each quad
+    """
+    cells = [np.nonzero(indi) for indi in (indi_x, indi_y, indi_z)]
+    iz = np.concatenate([c[0] for c in cells])
+    iy = np.concatenate([c[1] for c in cells])
+    ix = np.concatenate([c[2] for c in cells])
+    direction = np.repeat(np.arange(3), [len(c[0]) for c in cells])
+    order = np.lexsort((direction, iz, iy, ix))
+    ix, iy, iz, direction = ix[order], iy[order], iz[order], direction[order]
+
+    xMin, yMin = tfg.x_min[ix], tfg.y_min[iy]
+    bounds = [
+        (xMin, xMin + tfg.dx),
+        (yMin, yMin + tfg.dy),
+        (tfg.zMinCells(ix, iy, iz), tfg.zMaxCells(ix, iy, iz)),
+    ]
+    flags = QUAD_CORNERS[direction]
+    corners = np.empty((len(ix), 4, 3))
+    for axis, (lower, upper) in enumerate(bounds):
+        corners[:, :, axis] = np.where(flags[:, :, axis], upper[:, None], lower[:, None])
+    corners = corners.reshape(-1, 3)
+
+    # Sort corners by coordinates to find duplicates. The sort is stable, so the first corner of each run
+    # of equal ones is also its first use.
+    order = np.lexsort((corners[:, 2], corners[:, 1], corners[:, 0]))
+    ordered = corners[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    vertex = np.empty(len(order), dtype=np.int64)
+    vertex[order] = np.cumsum(starts) - 1
+
+    byFirstUse = np.argsort(order[starts])
+    renumber = np.empty(len(byFirstUse), dtype=np.int64)
+    renumber[byFirstUse] = np.arange(len(byFirstUse))
+    return ordered[starts][byFirstUse], renumber[vertex].reshape(-1, 4)
+
+def writeObj(outfile, verts, quads):
+    """
+    Writes quads as a text OBJ file.
+    :param outfile: output filename
+    :param verts: (V, 3) vertex coordinates
+    :param quads: (F, 4) zero-based vertex indices
+    """
+    with open(outfile, "w") as f:
+        for i in range(0, len(verts), CHUNK_ROWS):
+            chunk = verts[i:i+CHUNK_ROWS]
+            f.write(("v %f %f %f\n" * len(chunk)) % tuple(chunk.ravel()))
+        for i in range(0, len(quads), CHUNK_ROWS):
+            chunk = quads[i:i+CHUNK_ROWS] + 1
+            f.write(("f %d %d %d %d\n" * len(chunk)) % tuple(chunk.ravel()))
+
+def writePly(outfile, verts, quads):
+    """
+    Writes quads as a binary little-endian PLY file. Arguments are the same as for writeObj.
+    """
+    header = ("ply\n"
+              "format binary_little_endian 1.0\n"
+              "element vertex %d\n"
+              "property double x\n"
+              "property double y\n"
+              "property double z\n"
+              "element face %d\n"
+              "property list uchar int vertex_indices\n"
+              "end_header\n") %(len(verts), len(quads))
+    faceType = np.dtype([("n", "u1"), ("v", "<i4", (4,))])
+    with open(outfile, "wb") as f:
+        f.write(header.encode("ascii"))
+        for i in range(0, len(verts), CHUNK_ROWS):
+            f.write(verts[i:i+CHUNK_ROWS].astype("<f8").tobytes())
+        for i in range(0, len(quads), CHUNK_ROWS):
+            chunk = quads[i:i+CHUNK_ROWS]
+            records = np.empty(len(chunk), dtype=faceType)
+            records["n"] = 4
+            records["v"] = chunk
+            f.write(records.tobytes())
+
+def writeApproxFaces(tfg, indi_x, indi_y, indi_z, outfile, faceFormat="obj"):
+    """
+    Writes the quads approximating a mapped surface.
+    :param tfg: the terrain-following grid
+    :param indi_x: (nz, ny, nx) x-direction indicator array. Likewise indi_y and indi_z
+    :param outfile: output filename
+    :param faceFormat: one of FACE_FORMATS
+    """
+    verts, quads = approxFaces(tfg, indi_x, indi_y, indi_z)
+    if faceFormat == "ply":
+        writePly(outfile, verts, quads)
+    else:
+        writeObj(outfile, verts, quads)
@@ -0,0 +1,190 @@
+# Incremental remapping after a change of the mesh or the DEM.
+#
+# The indicators of a previous run stay valid for every column whose inputs did not change, so only the
+# affected columns are mapped again and the rest is copied from the previous output.
+#
+# Mesh changes are found by diffing the triangles of the old and new surfaces by vertex coordinates.
+# Every column touched by the xy bounding box of a removed or added triangle is affected. The columns
+# come from the same rasterization as the binned candidate lookup, which covers the R-tree candidates
+# too. DEM changes affect the columns whose elevation changed. For surfaces they also affect the lattice
+# columns that pair a changed cell with its x or y neighbor.
+#
+# Some changes invalidate every column and fall back to a full remap:
+# - a different lateral layout or layering of the grid;
+# - a different top of the geometry, because rays run to zMax+1 and cells above zMax are skipped.
+
+import os
+
+import numpy as np
+
+from .parallel import mapTiles
+from .pfbio import readPfb
+from .pfgm import ENGINES, INDICATOR_DTYPE
+from .profiling import Profile
+from .spatial import BinnedColumns
+
+def triangleRows(ts):
+    """
+    :return: (M, 9) coordinates of the three vertices of each triangle
+    """
+    return ts.verts[ts.faces].reshape(-1, 9)
+
+def changedTriangles(oldTs, ts):
+    """
+    Diffs two surfaces triangle by triangle. Triangles are compared by the coordinates of their vertices,
+    so renumbering or reordering vertices and faces is not a change.
+    :return: boolean masks over the faces of oldTs (removed triangles) and of ts (added triangles)
+    """
+    old, new = triangleRows(oldTs), triangleRows(ts)
+    rows = np.vstack([old, new])
+    if len(rows) == 0:
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype=bool)
+
+    # group identical triangles, then compare how often each occurs in either surface
+    order = np.lexsort(rows.T[::-1])
+    ordered = rows[order]
+    starts = np.ones(len(rows), dtype=bool)
+    starts[1:] = np.any(ordered[1:] != ordered[:-1], axis=1)
+    group = np.empty(len(rows), dtype=np.int64)
+    group[order] = np.cumsum(starts) - 1
+    ngroups = int(group.max()) + 1
+    nOld = np.bincount(group[:len(old)], minlength=ngroups)
+    nNew = np.bincount(group[len(old):], minlength=ngroups)
+    changed = (nOld != nNew)[group]
+    return changed[:len(old)], changed[len(old):]
+
+def sameLayout(oldTfg, tfg):
+    layout = lambda g: (g.x0, g.y0, g.dx, g.dy, g.nx, g.ny, list(g.dzs))
+    return layout(oldTfg) == layout(tfg)
+
+def affectedColumns(oldTs, oldTfg, ts, tfg, kind):
+    """
+    Finds the columns whose indicators may differ between a run of oldTs on oldTfg and of ts on tfg.
+    :param kind: 'volume' or 'surface'
+    :return: boolean mask of the columns to remap, (nx, ny) for volumes and (nx-1, ny-1) lattice columns
+        for surfaces. The second return value is None, or the reason why every column must be remapped
+    """
+    nx, ny = (tfg.nx, tfg.ny) if kind == "volume" else (tfg.nx-1, tfg.ny-1)
+    if not sameLayout(oldTfg, tfg):
+        return np.ones((nx, ny), dtype=bool), "the grid layout changed"
+    if oldTs.zMax != ts.zMax:
+        return np.ones((nx, ny), dtype=bool), "the top of the geometry changed"
+
+    removed, added = changedTriangles(oldTs, ts)
+    bboxMin = np.vstack([oldTs.bboxMin[removed], ts.bboxMin[added]])
+    bboxMax = np.vstack([oldTs.bboxMax[removed], ts.bboxMax[added]])
+    columns = BinnedColumns(bboxMin, bboxMax, tfg, kind)
+    mask = (np.diff(columns.offsets) > 0).reshape(nx, ny)
+
+    demChanged = (oldTfg.dem[0][:tfg.ny, :tfg.nx] != tfg.dem[0][:tfg.ny, :tfg.nx]).T
+    if kind == "volume":
+        mask |= demChanged
+    else:
+        mask |= demChanged[:-1, :-1] | demChanged[1:, :-1] | demChanged[:-1, 1:]
+    return mask, None
+
+def columnTiles(mask):
+    """
+    Covers the columns of a mask with tiles, one per run of consecutive iy in each ix.
+    :return: list of (ix0, ix1, iy0, iy1) tuples, upper bounds exclusive
+    """
+    padded = np.zeros((mask.shape[0], mask.shape[1]+2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    ixs, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+    return [(int(ix), int(ix)+1, int(iy0), int(iy1)) for ix, iy0, iy1 in zip(ixs, starts, ends)]
+
+def readPrevious(previous_root, kind, tfg):
+    """
+    Reads the indicators written by a previous run.
+    :param previous_root: root name of the previous output file(s)
+    :return: list of (nz, ny, nx) uint8 arrays, one for volumes and x, y, z for surfaces, on success,
+        None on failure. The second return value is None on success, and an error message on failure.
+    """
+    if kind == "volume":
+        paths = ["%s.pfb" %previous_root]
+    else:
+        paths = ["%s.%s.pfb" %(previous_root, dim) for dim in ["x", "y", "z"]]
+    arrays = []
+    for path in paths:
+        if not os.path.exists(path):
+            return None, "previous output '%s' does not exist" %path
+        try:
+            indi = readPfb(path, dtype=INDICATOR_DTYPE)
+        except ValueError as e:
+            return None, "error reading previous output '%s': %s" %(path, str(e))
+        if indi.shape != (tfg.nz, tfg.ny, tfg.nx):
+            return None, "previous output '%s' has shape %s, the grid is %s" %(path, indi.shape, (tfg.nz, tfg.ny, tfg.nx))
+        arrays.append(indi)
+    return arrays, None
+
+def remap(ts, tfg, kind, previous, mask, engine="ray", jobs=1, profile=None):
+    """
+    Maps the masked columns anew and keeps the previous indicators everywhere else.
+    :param ts: the new triangulated surface
+    :param tfg: the new terrain-following grid
+    :param kind: 'volume' or 'surface'
+    :param previous: indicator arrays of the previous run, as from readPrevious. Patched in place
+    :param mask: columns to remap, as from affectedColumns
+    :param engine: name of the engine, a key of ENGINES[kind]
+    :param jobs: number of worker processes. Output does not depend on this value
+    :param profile: optional Profile. Only remapped columns are counted as mapped
+    :return: the patched arrays
+    """
+    method = ENGINES[kind][engine]
+    profile = profile if profile is not None else Profile()
+    nz = tfg.nz if kind == "volume" else tfg.nz-1
+    tiles = columnTiles(mask)
+    cells = np.zeros((tfg.ny, tfg.nx), dtype=bool)
+    cells[:mask.shape[1], :mask.shape[0]] = mask.T
+
+    with profile.phase("buildIndex"):
+        ts.columnIndex(tfg, kind)
+    nRemapped = int(np.count_nonzero(mask))
+    profile.count("columnsCopied", mask.size - nRemapped)
+    profile.start(nRemapped * nz)
+    with profile.phase("map"), profile.hotLoop():
+        if jobs > 1 and len(tiles) > 0:
+            mapped = mapTiles(ts, tfg, kind, method, [INDICATOR_DTYPE]*len(previous), jobs, profile, tiles)
+            for indi, new in zip(previous, mapped):
+                indi[:, cells] = new[:, cells]
+        else:
+            for indi in previous:
+                indi[:, cells] = 0
+            for tile in tiles:
+                getattr(ts, method)(tfg, *previous, tile, profile)
+    return previous
+
+def processIncremental(ts, tfg, oldTs, oldTfg, previous_root, output_root, kind, engine="ray", jobs=1,
+                       subgrids=(1, 1, 1), faceFormat="obj", profile=None, vtkFormat="tcl", vtkInside=False):
+    """
+    Maps ts onto tfg by patching the output of a previous run of oldTs on oldTfg, and writes the same
+    files as processVolume or processSurface.
+    :param previous_root: root name of the previous output file(s)
+    :param output_root: root name of the output file(s). May equal previous_root
+    :return: None on success, and an error message on failure
+    """
+    profile = profile if profile is not None else Profile()
+    with profile.phase("diff"):
+        mask, reason = affectedColumns(oldTs, oldTfg, ts, tfg, kind)
+
+    if reason is not None:
+        print("Remapping every column of %s: %s" %(output_root, reason))
+        if kind == "volume":
+            arrays = [ts.mapVolume(tfg, engine, jobs, profile)]
+        else:
+            arrays = list(ts.mapSurface(tfg, engine, jobs, profile))
+    else:
+        with profile.phase("readPrevious"):
+            previous, err = readPrevious(previous_root, kind, tfg)
+        if err != None:
+            return err
+        print("Remapping %d of %d columns for %s" %(np.count_nonzero(mask), mask.size, output_root))
+        arrays = remap(ts, tfg, kind, previous, mask, engine, jobs, profile)
+
+    if kind == "volume":
+        ts.writeVolume(tfg, arrays[0], output_root, subgrids, profile, vtkFormat, vtkInside)
+    else:
+        ts.writeSurface(tfg, *arrays, output_root, subgrids, faceFormat, profile)
+    return None
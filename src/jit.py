@@ -0,0 +1,184 @@
+# Compiled kernels for the 'numba' engines.
+#
+# The NumPy engines spend their time in per-column Python loops and in the temporary arrays of the
+# batched Möller-Trumbore test. When the optional numba package is installed, the kernels below compile
+# the whole per-column loop to machine code: every candidate triangle is tested one at a time with no
+# temporaries, and the indicators are written directly. The arithmetic is that of segmentsIntersect,
+# verticalCrossings and classifyColumn term by term, so the indicators are identical to the other
+# engines. Without numba the 'numba' engines fall back to the NumPy 'column' and 'segment' engines.
+#
+# Candidates reach the kernels in CSR form for the columns of a tile, see tileCsr in spatial.py. Cell
+# centers are computed from the DEM row by row the same way as TFG.zMidColumn.
+
+from importlib.util import find_spec
+
+import numpy as np
+
+# numba is imported, and the kernels compiled, on first use, see compileKernels
+NUMBA = find_spec("numba") is not None
+
+EPSILON = 0.0000001
+
+# kernels in the order they are compiled, callees first
+KERNELS = ["columnMids", "segmentHits", "volumeColumns", "surfaceColumns"]
+compiled = False
+
+def compileKernels():
+    """
+    Replaces the kernels of this module by their numba-compiled versions. Until then, and without numba,
+    they are plain Python functions. Compiled code is cached on disk next to this file.
+    """
+    global compiled
+    if compiled or not NUMBA:
+        return
+    import numba
+    for name in KERNELS:
+        globals()[name] = numba.njit(cache=True, nogil=True)(globals()[name])
+    compiled = True
+
+def columnMids(dem, zBottoms, dzArray, ix, iy, zMids):
+    """
+    Cell center elevations of column (ix, iy), bottom to top, into zMids. Values match TFG.zMidColumn.
+    """
+    nz = len(zBottoms)
+    top = dem[iy, ix]
+    for iz in range(nz):
+        zMin = top - zBottoms[iz]
+        zMax = top if iz == nz-1 else zMin + dzArray[iz]
+        zMids[iz] = (zMin + zMax) / 2.0
+
+def segmentHits(ox, oy, oz, ex, ey, ez, tIds, v0, edge1, edge2):
+    """
+    Number of triangles tIds that the segment from (ox, oy, oz) to (ex, ey, ez) intersects. Scalar
+    version of TriangulatedSurface.segmentsIntersect.
+    """
+    rx, ry, rz = ex - ox, ey - oy, ez - oz
+    hits = 0
+    for tId in tIds:
+        e1x, e1y, e1z = edge1[tId, 0], edge1[tId, 1], edge1[tId, 2]
+        e2x, e2y, e2z = edge2[tId, 0], edge2[tId, 1], edge2[tId, 2]
+        # h = rayVector x edge2
+        hx = ry*e2z - rz*e2y
+        hy = rz*e2x - rx*e2z
+        hz = rx*e2y - ry*e2x
+        a = e1x*hx + e1y*hy + e1z*hz
+        if not (a <= -EPSILON or a >= EPSILON):
+            continue
+        f = 1.0/a
+        sx, sy, sz = ox - v0[tId, 0], oy - v0[tId, 1], oz - v0[tId, 2]
+        u = f * (sx*hx + sy*hy + sz*hz)
+        if not (u >= 0.0 and u <= 1.0):
+            continue
+        # q = s x edge1
+        qx = sy*e1z - sz*e1y
+        qy = sz*e1x - sx*e1z
+        qz = sx*e1y - sy*e1x
+        v = f * (rx*qx + ry*qy + rz*qz)
+        if not (v >= 0.0 and u + v <= 1.0):
+            continue
+        t = f * (e2x*qx + e2y*qy + e2z*qz)
+        if not t > EPSILON:
+            continue
+        # the intersection must lie between the two ends of the segment
+        K_AC = rx*(ex - (ox + rx*t)) + ry*(ey - (oy + ry*t)) + rz*(ez - (oz + rz*t))
+        K_AB = rx*rx + ry*ry + rz*rz
+        if K_AC >= 0 and K_AC <= K_AB:
+            hits += 1
+    return hits
+
+def volumeColumns(indi, ix0, ix1, tile, offsets, ids, xMid, yMid, dem, zBottoms, dzArray, v0, edge1, edge2, zMax):
+    """
+    Volume mapping of columns ix0..ix1-1 of a tile, with the rules of verticalCrossings and
+    classifyColumn.
+    :param indi: (nz, ny, nx) indicator array, filled in place
+    :param tile: (ix0, ix1, iy0, iy1) tile the CSR arrays cover
+    :param offsets: CSR offsets. Candidates of column (ix, iy) are ids[offsets[c]:offsets[c+1]] with
+        c = (ix - tile[0])*(tile[3] - tile[2]) + iy - tile[2]
+    :param zMax: top of the geometry
+    """
+    nz = len(zBottoms)
+    tileNy = tile[3] - tile[2]
+    zMids = np.empty(nz)
+    zs = np.empty(max(1, len(ids)))
+    dets = np.empty(max(1, len(ids)))
+    for ix in range(ix0, ix1):
+        x = xMid[ix]
+        for iy in range(tile[2], tile[3]):
+            c = (ix - tile[0])*tileNy + iy - tile[2]
+            y = yMid[iy]
+            # crossings of the vertical line through the column center
+            n = 0
+            for k in range(offsets[c], offsets[c+1]):
+                tId = ids[k]
+                hx, hy = -edge2[tId, 1], edge2[tId, 0]
+                a = edge1[tId, 0]*hx + edge1[tId, 1]*hy
+                if not abs(a) > 0:
+                    continue
+                f = 1.0/a
+                sx, sy, sz = x - v0[tId, 0], y - v0[tId, 1], -v0[tId, 2]
+                u = f * (sx*hx + sy*hy)
+                if not (u >= 0.0 and u <= 1.0):
+                    continue
+                qx = sy*edge1[tId, 2] - sz*edge1[tId, 1]
+                qy = sz*edge1[tId, 0] - sx*edge1[tId, 2]
+                qz = sx*edge1[tId, 1] - sy*edge1[tId, 0]
+                v = f * qz
+                if not (v >= 0.0 and u + v <= 1.0):
+                    continue
+                zs[n] = f * (edge2[tId, 0]*qx + edge2[tId, 1]*qy + edge2[tId, 2]*qz)
+                dets[n] = abs(a)
+                n += 1
+            if n == 0:
+                continue
+
+            # parity of the crossings above each cell center
+            columnMids(dem, zBottoms, dzArray, ix, iy, zMids)
+            for iz in range(nz):
+                zMid = zMids[iz]
+                if not zMid <= zMax:
+                    continue
+                rayLength = zMax + 1 - zMid
+                threshold = zMid + EPSILON*rayLength
+                above = 0
+                for k in range(n):
+                    if zs[k] > threshold and (dets[k] >= EPSILON or dets[k]*rayLength >= EPSILON):
+                        above += 1
+                if above % 2 != 0:
+                    indi[iz, iy, ix] = 1
+
+def surfaceColumns(indi_x, indi_y, indi_z, ix0, ix1, tile, offsets, ids, xMid, yMid, dem, zBottoms, dzArray,
+                   v0, edge1, edge2, zMax):
+    """
+    Surface mapping of lattice columns ix0..ix1-1 of a tile, with the segments of mapSurfaceRays.
+    Arguments are those of volumeColumns, with one indicator array per direction.
+    :return: number of segment-triangle tests made
+    """
+    nz = len(zBottoms)
+    tileNy = tile[3] - tile[2]
+    zMids = np.empty(nz)
+    zMidsX = np.empty(nz)
+    zMidsY = np.empty(nz)
+    ntests = 0
+    for ix in range(ix0, ix1):
+        x, xf = xMid[ix], xMid[ix+1]
+        for iy in range(tile[2], tile[3]):
+            c = (ix - tile[0])*tileNy + iy - tile[2]
+            tIds = ids[offsets[c]:offsets[c+1]]
+            if len(tIds) == 0:
+                continue
+            y, yf = yMid[iy], yMid[iy+1]
+            columnMids(dem, zBottoms, dzArray, ix, iy, zMids)
+            columnMids(dem, zBottoms, dzArray, ix+1, iy, zMidsX)
+            columnMids(dem, zBottoms, dzArray, ix, iy+1, zMidsY)
+            for iz in range(nz-1):
+                z = zMids[iz]
+                if not z <= zMax:
+                    continue
+                ntests += 3*len(tIds)
+                if segmentHits(x, y, z, xf, y, zMidsX[iz], tIds, v0, edge1, edge2) % 2 != 0:
+                    indi_x[iz, iy, ix] = 1
+                if segmentHits(x, y, z, x, yf, zMidsY[iz], tIds, v0, edge1, edge2) % 2 != 0:
+                    indi_y[iz, iy, ix] = 1
+                if segmentHits(x, y, z, x, y, zMids[iz+1], tIds, v0, edge1, edge2) % 2 != 0:
+                    indi_z[iz, iy, ix] = 1
+    return ntests
@@ -0,0 +1,326 @@
+# Readers for input meshes. The format is picked by the file extension:
+#
+#   .obj  text OBJ. Vertices (v) and faces (f) are read; indices may be negative (relative to the
+#         vertices read so far) or carry texture and normal indices (f 1/1/1 ...), which are ignored.
+#         Polygons are split into triangle fans
+#   .stl  binary STL. Every triangle has three vertices of its own
+#   .ply  binary PLY, little or big endian, with a vertex element (x, y, z) and a face element
+#         (vertex_indices). Polygons are split into triangle fans
+#   .npz  numpy archive with 'verts' (N, 3) coordinates and 'faces' (M, 3) zero-based indices, see writeNpz
+#
+# Files are parsed in bulk: the OBJ reader finds the vertex and face lines with array operations on the
+# raw bytes and converts all numbers of each with a single numpy call, and the binary readers load records straight into arrays. Each reader returns
+# ((verts, faces), None) on success and (None, error message) on failure.
+
+import os
+import re
+import struct
+import warnings
+
+import numpy as np
+
+# ASCII whitespace, as split by bytes.split
+WHITESPACE = np.zeros(256, dtype=bool)
+WHITESPACE[list(b" \t\n\r\x0b\x0c")] = True
+
+STL_RECORD = np.dtype([("normal", "<f4", (3,)), ("verts", "<f4", (3, 3)), ("attributes", "<u2")])
+
+PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+def fanTriangles(indices, counts):
+    """
+    Splits polygons into triangle fans around their first vertex.
+    :param indices: vertex indices of all polygons, concatenated
+    :param counts: number of vertices of each polygon, all at least 3
+    :return: (M, 3) vertex indices of the triangles, polygon by polygon
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    ntris = counts - 2
+    first = np.repeat(np.cumsum(counts) - counts, ntris)
+    # position of each triangle within its polygon, from 1
+    j = np.arange(len(first)) - np.repeat(np.cumsum(ntris) - ntris, ntris) + 1
+    return np.stack([indices[first], indices[first+j], indices[first+j+1]], axis=1)
+
+def gatherLines(buf, lineStarts, lineEnds, selected):
+    """
+    Gathers some lines of a text and blanks their first byte, the 'v' or 'f' keyword.
+    :param buf: uint8 array of the text
+    :param lineStarts: position of the first byte of every line. Likewise lineEnds, of its newline
+    :param selected: boolean mask of the lines to gather
+    :return: (uint8 array of the selected lines, each ending in a newline, position of each newline)
+    """
+    starts, ends = lineStarts[selected], lineEnds[selected]
+    # +1 from the start of every selected line, -1 after its newline
+    marks = np.zeros(len(buf)+1, dtype=np.int8)
+    marks[starts] = 1
+    marks[ends+1] -= 1
+    lines = buf[np.cumsum(marks[:-1], dtype=np.int8).view(bool)]
+    newlines = np.cumsum(ends - starts + 1) - 1
+    lines[newlines - (ends - starts)] = ord(" ")
+    return lines, newlines
+
+def tokenCounts(buf, newlines):
+    """
+    :return: number of whitespace-separated tokens on each line of a text, as from gatherLines
+    """
+    space = WHITESPACE[buf]
+    starts = ~space
+    starts[1:] &= space[:-1]
+    return np.bincount(np.searchsorted(newlines, np.flatnonzero(starts)), minlength=len(newlines))
+
+def parseNumbers(buf, count, dtype):
+    """
+    Parses whitespace-separated numbers in one pass.
+    :return: array of the count numbers of the text, or None if it holds anything else
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        try:
+            values = np.fromstring(buf.tobytes(), dtype=dtype, sep=" ")
+        except (ValueError, DeprecationWarning):
+            return None
+    return values if len(values) == count else None
+
+def lineError(data, lineNos, parse, infile):
+    """
+    Finds the first of the lines that parse fails on, for the error message.
+    """
+    lines = data.split(b"\n")
+    for i in lineNos:
+        try:
+            parse(lines[i])
+        except ValueError as e:
+            return str(e) + ", line %d of %s" %(i+1, infile)
+    return "unreadable values in %s" %infile
+
+def readObj(infile):
+    """
+    Reads the vertices and faces of an OBJ file.
+    :param infile: name of input file
+    :return: (verts, faces) on success, None on failure. The second return value is None on success, and
+        an error message on failure.
+    """
+    try:
+        with open(infile, "rb") as f:
+            data = f.read() + b"\n"
+    except OSError as e:
+        return None, "error reading %s: %s" %(infile, str(e))
+    if b"\n" not in data[:-1]:
+        # old Mac line endings. \r before \n is whitespace like any other
+        data = data.replace(b"\r", b"\n")
+    buf = np.frombuffer(data, dtype=np.uint8)
+    lineEnds = np.flatnonzero(buf == ord("\n"))
+    lineStarts = np.r_[0, lineEnds[:-1]+1]
+    keyword, separator = buf[lineStarts], buf[np.minimum(lineStarts+1, len(buf)-1)]
+    separated = (separator == ord(" ")) | (separator == ord("\t"))
+    isV = (keyword == ord("v")) & separated
+    isF = (keyword == ord("f")) & separated
+    vLines, fLines = np.flatnonzero(isV), np.flatnonzero(isF)
+    nv = len(vLines)
+
+    # vertices: 'v x y z', optionally followed by w or colors
+    text, newlines = gatherLines(buf, lineStarts, lineEnds, isV)
+    counts = tokenCounts(text, newlines)
+    short = np.flatnonzero(counts < 3)
+    if len(short) > 0:
+        return None, "encountered vertex with fewer than three values on line %d" %(vLines[short[0]]+1)
+    values = parseNumbers(text, counts.sum(), np.float64)
+    if values is None:
+        return None, lineError(data, vLines, lambda line: list(map(float, line.split()[1:])), infile)
+    verts = values[(np.cumsum(counts) - counts)[:, None] + np.arange(3)]
+
+    # faces: 'f i j k ...' where every index may be followed by /texture/normal
+    text, newlines = gatherLines(buf, lineStarts, lineEnds, isF)
+    if np.any(text == ord("/")):
+        text = np.frombuffer(re.sub(rb"/\S*", b"", text.tobytes()), dtype=np.uint8)
+        newlines = np.flatnonzero(text == ord("\n"))
+    counts = tokenCounts(text, newlines)
+    short = np.flatnonzero(counts < 3)
+    if len(short) > 0:
+        return None, "encountered face with fewer than three vertices on line %d" %(fLines[short[0]]+1)
+    indices = parseNumbers(text, counts.sum(), np.int64)
+    if indices is None:
+        parse = lambda line: list(map(int, re.sub(rb"/\S*", b"", line).split()[1:]))
+        return None, lineError(data, fLines, parse, infile)
+
+    # negative indices count back from the last vertex read before the face
+    vBefore = np.repeat((np.cumsum(isV) - isV)[fLines], counts)
+    resolved = np.where(indices < 0, vBefore + indices, indices - 1)
+    bad = np.nonzero((indices == 0) | (resolved < 0) | (resolved >= nv))[0]
+    if len(bad) > 0:
+        line = fLines[np.searchsorted(np.cumsum(counts), bad[0], side="right")]
+        return None, "face index %d out of range on line %d" %(indices[bad[0]], line+1)
+    return (verts, fanTriangles(resolved, counts)), None
+
+def readStl(infile):
+    """
+    Reads the triangles of a binary STL file. Arguments and return values are the same as for readObj.
+    """
+    try:
+        size = os.path.getsize(infile)
+        with open(infile, "rb") as f:
+            header = f.read(84)
+            n = struct.unpack("<I", header[80:84])[0] if len(header) == 84 else -1
+            if size != 84 + n * STL_RECORD.itemsize:
+                return None, "%s is not a binary STL file. ASCII STL is not supported" %infile
+            records = np.fromfile(f, dtype=STL_RECORD, count=n)
+    except OSError as e:
+        return None, "error reading %s: %s" %(infile, str(e))
+    verts = records["verts"].reshape(-1, 3).astype(np.float64)
+    return (verts, np.arange(len(verts)).reshape(-1, 3)), None
+
+def readPlyHeader(f):
+    """
+    :return: (byte order, [(element name, count, [property, ...])]), where a property is (name, dtype) or
+        (name, count dtype, item dtype) for lists
+    """
+    if f.readline().strip() != b"ply":
+        raise ValueError("missing 'ply' signature")
+    order, elements = None, []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("missing 'end_header'")
+        parts = line.decode("ascii").split()
+        if not parts or parts[0] in ("comment", "obj_info"):
+            continue
+        if parts[0] == "end_header":
+            break
+        if parts[0] == "format":
+            formats = {"binary_little_endian": "<", "binary_big_endian": ">"}
+            if parts[1] not in formats:
+                raise ValueError("PLY format '%s' is not supported, only binary ones are" %parts[1])
+            order = formats[parts[1]]
+        elif parts[0] == "element":
+            elements.append((parts[1], int(parts[2]), []))
+        elif parts[0] == "property":
+            if parts[1] == "list":
+                elements[-1][2].append((parts[4], PLY_TYPES[parts[2]], PLY_TYPES[parts[3]]))
+            else:
+                elements[-1][2].append((parts[2], PLY_TYPES[parts[1]]))
+    if order is None:
+        raise ValueError("missing 'format'")
+    return order, elements
+
+def readPlyElement(data, pos, order, count, props):
+    """
+    Reads the records of one PLY element from data[pos:].
+    :return: (fields, lists, end). fields maps names of scalar properties to arrays. lists maps the name
+        of a list property to (concatenated items, item count per record). end is the position after the
+        element
+    """
+    lists = [p for p in props if len(p) == 3]
+    if len(lists) > 1:
+        raise ValueError("elements with several list properties are not supported")
+    if not lists:
+        dtype = np.dtype([(name, order + t) for name, t in props])
+        records = np.frombuffer(data, dtype=dtype, count=count, offset=pos)
+        return {name: records[name] for name, _ in props}, {}, pos + count * dtype.itemsize
+
+    # Lists usually all have the same length (a triangle or quad mesh), so read the records as fixed-size
+    # first, and only walk them one by one if the lengths turn out to vary
+    name, countType, itemType = lists[0]
+    before = np.dtype([(p[0], order + p[1]) for p in props[:props.index(lists[0])]])
+    if count > 0:
+        n = int(np.frombuffer(data, dtype=order + countType, count=1, offset=pos + before.itemsize)[0])
+        fields = []
+        for p in props:
+            if len(p) == 2:
+                fields.append((p[0], order + p[1]))
+            else:
+                fields += [(p[0] + ".n", order + countType), (p[0], order + itemType, (n,))]
+        dtype = np.dtype(fields)
+        if pos + count * dtype.itemsize <= len(data):
+            records = np.frombuffer(data, dtype=dtype, count=count, offset=pos)
+            if np.all(records[name + ".n"] == n):
+                scalars = {p[0]: records[p[0]] for p in props if len(p) == 2}
+                return scalars, {name: (records[name].ravel(), np.full(count, n))}, pos + count * dtype.itemsize
+
+    scalarTypes = {p[0]: np.dtype(order + p[1]) for p in props if len(p) == 2}
+    scalars = {key: np.empty(count, dtype=t) for key, t in scalarTypes.items()}
+    countDtype, itemDtype = np.dtype(order + countType), np.dtype(order + itemType)
+    items, counts = [], np.empty(count, dtype=np.int64)
+    for i in range(count):
+        for p in props:
+            if len(p) == 2:
+                scalars[p[0]][i] = np.frombuffer(data, dtype=scalarTypes[p[0]], count=1, offset=pos)[0]
+                pos += scalarTypes[p[0]].itemsize
+            else:
+                counts[i] = np.frombuffer(data, dtype=countDtype, count=1, offset=pos)[0]
+                pos += countDtype.itemsize
+                items.append(np.frombuffer(data, dtype=itemDtype, count=counts[i], offset=pos))
+                pos += counts[i] * itemDtype.itemsize
+    flat = np.concatenate(items) if items else np.zeros(0, dtype=itemDtype)
+    return scalars, {name: (flat, counts)}, pos
+
+def readPly(infile):
+    """
+    Reads the vertices and faces of a binary PLY file. Arguments and return values are the same as for
+    readObj.
+    """
+    try:
+        with open(infile, "rb") as f:
+            order, elements = readPlyHeader(f)
+            data = f.read()
+        pos, verts, faces = 0, None, None
+        for name, count, props in elements:
+            fields, lists, pos = readPlyElement(data, pos, order, count, props)
+            if name == "vertex":
+                verts = np.stack([fields[axis] for axis in ("x", "y", "z")], axis=1).astype(np.float64)
+            elif name == "face":
+                key = "vertex_indices" if "vertex_indices" in lists else "vertex_index"
+                faces = lists[key]
+    except OSError as e:
+        return None, "error reading %s: %s" %(infile, str(e))
+    except (ValueError, KeyError, IndexError) as e:
+        return None, "error reading PLY file %s: %s" %(infile, str(e))
+    if verts is None or faces is None:
+        return None, "PLY file %s has no vertex or no face element" %infile
+    indices, counts = faces
+    if np.any(counts < 3):
+        return None, "PLY file %s has faces with fewer than three vertices" %infile
+    indices = indices.astype(np.int64)
+    if len(indices) > 0 and (indices.min() < 0 or indices.max() >= len(verts)):
+        return None, "PLY file %s has face indices out of range" %infile
+    return (verts, fanTriangles(indices, counts)), None
+
+def readNpz(infile):
+    """
+    Reads a mesh written by writeNpz. Arguments and return values are the same as for readObj.
+    """
+    try:
+        with np.load(infile) as archive:
+            verts, faces = archive["verts"], archive["faces"]
+    except (OSError, ValueError, KeyError) as e:
+        return None, "error reading %s: %s" %(infile, str(e))
+    if verts.ndim != 2 or verts.shape[1] != 3 or faces.ndim != 2 or faces.shape[1] != 3:
+        return None, "%s must hold (N, 3) 'verts' and (M, 3) 'faces' arrays" %infile
+    if len(faces) > 0 and (faces.min() < 0 or faces.max() >= len(verts)):
+        return None, "%s has face indices out of range" %infile
+    return (verts, faces), None
+
+def writeNpz(outfile, verts, faces):
+    """
+    Writes a mesh in the npz input format. Uncompressed, so it loads at the speed of the disk.
+    :param verts: (N, 3) vertex coordinates
+    :param faces: (M, 3) zero-based vertex indices of each triangle
+    """
+    np.savez(outfile, verts=np.asarray(verts, dtype=np.float64), faces=np.asarray(faces, dtype=np.int32))
+
+# Mesh readers by file extension
+MESH_READERS = {".obj": readObj, ".stl": readStl, ".ply": readPly, ".npz": readNpz}
+
+def readMesh(infile):
+    """
+    Reads a mesh with the reader for its file extension, one of MESH_READERS. Arguments and return values
+    are the same as for readObj.
+    """
+    ext = os.path.splitext(infile)[1].lower()
+    if ext not in MESH_READERS:
+        return None, "unknown mesh format '%s' of %s. Expected one of %s" %(ext, infile, ", ".join(MESH_READERS))
+    return MESH_READERS[ext](infile)
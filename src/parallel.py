@@ -0,0 +1,104 @@
+# Tiled multi-process execution of the mapping engines.
+#
+# The grid is split into ix/iy tiles that are mapped independently in a process pool. Workers write
+# straight into compact indicator arrays backed by shared memory, so nothing but tile bounds travels
+# between processes. Every column is mapped by the same engine code as the serial path, so the output is
+# identical regardless of the number of jobs.
+
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .profiling import Profile
+
+# State inherited (fork) or received (spawn) by each worker through the pool initializer
+_worker = {}
+
+def makeTiles(nx, ny, ntiles):
+    """
+    Splits an nx by ny range of columns into roughly ntiles square tiles.
+    :return: list of (ix0, ix1, iy0, iy1) tuples, upper bounds exclusive
+    """
+    if nx <= 0 or ny <= 0:
+        return []
+    size = max(1, int(math.ceil(math.sqrt(nx * ny / max(1, ntiles)))))
+    tiles = []
+    for ix0 in range(0, nx, size):
+        for iy0 in range(0, ny, size):
+            tiles.append((ix0, min(nx, ix0+size), iy0, min(ny, iy0+size)))
+    return tiles
+
+def _initWorker(ts, tfg, method, names, dtypes, shape):
+    _worker["ts"] = ts
+    _worker["tfg"] = tfg
+    _worker["method"] = getattr(ts, method)
+    _worker["shms"] = [shared_memory.SharedMemory(name=name) for name in names]
+    _worker["arrays"] = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, dtype in zip(_worker["shms"], dtypes)]
+
+def _mapTile(tile):
+    profile = Profile(quiet=True)
+    _worker["method"](_worker["tfg"], *_worker["arrays"], tile=tile, profile=profile)
+    return tile, profile.stats()
+
+def mapTiles(ts, tfg, kind, method, dtypes, jobs, profile=None, tiles=None, onTile=None):
+    """
+    Maps a triangulated surface onto a grid with a pool of worker processes.
+    :param ts: the triangulated surface
+    :param tfg: the terrain-following grid
+    :param kind: 'volume' or 'surface'
+    :param method: name of the TriangulatedSurface engine method, called as method(tfg, *arrays, tile=tile)
+    :param dtypes: dtype of each (nz, ny, nx) array the engine fills
+    :param jobs: number of worker processes
+    :param profile: optional Profile. Worker counters are merged into it as tiles complete
+    :param tiles: optional list of (ix0, ix1, iy0, iy1) tiles to map. Defaults to every column of the
+        grid. Columns outside the tiles are left zero
+    :param onTile: optional callback, called in this process as onTile(tile, arrays) once each tile is
+        done. arrays are the shared indicator arrays, still being filled elsewhere, so the callback must
+        copy out what it keeps
+    :return: list of arrays, one per dtype
+    """
+    shape = (tfg.nz, tfg.ny, tfg.nx)
+    if kind == "volume":
+        nx, ny, nz = tfg.nx, tfg.ny, tfg.nz
+    else:
+        nx, ny, nz = tfg.nx-1, tfg.ny-1, tfg.nz-1
+
+    # Many more tiles than workers, handed out largest first, keeps workers busy when the mesh only
+    # covers part of the grid. Tiles without candidate triangles are all zeros and never leave here.
+    if tiles is None:
+        tiles = makeTiles(nx, ny, 16 * jobs)
+    columns = ts.columnIndex(tfg, kind)
+    costs = [columns.tileCost(tile) for tile in tiles]
+    work = [tile for cost, tile in sorted(zip(costs, tiles), key=lambda ct: -ct[0]) if cost > 0]
+    skipped = [tile for cost, tile in zip(costs, tiles) if cost == 0]
+    if profile is not None:
+        for ix0, ix1, iy0, iy1 in skipped:
+            profile.skipTile((ix1-ix0) * (iy1-iy0), (ix1-ix0) * (iy1-iy0) * nz)
+
+    dtypes = [np.dtype(dtype) for dtype in dtypes]
+    shared = []
+    shms = [shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize)) for dtype in dtypes]
+    try:
+        shared = [np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, dtype in zip(shms, dtypes)]
+        for array in shared:
+            array.fill(0)
+        names = [shm.name for shm in shms]
+        with multiprocessing.Pool(jobs, initializer=_initWorker, initargs=(ts, tfg, method, names, dtypes, shape)) as pool:
+            if onTile is not None:
+                for tile in skipped:
+                    onTile(tile, shared)
+            for tile, stats in pool.imap_unordered(_mapTile, work):
+                if profile is not None:
+                    profile.merge(stats)
+                if onTile is not None:
+                    onTile(tile, shared)
+        # copy out of shared memory so the segments can be released
+        return [array.copy() for array in shared]
+    finally:
+        # views must be gone before the segments close
+        del shared[:]
+        for shm in shms:
+            shm.close()
+            shm.unlink()
@@ -1,8 +1,5 @@
 #!/usr/bin/env python3.4
 
-import sys
-sys.path.append("/modeling/al/bin")
-
 import glob
 import os
 
@@ -0,0 +1,203 @@
+# ParFlow binary (pfb) input and output, without the ParFlow Python package.
+#
+# Mapping engines keep their indicators in compact integer or boolean arrays (one byte per cell), while
+# pfb files store big-endian float64 values. Converting a whole grid at once costs 8 bytes per cell on
+# top of the indicators, so the writer converts one slab of rows at a time instead. Files are
+# byte-for-byte the same as those written by parflow.tools.io.write_pfb, including the optional .dist file.
+#
+# The reader memory-maps the file and copies out only the subgrids that overlap the requested window, so
+# a window of a large DEM costs the pages it covers. Files it cannot lay out, e.g. velocity files whose
+# subgrids reach one cell past the grid, are handed to parflow.tools.io when ParFlow is installed.
+#
+# Layout: a 64 byte header (origin, size, spacing and number of subgrids), then every subgrid as a
+# 36 byte header (lower-left index, size, refinement) followed by its values, x fastest, then y, then z.
+
+import os
+import struct
+from importlib.util import find_spec
+
+import numpy as np
+
+# Upper bound on the float64 buffer used while converting
+SLAB_BYTES = 1 << 24
+
+def subgridLayout(nx, ny, nz, p=1, q=1, r=1):
+    """
+    Splits a grid into p by q by r subgrids the way ParFlow does: every subgrid along an axis gets the same
+    number of cells, and the first (n % parts) subgrids one more.
+    :return: list of (offset, (ix, iy, iz), (sx, sy, sz)) tuples in file order, where offset is the byte
+        offset of the subgrid's first value
+    """
+    def split(n, parts):
+        base, rem = n // parts, n % parts
+        return [(i*base + min(i, rem), base + (1 if i < rem else 0)) for i in range(parts)]
+
+    layout = []
+    offset = 64
+    for iz, sz in split(nz, r):
+        for iy, sy in split(ny, q):
+            for ix, sx in split(nx, p):
+                offset += 36
+                layout.append((offset, (ix, iy, iz), (sx, sy, sz)))
+                offset += 8 * sx * sy * sz
+    return layout
+
+class PfbWriter:
+    def __init__(self, path, nx, ny, nz, x=0.0, y=0.0, z=0.0, dx=1.0, dy=1.0, dz=1.0, p=1, q=1, r=1, dist=True):
+        """
+        Opens a pfb file for writing. Subgrids may be written in any order, each exactly once, before close().
+        :param path: output filename
+        :param nx: number of cells along x. Likewise ny and nz
+        :param x: grid origin. Likewise y and z
+        :param dx: cell size along x. Likewise dy and dz
+        :param p: number of subgrids along x. Likewise q and r
+        :param dist: also write a .dist file listing subgrid offsets
+        """
+        self.path = path
+        self.shape = (nz, ny, nx)
+        self.layout = subgridLayout(nx, ny, nz, p, q, r)
+        self.dist = dist
+        self.f = open(path, "wb")
+        self.f.write(struct.pack(">dddiiidddi", x, y, z, nx, ny, nz, dx, dy, dz, len(self.layout)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def writeSubgrid(self, i, block):
+        """
+        Writes one subgrid.
+        :param i: subgrid number, in file order
+        :param block: (sz, sy, sx) values of the subgrid, any numeric dtype
+        """
+        offset, start, size = self.layout[i]
+        sx, sy, sz = size
+        if block.shape != (sz, sy, sx):
+            raise ValueError("subgrid %d has shape %s, expected %s" %(i, block.shape, (sz, sy, sx)))
+        self.f.seek(offset - 36)
+        self.f.write(struct.pack(">9i", *start, *size, 1, 1, 1))
+
+        # slabs are runs of whole layers, or runs of rows when a single layer exceeds SLAB_BYTES
+        layerBytes = 8 * sx * sy
+        if layerBytes <= SLAB_BYTES:
+            step = SLAB_BYTES // max(1, layerBytes)
+            for k in range(0, sz, step):
+                self.f.write(block[k:k+step].astype(">f8").tobytes())
+        else:
+            step = max(1, SLAB_BYTES // (8 * sx))
+            for k in range(sz):
+                for j in range(0, sy, step):
+                    self.f.write(block[k, j:j+step].astype(">f8").tobytes())
+
+    def writeArray(self, array):
+        """
+        Writes every subgrid of a whole grid.
+        :param array: (nz, ny, nx) values, any numeric dtype
+        """
+        if array.shape != self.shape:
+            raise ValueError("array has shape %s, expected %s" %(array.shape, self.shape))
+        for i, (_, (ix, iy, iz), (sx, sy, sz)) in enumerate(self.layout):
+            self.writeSubgrid(i, array[iz:iz+sz, iy:iy+sy, ix:ix+sx])
+
+    def close(self):
+        if self.f is None:
+            return
+        self.f.close()
+        self.f = None
+        if self.dist:
+            with open(self.path + ".dist", "w") as f:
+                for i, (offset, _, _) in enumerate(self.layout):
+                    f.write("%d\n" %(offset - 100 if i == 0 else offset - 36))
+
+def writePfb(path, array, x=0.0, y=0.0, z=0.0, dx=1.0, dy=1.0, dz=1.0, p=1, q=1, r=1, dist=True):
+    """
+    Writes a (nz, ny, nx) array of any numeric dtype to a pfb file without converting it all at once.
+    Arguments are the same as for PfbWriter.
+    """
+    nz, ny, nx = array.shape
+    with PfbWriter(path, nx, ny, nz, x, y, z, dx, dy, dz, p, q, r, dist) as w:
+        w.writeArray(array)
+
+class PfbLayoutError(ValueError):
+    """
+    Subgrids that do not tile the grid of a pfb file, see readPfb.
+    """
+
+def readPfbHeader(path):
+    """
+    Reads the header and the subgrid headers of a pfb file.
+    :return: dict with the origin (x, y, z), size (nx, ny, nz), spacing (dx, dy, dz) and 'subgrids', a list
+        of (offset, (ix, iy, iz), (sx, sy, sz)) tuples in file order like subgridLayout
+    """
+    size = os.path.getsize(path)
+    if size < 64:
+        raise ValueError("%s is too short to be a pfb file" %path)
+    with open(path, "rb") as f:
+        values = struct.unpack(">dddiiidddi", f.read(64))
+        header = dict(zip(["x", "y", "z", "nx", "ny", "nz", "dx", "dy", "dz"], values[:9]))
+        subgrids = []
+        offset = 64
+        for i in range(values[9]):
+            f.seek(offset)
+            data = f.read(36)
+            if len(data) < 36:
+                raise ValueError("%s is truncated in the header of subgrid %d" %(path, i))
+            ix, iy, iz, sx, sy, sz = struct.unpack(">9i", data)[:6]
+            offset += 36
+            subgrids.append((offset, (ix, iy, iz), (sx, sy, sz)))
+            offset += 8 * sx * sy * sz
+    if offset > size:
+        raise ValueError("%s is truncated: %d bytes, expected %d" %(path, size, offset))
+    header["subgrids"] = subgrids
+    return header
+
+def readPfb(path, window=None, dtype=np.float64):
+    """
+    Reads a pfb file, or a window of its columns.
+    :param path: pfb filename
+    :param window: optional (ix0, ix1, iy0, iy1) columns to read, upper bounds exclusive. Defaults to the
+        whole grid
+    :param dtype: dtype of the returned array. Values are converted subgrid by subgrid, so e.g. indicators
+        read as uint8 never take 8 bytes per cell
+    :return: (nz, ny, nx) array, or (nz, iy1-iy0, ix1-ix0) for a window
+    """
+    try:
+        return readPfbNative(path, window, dtype)
+    except PfbLayoutError:
+        if find_spec("parflow") is None:
+            raise
+    from parflow.tools.io import read_pfb
+    data = read_pfb(path)
+    if window is not None:
+        ix0, ix1, iy0, iy1 = window
+        data = data[:, iy0:iy1, ix0:ix1]
+    return np.ascontiguousarray(data, dtype=dtype)
+
+def readPfbNative(path, window=None, dtype=np.float64):
+    """
+    readPfb without the ParFlow fallback. Raises PfbLayoutError for files whose subgrids do not tile the grid.
+    """
+    header = readPfbHeader(path)
+    nx, ny, nz = header["nx"], header["ny"], header["nz"]
+    ix0, ix1, iy0, iy1 = window if window is not None else (0, nx, 0, ny)
+    if not (0 <= ix0 <= ix1 <= nx and 0 <= iy0 <= iy1 <= ny):
+        raise ValueError("window %s is outside the %d by %d columns of %s" %((ix0, ix1, iy0, iy1), nx, ny, path))
+    data = np.empty((nz, iy1-iy0, ix1-ix0), dtype=dtype)
+    covered = 0
+    raw = np.memmap(path, dtype=np.uint8, mode="r") if header["subgrids"] else None
+    for offset, (sx0, sy0, sz0), (sx, sy, sz) in header["subgrids"]:
+        if sx0 < 0 or sy0 < 0 or sz0 < 0 or sx0+sx > nx or sy0+sy > ny or sz0+sz > nz:
+            raise PfbLayoutError("subgrid at %s of %s is outside the grid" %((sx0, sy0, sz0), path))
+        covered += sx * sy * sz
+        # the part of the subgrid inside the window
+        x0, x1 = max(ix0, sx0), min(ix1, sx0+sx)
+        y0, y1 = max(iy0, sy0), min(iy1, sy0+sy)
+        if x0 >= x1 or y0 >= y1 or sz == 0:
+            continue
+        block = np.ndarray((sz, sy, sx), dtype=">f8", buffer=raw, offset=offset)
+        data[sz0:sz0+sz, y0-iy0:y1-iy0, x0-ix0:x1-ix0] = block[:, y0-sy0:y1-sy0, x0-sx0:x1-sx0]
+    if covered != nx * ny * nz:
+        raise PfbLayoutError("the subgrids of %s cover %d cells, expected %d" %(path, covered, nx * ny * nz))
+    return data
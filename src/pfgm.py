@@ -12,81 +12,161 @@
 # This pattern is not in common Python as other languages, but does force deliberate writing of 
 # error-handling code at the point the function is called. 
 
-import argparse
 import os
-import numpy as np
-from rtree import index
 import sys
-from pfb2vtk import renderVtkGen
-from tfg import TFG
-from parflow.tools.io import write_pfb
+
+# Run as a script (python src/pfgm.py), the module is not part of the src package, so its relative imports
+# would fail. Import it from its package instead
+if not __package__:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+    __package__ = "src"
+
+from .cli import makeParser
+
+# --help and usage errors exit here, before numpy and the engines are imported. getArgs parses again
+if __name__ == "__main__":
+    makeParser().parse_args()
+
+import numpy as np
+
+from .export import FACE_FORMATS, writeApproxFaces
+from .tfg import TFG
+from .parallel import mapTiles
+from .pipeline import mapAndWrite, runConcurrently
+from .profiling import Profile
+from .spatial import INDEX_KINDS, BinnedColumns, RtreeColumns, buildRtree
+from .meshio import MESH_READERS, readMesh, readObj
+from .pfbio import writePfb
+from .vtkio import VTK_FORMATS, writeVolumeVtk
+from . import jit
+
+# Indicators are 0/1, so engines fill one byte per cell. Values are converted to float64 only as
+# they are written out
+INDICATOR_DTYPE = np.uint8
+
+# Mapping engines by kind: CLI name -> TriangulatedSurface method
+ENGINES = {
+    "volume": {"ray": "mapVolumeRays", "column": "mapVolumeColumns", "voxel": "mapVolumeVoxels", "numba": "mapVolumeNumba"},
+    "surface": {"ray": "mapSurfaceRays", "segment": "mapSurfaceSegments", "triangle": "mapSurfaceTriangles",
+                "numba": "mapSurfaceNumba"},
+}
+
+# Columns classified together by the voxel engine. Bounds the (columns, layers) arrays it builds
+VOXEL_CHUNK_COLUMNS = 4096
+
+# (triangle, column, layer) triples tested together by the triangle surface engine. Bounds its arrays
+TRIANGLE_CHUNK_TRIPLES = 1 << 18
+
+def countBelow(rows, rowIds, values):
+    """
+    Row-wise binary search: the number of entries of rows[rowIds[i]] that are less than values[i].
+    :param rows: (R, n) array, sorted along each row
+    :param rowIds: (P,) row of each value
+    :param values: (P,) values to look up
+    :return: (P,) int64 counts
+    """
+    lo = np.zeros(len(values), dtype=np.int64)
+    hi = np.full(len(values), rows.shape[1], dtype=np.int64)
+    active = lo < hi
+    while np.any(active):
+        mid = (lo + hi) // 2
+        less = rows[rowIds, np.minimum(mid, rows.shape[1]-1)] < values
+        lo = np.where(active & less, mid+1, lo)
+        hi = np.where(active & ~less, mid, hi)
+        active = lo < hi
+    return lo
 
 def exitWith(msg):
     print(msg)
     sys.exit(1)
 
-class Progress:
-    def __init__(self, nticks):
-        self.nticks = nticks
-        self.pct = nticks // 100
-        self.tick = 0
-
-    def __del__(self):
-        sys.stdout.write("\n")
-        sys.stdout.flush()
+class TriangulatedSurface():
+    def __init__(self, verts, faces, indexKind=None):
+        """
+        :param verts: (N, 3) vertex coordinates, or anything convertible to that
+        :param faces: (M, 3) zero-based vertex indices of each triangle
+        :param indexKind: how candidate triangles are found for each column, one of INDEX_KINDS.
+            Defaults to 'rtree' when the rtree package is installed and 'bins' otherwise
+        """
+        self.verts = np.ascontiguousarray(verts, dtype=np.float64).reshape(-1, 3)
+        self.faces = np.ascontiguousarray(faces, dtype=np.int32).reshape(-1, 3)
+        self.indexKind = indexKind if indexKind is not None else INDEX_KINDS[0]
+        self.index = None
+        self.columnIndexes = {}
+        # content key of the cache entry this surface was loaded from, see cache.py
+        self.cacheKey = None
+        self.precomputeGeometry()
+        self.zMax = np.max(self.verts[:, 2])
 
-    def inc(self):
-        self.tick += 1
-        if self.tick % self.pct == 0:
-            sys.stdout.write(" %d%%" %(round(100*self.tick/self.nticks)))
-            sys.stdout.flush()
+    def __getstate__(self):
+        # the rtree index does not pickle; worker processes rebuild lookups on first use
+        state = dict(self.__dict__)
+        state["index"] = None
+        state["columnIndexes"] = {}
+        return state
 
-class TriangulatedSurface():
-    def __init__(self, verts, triangles):
-        self.verts = verts
-        self.triangles = triangles
-        self.buildIndex()
-        self.zMax = np.max(np.array(list(map(lambda v: v[2], self.verts))))
+    def precomputeGeometry(self):
+        """
+        Builds the per-triangle arrays used by the intersection kernels: the first vertex (v0), the two
+        edges leaving it (edge1, edge2), and axis-aligned bounding boxes (bboxMin, bboxMax), all (M, 3).
+        """
+        corners = self.verts[self.faces]
+        self.v0 = corners[:, 0, :]
+        self.edge1 = corners[:, 1, :] - self.v0
+        self.edge2 = corners[:, 2, :] - self.v0
+        self.bboxMin = np.min(corners, axis=1)
+        self.bboxMax = np.max(corners, axis=1)
 
     def buildIndex(self):
-        p = index.Property()
-        p.dimension = 2
-        self.index = index.Index(properties=p)
-        for tId, _ in enumerate(self.triangles):
-            v0, v1, v2 = self.verticesFromTriangle(tId)
-            xmin = np.min([v0[0], v1[0], v2[0]])
-            xmax = np.max([v0[0], v1[0], v2[0]])
-            ymin = np.min([v0[1], v1[1], v2[1]])
-            ymax = np.max([v0[1], v1[1], v2[1]])
-            self.index.insert(tId, (xmin, ymin, xmax, ymax))
+        self.index = buildRtree(self.bboxMin, self.bboxMax)
+
+    def columnIndexKey(self, tfg, kind):
+        return (kind, self.indexKind, tfg.x0, tfg.y0, tfg.dx, tfg.dy, tfg.nx, tfg.ny, tfg.ix0, tfg.iy0)
+
+    def columnIndex(self, tfg, kind):
+        """
+        Candidate-triangle lookup for the columns of a grid, built on first use and kept for later calls
+        on grids with the same lateral layout.
+        :param tfg: the terrain-following grid
+        :param kind: 'volume' or 'surface'
+        :return: an RtreeColumns or BinnedColumns, depending on indexKind
+        """
+        key = self.columnIndexKey(tfg, kind)
+        if key not in self.columnIndexes:
+            if self.indexKind == "rtree":
+                if self.index is None:
+                    self.buildIndex()
+                self.columnIndexes[key] = RtreeColumns(self.index, tfg, kind)
+            else:
+                self.columnIndexes[key] = BinnedColumns(self.bboxMin, self.bboxMax, tfg, kind)
+        return self.columnIndexes[key]
 
     @staticmethod
     def fromObj(infile):
         '''
-        Read simple .obj file. Function only reads vertices (v) and faces (f) of order 3 (e.g., triangles)
-        
+        Read an .obj file. Only vertices (v) and faces (f) are read. Faces may be polygons, which are split
+        into triangles, and their indices may be negative or carry texture and normal indices, see meshio.py
+
+        :param: name of input file
+        :return: the triangulated surface or an possible error message if reading failed.
+        '''
+        mesh, err = readObj(infile)
+        if err != None:
+            return None, err
+        return TriangulatedSurface(*mesh), None
+
+    @staticmethod
+    def fromFile(infile):
+        '''
+        Read a mesh in any of the input formats (.obj, .stl, .ply or .npz), picked by file extension
+
         :param: name of input file
         :return: the triangulated surface or an possible error message if reading failed.
         '''
-        verts, triangles = [], []
-        with open(infile, "r") as f:
-            for line_no, line in enumerate(f):
-                if line.startswith("v "):
-                    parts = line.strip().split()
-                    if len(parts) != 4:
-                        return None, "encountered vertex with more than three values defined on line %d" %(line_no+1)
-                    x, y, z = map(float, parts[1:])
-                    verts.append(np.array([x, y, z]))
-                if line.startswith("f "):
-                    parts = line.strip().split()
-                    if len(parts) != 4:
-                        return None, "encountered face with more than three vertices defined on line %d" %(line_no+1)
-                    try:
-                        p1, p2, p3 = map(lambda n: int(n) - 1, parts[1:])
-                    except ValueError as e:
-                        return None, str(e) + ", line %d of %s" %(line_no, infile) 
-                    triangles.append([p1, p2, p3])
-        return TriangulatedSurface(verts, triangles), None
+        mesh, err = readMesh(infile)
+        if err != None:
+            return None, err
+        return TriangulatedSurface(*mesh), None
     
     def verticesFromTriangle(self, tId):
         """
@@ -94,7 +174,7 @@ class TriangulatedSurface():
         :param tId: index of triangle of interest
         :return: three vertices, each a size three numpy array
         """
-        p0, p1, p2 = self.triangles[tId]
+        p0, p1, p2 = self.faces[tId]
         v0 = self.verts[p0]
         v1 = self.verts[p1]
         v2 = self.verts[p2]
@@ -104,210 +184,880 @@ class TriangulatedSurface():
         """
         Determines if a line segment intersects a triangle. 
         """
-        EPSILON = 0.0000001
         if rayEnd is None:
             rayEnd = np.array([rayOrigin[0], rayOrigin[1], self.zMax+1])
-        rayVector = rayEnd - rayOrigin
-        v0, v1, v2 = self.verticesFromTriangle(tId)
-        edge1 = v1 - v0
-        edge2 = v2 - v0
-        h = np.cross(rayVector, edge2)
-        a = np.dot(edge1, h)
-        if a > -EPSILON and a < EPSILON:
-            return False
-        
-        f = 1.0/a
-        s = rayOrigin - v0
-        u = f * np.dot(s, h)
-        if u < 0.0 or u > 1.0:
-            return False
-        
-        q = np.cross(s, edge1)
-        v = f * np.dot(rayVector, q)
-        if v < 0.0 or u + v > 1.0:
-            return False
-        
-        t = f * np.dot(edge2, q)
-
-        if t <= EPSILON:
-            return False
-        
-        # At this point, the ray intersects. Now, we must determine if the potentional
-        # point of intersection actually lies on the line between rayOrigin and rayEnd
-        potentialP = rayOrigin + rayVector*t
-        K_AC = rayVector.dot(rayEnd - potentialP)
-        K_AB = rayVector.dot(rayVector)
-        if K_AC < 0 or K_AC > K_AB:
-            return False
-        
-        return True
-        
+        return bool(self.segmentsIntersect(rayOrigin, rayEnd, np.array([tId]))[0])
+
+    def segmentsIntersect(self, origins, ends, tIds):
+        """
+        Batched Möller-Trumbore test of line segments against triangles, using the precomputed
+        triangle geometry.
+        :param origins: segment start points, (3,) for one segment or (S, 3) for many
+        :param ends: segment end points, same shape as origins
+        :param tIds: (T,) ids of the triangles to test
+        :return: boolean array, (T,) for one segment or (S, T) for many. True where the segment
+            intersects the triangle
+        """
+        origins = np.asarray(origins, dtype=np.float64)
+        ends = np.asarray(ends, dtype=np.float64)
+        single = origins.ndim == 1
+        hit = self.segmentTriangleTest(origins.reshape(-1, 1, 3), ends.reshape(-1, 1, 3), tIds)
+        return hit[0] if single else hit
+
+    def segmentPairsIntersect(self, origins, ends, tIds):
+        """
+        Pairwise version of segmentsIntersect: tests segment i against triangle tIds[i].
+        :param origins: (P, 3) segment start points
+        :param ends: (P, 3) segment end points
+        :param tIds: (P,) triangle ids
+        :return: (P,) boolean array, True where the segment intersects its triangle
+        """
+        return self.segmentTriangleTest(np.asarray(origins, dtype=np.float64), np.asarray(ends, dtype=np.float64), tIds)
+
+    def segmentTriangleTest(self, origins, ends, tIds):
+        """
+        The Möller-Trumbore test behind segmentsIntersect and segmentPairsIntersect. The coordinates
+        origins[..., i] and ends[..., i] broadcast against the (T,) triangle arrays.
+        """
+        EPSILON = 0.0000001
+        ox, oy, oz = origins[..., 0], origins[..., 1], origins[..., 2]
+        ex, ey, ez = ends[..., 0], ends[..., 1], ends[..., 2]
+        rx, ry, rz = ex - ox, ey - oy, ez - oz
+        v0, edge1, edge2 = self.v0[tIds], self.edge1[tIds], self.edge2[tIds]
+        e1x, e1y, e1z = edge1[:, 0], edge1[:, 1], edge1[:, 2]
+        e2x, e2y, e2z = edge2[:, 0], edge2[:, 1], edge2[:, 2]
+
+        # h = rayVector x edge2
+        hx = ry*e2z - rz*e2y
+        hy = rz*e2x - rx*e2z
+        hz = rx*e2y - ry*e2x
+        a = e1x*hx + e1y*hy + e1z*hz
+        hit = (a <= -EPSILON) | (a >= EPSILON)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            f = 1.0/a
+            sx, sy, sz = ox - v0[:, 0], oy - v0[:, 1], oz - v0[:, 2]
+            u = f * (sx*hx + sy*hy + sz*hz)
+            hit &= (u >= 0.0) & (u <= 1.0)
+            # q = s x edge1
+            qx = sy*e1z - sz*e1y
+            qy = sz*e1x - sx*e1z
+            qz = sx*e1y - sy*e1x
+            v = f * (rx*qx + ry*qy + rz*qz)
+            hit &= (v >= 0.0) & (u + v <= 1.0)
+            t = f * (e2x*qx + e2y*qy + e2z*qz)
+            hit &= t > EPSILON
+
+            # At this point, the ray intersects. Now, we must determine if the potentional
+            # point of intersection actually lies on the line between rayOrigin and rayEnd
+            K_AC = rx*(ex - (ox + rx*t)) + ry*(ey - (oy + ry*t)) + rz*(ez - (oz + rz*t))
+            K_AB = rx*rx + ry*ry + rz*rz
+            hit &= (K_AC >= 0) & (K_AC <= K_AB)
+        return hit
+
     @staticmethod
     def writeApproxObj(tfg, indi_x, indi_y, indi_z, outfile):
-        f = open(outfile, "w")
-        nFaces = 0
-        for ix in range(0, tfg.nx):
-            for iy in range(0, tfg.ny):
-                for iz in range(0, tfg.nz):
-                    xmin, xmax = tfg.xMin(ix), tfg.xMax(ix)
-                    ymin, ymax = tfg.yMin(iy), tfg.yMax(iy)
-                    zmin, zmax = tfg.zMin(ix, iy, iz), tfg.zMax(ix, iy, iz)
-                    if indi_x[iz][iy][ix] == 1:
-                        f.write("v %f %f %f\n" %(xmax, ymin, zmin))
-                        f.write("v %f %f %f\n" %(xmax, ymin, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymax, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymax, zmin))
-                        nFaces += 1
-                    if indi_y[iz][iy][ix] == 1:
-                        f.write("v %f %f %f\n" %(xmin, ymax, zmin))
-                        f.write("v %f %f %f\n" %(xmin, ymax, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymax, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymax, zmin))
-                        nFaces += 1
-                    if indi_z[iz][iy][ix] == 1:
-                        f.write("v %f %f %f\n" %(xmin, ymin, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymin, zmax))
-                        f.write("v %f %f %f\n" %(xmax, ymax, zmax))
-                        f.write("v %f %f %f\n" %(xmin, ymax, zmax))
-                        nFaces += 1
-        for i in range(0, nFaces):
-            n = i*4
-            f.write("f %d %d %d %d\n" %(n+1, n+2, n+3, n+4))
-        
-    def processVolume(self, tfg, output_root):
-        indi = np.zeros([tfg.nz, tfg.ny, tfg.nx])
-        ncells = tfg.nx * tfg.ny * tfg.nz
-        print("Processing volume for %s. %d cells. %d faces" %(output_root, ncells, len(self.index)))
-        bump = tfg.dx * 0.1
-        progress = Progress(ncells)
-        for ix in range(0, tfg.nx):
-            for iy in range(0, tfg.ny):
-                x, y = tfg.xMid(ix), tfg.yMid(iy)
-                tIds = list(self.index.intersection((x, y, x+bump, y+bump)))
+        writeApproxFaces(tfg, indi_x, indi_y, indi_z, outfile, "obj")
+
+    def columnCrossings(self, x, y, tIds):
+        """
+        Intersects the vertical line through (x, y) with candidate triangles in a single pass. This is
+        the Möller-Trumbore test with the ray direction fixed to +z, so each triangle is tested once per
+        column instead of once per cell.
+        :param x: x-coordinate of the column
+        :param y: y-coordinate of the column
+        :param tIds: ids of candidate triangles
+        :return: crossing elevations (sorted), the matching |determinant| for a unit-length ray and the
+            ids of the crossed triangles
+        """
+        if len(tIds) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0, dtype=np.int64)
+        z, absDets, hit = self.verticalCrossings(x, y, tIds)
+        order = np.argsort(z[hit])
+        return z[hit][order], absDets[hit][order], np.asarray(tIds)[hit][order]
+
+    def verticalCrossings(self, xs, ys, tIds):
+        """
+        Pairwise version of columnCrossings: intersects the vertical line through (xs[i], ys[i]) with
+        triangle tIds[i]. Scalar xs and ys test one column against every triangle.
+        :return: crossing elevations, the matching |determinant| for a unit-length ray, and a boolean
+            array that is True where the line crosses the triangle. The first two are only meaningful there
+        """
+        v0, edge1, edge2 = self.v0[tIds], self.edge1[tIds], self.edge2[tIds]
+        # h = (0, 0, 1) x edge2
+        hx, hy = -edge2[:, 1], edge2[:, 0]
+        a = edge1[:, 0]*hx + edge1[:, 1]*hy
+        hit = np.abs(a) > 0
+        a = np.where(hit, a, 1.0)
+        f = 1.0/a
+        sx, sy, sz = xs - v0[:, 0], ys - v0[:, 1], -v0[:, 2]
+        u = f * (sx*hx + sy*hy)
+        hit &= (u >= 0.0) & (u <= 1.0)
+        # q = s x edge1
+        qx = sy*edge1[:, 2] - sz*edge1[:, 1]
+        qy = sz*edge1[:, 0] - sx*edge1[:, 2]
+        qz = sx*edge1[:, 1] - sy*edge1[:, 0]
+        v = f * qz
+        hit &= (v >= 0.0) & (u + v <= 1.0)
+        z = f * (edge2[:, 0]*qx + edge2[:, 1]*qy + edge2[:, 2]*qz)
+        return z, np.abs(a), hit
+
+    def classifyColumn(self, zCrossings, absDets, zMids, zMax=None):
+        """
+        Classifies every cell center of a column by the parity of crossings above it. A crossing counts
+        for a cell exactly when rayIntersectsTriangle would count it for a ray cast from that cell center
+        to zMax+1 (t > EPSILON and |determinant| >= EPSILON for a ray of length zMax+1-z).
+        :param zCrossings: sorted crossing elevations from columnCrossings
+        :param absDets: |determinant| of each crossing for a unit-length ray
+        :param zMids: cell center elevations of the column
+        :param zMax: top of the geometry the crossings belong to. Defaults to the top of this surface
+        :return: boolean array, True where a cell center is inside the geometry
+        """
+        EPSILON = 0.0000001
+        if zMax is None:
+            zMax = self.zMax
+        rayLength = zMax + 1 - zMids
+        threshold = zMids + EPSILON*rayLength
+        regular = absDets >= EPSILON
+        zRegular = zCrossings[regular]
+        above = len(zRegular) - np.searchsorted(zRegular, threshold, side="right")
+        if not np.all(regular):
+            # near-vertical triangles only count for rays long enough to lift the determinant past EPSILON
+            zMarginal, dMarginal = zCrossings[~regular], absDets[~regular]
+            counted = (zMarginal > threshold[:, None]) & (dMarginal*rayLength[:, None] >= EPSILON)
+            above += np.sum(counted, axis=1)
+        return (above % 2 != 0) & (zMids <= zMax)
+
+    def mapVolumeRays(self, tfg, indi, tile, profile=None):
+        """
+        Volume mapping with one ray cast per cell center.
+        :param tfg: the terrain-following grid
+        :param indi: (nz, ny, nx) indicator array, filled in place
+        :param tile: (ix0, ix1, iy0, iy1) range of columns to map, upper bounds exclusive
+        :param profile: optional Profile counting cells, candidates and ray-triangle tests
+        """
+        ix0, ix1, iy0, iy1 = tile
+        columns = self.columnIndex(tfg, "volume")
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                x, y = tfg.x_mid[ix], tfg.y_mid[iy]
+                tIds = columns.candidates(ix, iy)
+                rayEnd = np.array([x, y, self.zMax+1])
+                zMids = tfg.zMidColumn(ix, iy)
                 for iz in range(0, tfg.nz):
-                    z = tfg.zMid(ix, iy, iz)
+                    z = zMids[iz]
                     if z > self.zMax:
-                        progress.inc()
                         continue
 
-                    intersections = 0
-                    for tId in tIds:
-                        if self.rayIntersectsTriangle(np.array([x, y, z]), tId):
-                            intersections += 1
+                    intersections = np.count_nonzero(self.segmentsIntersect(np.array([x, y, z]), rayEnd, tIds))
                     if intersections % 2 != 0:
                         indi[iz][iy][ix] = 1
-                    progress.inc()
+                if profile is not None:
+                    profile.column(len(tIds), tfg.nz, len(tIds) * np.count_nonzero(zMids <= self.zMax))
 
-        pfbPath = "%s.pfb" %output_root
-        write_pfb(pfbPath, indi, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
-        renderVtkGen(pfbPath, "%s.vtk" %output_root, tfg.demPfb, tfg.dzs, "%s.gen_vtk.tcl" %output_root)
+    def mapVolumeColumns(self, tfg, indi, tile, profile=None):
+        """
+        Volume mapping with one crossing pass per (ix, iy) column. Produces the same indicators as
+        mapVolumeRays. Arguments are the same as for mapVolumeRays.
+        """
+        ix0, ix1, iy0, iy1 = tile
+        columns = self.columnIndex(tfg, "volume")
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                x, y = tfg.x_mid[ix], tfg.y_mid[iy]
+                tIds = columns.candidates(ix, iy)
+                zCrossings, absDets, _ = self.columnCrossings(x, y, tIds)
+                if len(zCrossings) > 0:
+                    inside = self.classifyColumn(zCrossings, absDets, tfg.zMidColumn(ix, iy))
+                    indi[inside, iy, ix] = 1
+                if profile is not None:
+                    profile.column(len(tIds), tfg.nz, len(tIds))
 
-    def processSurface(self, tfg, output_root):
-        indi_x = np.zeros([tfg.nz, tfg.ny, tfg.nx])
-        indi_y = np.zeros([tfg.nz, tfg.ny, tfg.nx])
-        indi_z = np.zeros([tfg.nz, tfg.ny, tfg.nx])
-        ncells = tfg.nx * tfg.ny * tfg.nz
-        print("Processing volume for %s. %d cells. %d faces" %(output_root, ncells, len(self.index)))
-        progress = Progress((tfg.nx-1) * (tfg.ny-1) * (tfg.nz-1))
-        for ix in range(0, tfg.nx-1):
-            for iy in range(0, tfg.ny-1):
-                x0, xf = tfg.xMid(ix), tfg.xMid(ix+1)
-                y0, yf = tfg.yMid(iy), tfg.yMid(iy+1)
-                tIds = list(self.index.intersection((x0, y0, xf, yf)))
+    def mapVolumeVoxels(self, tfg, indi, tile, profile=None):
+        """
+        Volume mapping driven by the triangles rather than the cells. Each candidate triangle of the tile
+        is crossed with the vertical lines through the column centers its bounding box covers. Every
+        crossing toggles the parity of the layers below it, and a cumulative sum along z turns the toggles
+        into indicators. Columns outside the mesh footprint and layers above zMax or below the lowest
+        crossing are not visited. Produces the same indicators as mapVolumeRays. Arguments are the same as
+        for mapVolumeRays.
+        """
+        EPSILON = 0.0000001
+        TOLERANCE = 1e-9
+        ix0, ix1, iy0, iy1 = tile
+        if ix0 >= ix1 or iy0 >= iy1:
+            return
+        tileNy = iy1 - iy0
+        tIds = self.columnIndex(tfg, "volume").tileCandidates(tile)
+
+        # expand every triangle into the columns of the tile whose center its bounding box covers
+        cx0 = np.ceil((self.bboxMin[tIds, 0] - tfg.x_mid[0]) / tfg.dx - TOLERANCE).astype(np.int64)
+        cx1 = np.floor((self.bboxMax[tIds, 0] - tfg.x_mid[0]) / tfg.dx + TOLERANCE).astype(np.int64)
+        cy0 = np.ceil((self.bboxMin[tIds, 1] - tfg.y_mid[0]) / tfg.dy - TOLERANCE).astype(np.int64)
+        cy1 = np.floor((self.bboxMax[tIds, 1] - tfg.y_mid[0]) / tfg.dy + TOLERANCE).astype(np.int64)
+        cx0, cx1 = np.maximum(cx0, ix0), np.minimum(cx1, ix1-1)
+        cy0, cy1 = np.maximum(cy0, iy0), np.minimum(cy1, iy1-1)
+        keep = (cx0 <= cx1) & (cy0 <= cy1)
+        tIds, cx0, cx1, cy0, cy1 = tIds[keep], cx0[keep], cx1[keep], cy0[keep], cy1[keep]
+        heights = cy1 - cy0 + 1
+        counts = (cx1 - cx0 + 1) * heights
+        owner = np.repeat(np.arange(len(tIds)), counts)
+        local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pix = cx0[owner] + local // heights[owner]
+        piy = cy0[owner] + local % heights[owner]
+        column = (pix - ix0)*tileNy + piy - iy0
+        if profile is not None:
+            profile.columns(np.bincount(column, minlength=(ix1-ix0)*tileNy), tfg.nz, len(column))
+
+        z, absDets, hit = self.verticalCrossings(tfg.x_mid[pix], tfg.y_mid[piy], tIds[owner])
+        column, z, absDets = column[hit], z[hit], absDets[hit]
+
+        # near-vertical triangles only count for some layers (see classifyColumn), so their few columns
+        # are classified one at a time
+        marginal = np.zeros((ix1-ix0)*tileNy, dtype=bool)
+        marginal[column[absDets < EPSILON]] = True
+        for c in np.nonzero(marginal)[0]:
+            ix, iy = ix0 + c // tileNy, iy0 + c % tileNy
+            mine = column == c
+            order = np.argsort(z[mine])
+            inside = self.classifyColumn(z[mine][order], absDets[mine][order], tfg.zMidColumn(ix, iy))
+            indi[inside, iy, ix] = 1
+
+        regular = ~marginal[column]
+        column, z = column[regular], z[regular]
+        order = np.argsort(column, kind="stable")
+        column, z = column[order], z[order]
+        cols, first = np.unique(column, return_index=True)
+        bounds = np.append(first, len(column))
+        for c0 in range(0, len(cols), VOXEL_CHUNK_COLUMNS):
+            c1 = min(len(cols), c0 + VOXEL_CHUNK_COLUMNS)
+            owner = np.repeat(np.arange(c1-c0), np.diff(bounds[c0:c1+1]))
+            self.fillParity(tfg, indi, ix0 + cols[c0:c1] // tileNy, iy0 + cols[c0:c1] % tileNy, owner,
+                            z[bounds[c0]:bounds[c1]])
+
+    def fillParity(self, tfg, indi, ixs, iys, owner, zCrossings):
+        """
+        Sets the indicators of whole columns from their crossings with the parity rule of classifyColumn,
+        for crossings whose |determinant| is at least EPSILON. Only the window of layers between the
+        lowest crossing and zMax is built; the layers below it take the parity of all crossings.
+        :param tfg: the terrain-following grid
+        :param indi: (nz, ny, nx) indicator array, filled in place
+        :param ixs: (C,) x-indices of the columns. Likewise iys
+        :param owner: (P,) position in ixs of the column of each crossing
+        :param zCrossings: (P,) crossing elevations
+        """
+        EPSILON = 0.0000001
+        zLo = np.min(zCrossings)
+        dem = tfg.dem[0][iys, ixs]
+        # cell centers relative to the DEM, increasing with iz, give a first guess of the window, which is
+        # then widened until it holds with the exact arithmetic of classifyColumn
+        offsets = tfg.dzArray/2.0 - tfg.zBottoms
+        threshold = lambda zMids: zMids + EPSILON*(self.zMax + 1 - zMids)
+        izLo = max(0, int(np.searchsorted(offsets, zLo - np.max(dem), side="left")) - 1)
+        while izLo > 0 and not np.all(threshold(tfg.zMidCells(ixs, iys, izLo-1)) < zLo):
+            izLo -= 1
+        izHi = min(tfg.nz, int(np.searchsorted(offsets, self.zMax - np.min(dem), side="right")) + 1)
+        while izHi < tfg.nz and np.any(tfg.zMidCells(ixs, iys, izHi) <= self.zMax):
+            izHi += 1
+        izLo = min(izLo, izHi)
+
+        # every crossing counts for the layers whose threshold is below it, i.e. toggles the parity of
+        # layers izLo .. izLo+k-1. Layers below izLo see all crossings, layers from izHi up are above zMax
+        n = izHi - izLo
+        zMids = tfg.zMidCells(ixs[:, None], iys[:, None], np.arange(izLo, izHi)[None, :])
+        k = countBelow(threshold(zMids), owner, zCrossings)
+        toggles = np.bincount(owner*(n+1) + k, minlength=len(ixs)*(n+1)).reshape(len(ixs), n+1)
+        above = np.cumsum(toggles[:, ::-1], axis=1)[:, ::-1]
+        indi[izLo:izHi, iys, ixs] = ((above[:, 1:] % 2 != 0) & (zMids <= self.zMax)).T
+        odd = above[:, 0] % 2 != 0
+        if izLo > 0 and np.any(odd):
+            indi[:izLo, iys[odd], ixs[odd]] = 1
+
+    def jitArgs(self, tfg):
+        """
+        :return: the grid and geometry arrays the compiled kernels take, see jit.py
+        """
+        dem = np.ascontiguousarray(tfg.dem[0], dtype=np.float64)
+        return (tfg.x_mid, tfg.y_mid, dem, tfg.zBottoms, tfg.dzArray, self.v0, self.edge1, self.edge2,
+                float(self.zMax))
+
+    def mapVolumeNumba(self, tfg, indi, tile, profile=None):
+        """
+        Volume mapping with the per-column loop of mapVolumeColumns compiled by numba (see jit.py).
+        Falls back to mapVolumeColumns when numba is not installed. Produces the same indicators as
+        mapVolumeRays. Arguments are the same as for mapVolumeRays.
+        """
+        if not jit.NUMBA:
+            return self.mapVolumeColumns(tfg, indi, tile, profile)
+        ix0, ix1, iy0, iy1 = tile
+        if ix0 >= ix1 or iy0 >= iy1:
+            return
+        jit.compileKernels()
+        offsets, ids = self.columnIndex(tfg, "volume").tileCsr(tile)
+        args = self.jitArgs(tfg)
+        # one row of columns per call, so the ticker moves
+        for ix in range(ix0, ix1):
+            jit.volumeColumns(indi, ix, ix+1, tile, offsets, ids, *args)
+            if profile is not None:
+                ncand = np.diff(offsets[(ix-ix0)*(iy1-iy0):(ix-ix0+1)*(iy1-iy0)+1])
+                profile.columns(ncand, tfg.nz, int(np.sum(ncand)))
+
+    def mapSurfaceRays(self, tfg, indi_x, indi_y, indi_z, tile, profile=None):
+        """
+        Surface mapping with one segment cast from each cell center to its x, y and z neighbors.
+        :param tfg: the terrain-following grid
+        :param indi_x: (nz, ny, nx) x-direction indicator array, filled in place. Likewise indi_y and indi_z
+        :param tile: (ix0, ix1, iy0, iy1) range of columns to map, at most (0, nx-1, 0, ny-1)
+        :param profile: optional Profile counting cell pairs, candidates and ray-triangle tests
+        """
+        ix0, ix1, iy0, iy1 = tile
+        columns = self.columnIndex(tfg, "surface")
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                tIds = columns.candidates(ix, iy)
+                x, xf = tfg.x_mid[ix], tfg.x_mid[ix+1]
+                y, yf = tfg.y_mid[iy], tfg.y_mid[iy+1]
+                zMids = tfg.zMidColumn(ix, iy)
+                zMidsX, zMidsY = tfg.zMidColumn(ix+1, iy), tfg.zMidColumn(ix, iy+1)
                 for iz in range(0, tfg.nz-1):
-                    z = tfg.zMid(ix, iy, iz)
+                    z = zMids[iz]
                     if z > self.zMax:
-                        progress.inc()
                         continue
 
+                    rayOrigin = np.array([x, y, z])
+
                     # Surface intersections in x-direction
-                    intersections = 0
-                    for tId in tIds:
-                        rayOrigin = np.array(tfg.cellCenter(ix, iy, iz))
-                        rayEnd = np.array(tfg.cellCenter(ix+1, iy, iz))
-                        if self.rayIntersectsTriangle(rayOrigin, tId, rayEnd=rayEnd):
-                            intersections += 1
+                    rayEnd = np.array([xf, y, zMidsX[iz]])
+                    intersections = np.count_nonzero(self.segmentsIntersect(rayOrigin, rayEnd, tIds))
                     if intersections % 2 != 0:
                         indi_x[iz][iy][ix] = 1
 
                     # Surface intersections in y-direction
-                    intersections = 0
-                    for tId in tIds:
-                        rayOrigin = np.array(tfg.cellCenter(ix, iy, iz))
-                        rayEnd = np.array(tfg.cellCenter(ix, iy+1, iz))
-                        if self.rayIntersectsTriangle(rayOrigin, tId, rayEnd=rayEnd):
-                            intersections += 1
+                    rayEnd = np.array([x, yf, zMidsY[iz]])
+                    intersections = np.count_nonzero(self.segmentsIntersect(rayOrigin, rayEnd, tIds))
                     if intersections % 2 != 0:
                         indi_y[iz][iy][ix] = 1
 
                     # Surface intersections in z-direction
-                    intersections = 0
-                    for tId in tIds:
-                        rayOrigin = np.array(tfg.cellCenter(ix, iy, iz))
-                        rayEnd = np.array(tfg.cellCenter(ix, iy, iz+1))
-                        if self.rayIntersectsTriangle(rayOrigin, tId, rayEnd=rayEnd):
-                            intersections += 1
+                    rayEnd = np.array([x, y, zMids[iz+1]])
+                    intersections = np.count_nonzero(self.segmentsIntersect(rayOrigin, rayEnd, tIds))
                     if intersections % 2 != 0:
                         indi_z[iz][iy][ix] = 1
+                if profile is not None:
+                    nLayers = np.count_nonzero(zMids[:tfg.nz-1] <= self.zMax)
+                    profile.column(len(tIds), tfg.nz-1, 3 * nLayers * len(tIds))
+
+    def mapSurfaceSegments(self, tfg, indi_x, indi_y, indi_z, tile, profile=None):
+        """
+        Surface mapping that builds the x, y and z neighbor segments of every layer of a column as arrays
+        and tests them against the column's candidate triangles in one batched pass. Produces the same
+        indicators as mapSurfaceRays. Arguments are the same as for mapSurfaceRays.
+        """
+        ix0, ix1, iy0, iy1 = tile
+        columns = self.columnIndex(tfg, "surface")
+        nz = tfg.nz - 1
+        for ix in range(ix0, ix1):
+            for iy in range(iy0, iy1):
+                tIds = columns.candidates(ix, iy)
+                if len(tIds) == 0:
+                    if profile is not None:
+                        profile.column(0, nz, 0)
+                    continue
+
+                x, xf = tfg.x_mid[ix], tfg.x_mid[ix+1]
+                y, yf = tfg.y_mid[iy], tfg.y_mid[iy+1]
+                zMids = tfg.zMidColumn(ix, iy)
+                layers = np.nonzero(zMids[:nz] <= self.zMax)[0]
+                n = len(layers)
+                z = zMids[layers]
+
+                origins = np.empty((3*n, 3))
+                origins[:, 0], origins[:, 1], origins[:, 2] = x, y, np.tile(z, 3)
+                ends = origins.copy()
+                ends[:n, 0], ends[:n, 2] = xf, tfg.zMidColumn(ix+1, iy)[layers]
+                ends[n:2*n, 1], ends[n:2*n, 2] = yf, tfg.zMidColumn(ix, iy+1)[layers]
+                ends[2*n:, 2] = zMids[layers+1]
+
+                crossed = np.count_nonzero(self.segmentsIntersect(origins, ends, tIds), axis=1) % 2 != 0
+                indi_x[layers[crossed[:n]], iy, ix] = 1
+                indi_y[layers[crossed[n:2*n]], iy, ix] = 1
+                indi_z[layers[crossed[2*n:]], iy, ix] = 1
+                if profile is not None:
+                    profile.column(len(tIds), nz, 3 * n * len(tIds))
+
+    def mapSurfaceTriangles(self, tfg, indi_x, indi_y, indi_z, tile, profile=None):
+        """
+        Surface mapping driven by the triangles rather than the cell pairs. Each candidate triangle of the
+        tile is expanded into the lattice columns its xy bounding box covers and, within each column, into
+        the layers whose x, y and z neighbor segments can reach its z range. Only those segments are
+        tested, pairwise, and the indicators of segments crossed an odd number of times are set. The cost
+        follows the area of the surface rather than the volume of the grid. Produces the same indicators
+        as mapSurfaceRays. Arguments are the same as for mapSurfaceRays.
+        """
+        TOLERANCE = 1e-9
+        ix0, ix1, iy0, iy1 = tile
+        if ix0 >= ix1 or iy0 >= iy1:
+            return
+        nz, tileNy = tfg.nz - 1, iy1 - iy0
+        tIds = self.columnIndex(tfg, "surface").tileCandidates(tile)
+
+        # expand every triangle into the lattice columns of the tile its bounding box touches. Lattice
+        # column ix spans the cell centers ix and ix+1, as in BinnedColumns
+        cx0 = np.ceil((self.bboxMin[tIds, 0] - tfg.x_mid[0]) / tfg.dx - TOLERANCE).astype(np.int64) - 1
+        cx1 = np.floor((self.bboxMax[tIds, 0] - tfg.x_mid[0]) / tfg.dx + TOLERANCE).astype(np.int64)
+        cy0 = np.ceil((self.bboxMin[tIds, 1] - tfg.y_mid[0]) / tfg.dy - TOLERANCE).astype(np.int64) - 1
+        cy1 = np.floor((self.bboxMax[tIds, 1] - tfg.y_mid[0]) / tfg.dy + TOLERANCE).astype(np.int64)
+        cx0, cx1 = np.maximum(cx0, ix0), np.minimum(cx1, ix1-1)
+        cy0, cy1 = np.maximum(cy0, iy0), np.minimum(cy1, iy1-1)
+        keep = (cx0 <= cx1) & (cy0 <= cy1)
+        tIds, cx0, cx1, cy0, cy1 = tIds[keep], cx0[keep], cx1[keep], cy0[keep], cy1[keep]
+        heights = cy1 - cy0 + 1
+        counts = (cx1 - cx0 + 1) * heights
+        owner = np.repeat(np.arange(len(tIds)), counts)
+        local = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pix = cx0[owner] + local // heights[owner]
+        piy = cy0[owner] + local % heights[owner]
+        pIds = tIds[owner]
+        pix, piy, pIds, zLo, zHi = self.latticeOverlap(tfg, pix, piy, pIds)
+
+        # layers whose segments can reach the triangle within the column. Cell centers relative to the DEM
+        # give the window, widened by one layer on each side for rounding; the segments are tested exactly
+        offsets = tfg.dzArray/2.0 - tfg.zBottoms
+        dems = np.stack([tfg.dem[0][piy, pix], tfg.dem[0][piy, pix+1], tfg.dem[0][piy+1, pix]])
+        izLo = np.searchsorted(offsets, zLo - np.max(dems, axis=0), side="left") - 2
+        izHi = np.searchsorted(offsets, zHi - np.min(dems, axis=0), side="right")
+        izLo, izHi = np.maximum(izLo, 0), np.minimum(izHi, nz-1)
+        layers = np.maximum(izHi - izLo + 1, 0)
+        if profile is not None:
+            column = (pix - ix0)*tileNy + piy - iy0
+            profile.columns(np.bincount(column, minlength=(ix1-ix0)*tileNy), nz, 3 * int(np.sum(layers)))
+
+        # test the triples in chunks of whole (triangle, column) pairs and count the crossings of each segment
+        ends = np.cumsum(layers)
+        bounds = np.searchsorted(ends, np.arange(TRIANGLE_CHUNK_TRIPLES, ends[-1] if len(ends) else 0,
+                                                 TRIANGLE_CHUNK_TRIPLES), side="left")
+        bounds = np.concatenate([[0], bounds, [len(layers)]])
+        crossed = [[], [], []]
+        for p0, p1 in zip(bounds[:-1], bounds[1:]):
+            n = layers[p0:p1]
+            pair = np.repeat(np.arange(p0, p1), n)
+            iz = izLo[pair] + np.arange(len(pair)) - np.repeat(np.cumsum(n) - n, n)
+            cix, ciy = pix[pair], piy[pair]
+            z = tfg.zMidCells(cix, ciy, iz)
+            below = z <= self.zMax
+            pair, iz, cix, ciy, z = pair[below], iz[below], cix[below], ciy[below], z[below]
+            origins = np.column_stack([tfg.x_mid[cix], tfg.y_mid[ciy], z])
+            segmentEnds = [np.column_stack([tfg.x_mid[cix+1], tfg.y_mid[ciy], tfg.zMidCells(cix+1, ciy, iz)]),
+                           np.column_stack([tfg.x_mid[cix], tfg.y_mid[ciy+1], tfg.zMidCells(cix, ciy+1, iz)]),
+                           np.column_stack([tfg.x_mid[cix], tfg.y_mid[ciy], tfg.zMidCells(cix, ciy, iz+1)])]
+            for dim, segmentEnd in enumerate(segmentEnds):
+                hit = self.segmentPairsIntersect(origins, segmentEnd, pIds[pair])
+                crossed[dim].append((iz[hit]*tfg.ny + ciy[hit])*tfg.nx + cix[hit])
+
+        for indi, cells in zip([indi_x, indi_y, indi_z], crossed):
+            cells, hits = np.unique(np.concatenate(cells + [np.zeros(0, dtype=np.int64)]), return_counts=True)
+            cells = cells[hits % 2 != 0]
+            indi[cells // (tfg.ny*tfg.nx), cells // tfg.nx % tfg.ny, cells % tfg.nx] = 1
+
+    def latticeOverlap(self, tfg, pix, piy, pIds):
+        """
+        Narrows (lattice column, triangle) pairs for mapSurfaceTriangles. Drops the pairs whose triangle
+        misses the column's rectangle [xMid(ix), xMid(ix+1)] by [yMid(iy), yMid(iy+1)] in plan view, and
+        bounds the elevations of the rest by the triangle's plane over the rectangle. The rectangle is
+        widened by a small margin, so no pair whose segments can cross the triangle is lost. The elevations
+        are approximate; mapSurfaceTriangles widens the layer window they give.
+        :param pix: (P,) x-indices of the lattice columns. Likewise piy
+        :param pIds: (P,) triangle ids
+        :return: pix, piy and pIds of the remaining pairs, and the lowest and highest elevation at which the
+            triangle can be crossed within the column
+        """
+        TOLERANCE = 1e-9
+        margin = TOLERANCE * (tfg.dx + tfg.dy)
+        xs = np.stack([tfg.x_mid[pix], tfg.x_mid[pix+1]])[[0, 1, 1, 0]] + margin*np.array([-1, 1, 1, -1])[:, None]
+        ys = np.stack([tfg.y_mid[piy], tfg.y_mid[piy+1]])[[0, 0, 1, 1]] + margin*np.array([-1, -1, 1, 1])[:, None]
+        corners = self.verts[self.faces[pIds]]
+
+        # separating axes: the rectangle lies entirely outside one of the triangle's edges
+        keep = np.ones(len(pIds), dtype=bool)
+        for i in range(3):
+            p, q, r = corners[:, i], corners[:, (i+1) % 3], corners[:, (i+2) % 3]
+            nx, ny = p[:, 1] - q[:, 1], q[:, 0] - p[:, 0]
+            side = nx*(r[:, 0] - p[:, 0]) + ny*(r[:, 1] - p[:, 1])
+            reach = nx*(xs - p[:, 0]) + ny*(ys - p[:, 1])
+            slack = margin * (np.abs(nx) + np.abs(ny))
+            keep &= ~(((side > 0) & np.all(reach < -slack, axis=0)) | ((side < 0) & np.all(reach > slack, axis=0)))
+        pix, piy, pIds, corners, xs, ys = pix[keep], piy[keep], pIds[keep], corners[keep], xs[:, keep], ys[:, keep]
+
+        # the plane of the triangle over the rectangle, within the triangle's own z range
+        zLo, zHi = self.bboxMin[pIds, 2], self.bboxMax[pIds, 2]
+        normal = np.cross(self.edge1[pIds], self.edge2[pIds])
+        # near-vertical triangles keep their bounding box
+        sloped = np.abs(normal[:, 2]) > TOLERANCE * np.linalg.norm(normal, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = corners[:, 0, 2] - (normal[:, 0]*(xs - corners[:, 0, 0]) + normal[:, 1]*(ys - corners[:, 0, 1])) / normal[:, 2]
+        zLo = np.where(sloped, np.maximum(zLo, np.min(z, axis=0)), zLo)
+        zHi = np.where(sloped, np.minimum(zHi, np.max(z, axis=0)), zHi)
+        return pix, piy, pIds, zLo, zHi
+
+    def mapSurfaceNumba(self, tfg, indi_x, indi_y, indi_z, tile, profile=None):
+        """
+        Surface mapping with the segment tests of mapSurfaceRays compiled by numba (see jit.py). Falls
+        back to mapSurfaceSegments when numba is not installed. Produces the same indicators as
+        mapSurfaceRays. Arguments are the same as for mapSurfaceRays.
+        """
+        if not jit.NUMBA:
+            return self.mapSurfaceSegments(tfg, indi_x, indi_y, indi_z, tile, profile)
+        ix0, ix1, iy0, iy1 = tile
+        if ix0 >= ix1 or iy0 >= iy1:
+            return
+        jit.compileKernels()
+        offsets, ids = self.columnIndex(tfg, "surface").tileCsr(tile)
+        args = self.jitArgs(tfg)
+        for ix in range(ix0, ix1):
+            ntests = jit.surfaceColumns(indi_x, indi_y, indi_z, ix, ix+1, tile, offsets, ids, *args)
+            if profile is not None:
+                ncand = np.diff(offsets[(ix-ix0)*(iy1-iy0):(ix-ix0+1)*(iy1-iy0)+1])
+                profile.columns(ncand, tfg.nz-1, ntests)
+
+    def mapVolume(self, tfg, engine="ray", jobs=1, profile=None):
+        """
+        Maps the closed surface onto the grid as a volume.
+        :param tfg: the terrain-following grid
+        :param engine: name of the volume engine, a key of ENGINES["volume"]
+        :param jobs: number of worker processes. Output does not depend on this value
+        :param profile: optional Profile recording the index build and mapping phases. Shows progress
+        :return: (nz, ny, nx) uint8 indicator array, 1 for cell centers inside the geometry
+        """
+        method = ENGINES["volume"][engine]
+        profile = profile if profile is not None else Profile()
+        with profile.phase("buildIndex"):
+            self.columnIndex(tfg, "volume")
+        profile.start(tfg.nx * tfg.ny * tfg.nz)
+        with profile.phase("map"), profile.hotLoop():
+            if jobs > 1:
+                indi, = mapTiles(self, tfg, "volume", method, [INDICATOR_DTYPE], jobs, profile)
+            else:
+                indi = np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=INDICATOR_DTYPE)
+                getattr(self, method)(tfg, indi, (0, tfg.nx, 0, tfg.ny), profile)
+        return indi
+
+    def mapSurface(self, tfg, engine="ray", jobs=1, profile=None):
+        """
+        Maps the surface onto the grid as flow barriers between neighboring cells.
+        :param tfg: the terrain-following grid
+        :param engine: name of the surface engine, a key of ENGINES["surface"]
+        :param jobs: number of worker processes. Output does not depend on this value
+        :param profile: optional Profile recording the index build and mapping phases. Shows progress
+        :return: (nz, ny, nx) uint8 indicator arrays for the x, y and z directions
+        """
+        method = ENGINES["surface"][engine]
+        profile = profile if profile is not None else Profile()
+        with profile.phase("buildIndex"):
+            self.columnIndex(tfg, "surface")
+        profile.start((tfg.nx-1) * (tfg.ny-1) * (tfg.nz-1))
+        with profile.phase("map"), profile.hotLoop():
+            if jobs > 1:
+                indi_x, indi_y, indi_z = mapTiles(self, tfg, "surface", method, [INDICATOR_DTYPE]*3, jobs, profile)
+            else:
+                indi_x = np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=INDICATOR_DTYPE)
+                indi_y = np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=INDICATOR_DTYPE)
+                indi_z = np.zeros([tfg.nz, tfg.ny, tfg.nx], dtype=INDICATOR_DTYPE)
+                getattr(self, method)(tfg, indi_x, indi_y, indi_z, (0, tfg.nx-1, 0, tfg.ny-1), profile)
+        return indi_x, indi_y, indi_z
+
+    def processVolume(self, tfg, output_root, engine="ray", jobs=1, subgrids=(1, 1, 1), profile=None,
+                      vtkFormat="tcl", vtkInside=False):
+        """
+        Maps the closed surface onto the grid as a volume and writes <output_root>.pfb, with a VTK or the tcl
+        script that builds one, see vtkio.py. Finished subgrids are written while mapping goes on, see
+        pipeline.py.
+        """
+        profile = profile if profile is not None else Profile()
+        ncells = tfg.nx * tfg.ny * tfg.nz
+        print("Processing volume for %s. %d cells. %d faces" %(output_root, ncells, len(self.faces)))
+        pfbPath = "%s.pfb" %output_root
+        indi, = mapAndWrite(self, tfg, "volume", ENGINES["volume"][engine], INDICATOR_DTYPE, [pfbPath], jobs, subgrids,
+                            profile)
+        with profile.phase("writeVtk"):
+            writeVolumeVtk(tfg, indi, output_root, vtkFormat, vtkInside)
+
+    @staticmethod
+    def writeVolume(tfg, indi, output_root, subgrids=(1, 1, 1), profile=None, vtkFormat="tcl", vtkInside=False):
+        """
+        Writes volume indicators to <output_root>.pfb, with a VTK or the tcl script that builds one.
+        """
+        p, q, r = subgrids
+        profile = profile if profile is not None else Profile()
+        pfbPath = "%s.pfb" %output_root
+        with profile.phase("writePfb"):
+            writePfb(pfbPath, indi, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1, p=p, q=q, r=r)
+        with profile.phase("writeVtk"):
+            writeVolumeVtk(tfg, indi, output_root, vtkFormat, vtkInside)
+
+    def processSurface(self, tfg, output_root, engine="ray", jobs=1, subgrids=(1, 1, 1), faceFormat="obj", profile=None):
+        """
+        Maps the surface onto the grid and writes <output_root>.x.pfb, .y.pfb and .z.pfb and the
+        approximate faces. Finished subgrids are written while mapping goes on, and the faces while the
+        last subgrids are written, see pipeline.py.
+        """
+        profile = profile if profile is not None else Profile()
+        ncells = tfg.nx * tfg.ny * tfg.nz
+        print("Processing volume for %s. %d cells. %d faces" %(output_root, ncells, len(self.faces)))
+        pfbPaths = ["%s.%s.pfb" %(output_root, dim) for dim in ["x", "y", "z"]]
 
-                    progress.inc()
+        def writeFaces(arrays):
+            with profile.phase("writeFaces"):
+                writeApproxFaces(tfg, *arrays, "%s.faces.%s" %(output_root, faceFormat), faceFormat)
 
-        pfbPath = lambda dim: "%s.%s.pfb" %(output_root, dim)
-        write_pfb(pfbPath("x"), indi_x, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
-        write_pfb(pfbPath("y"), indi_y, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
-        write_pfb(pfbPath("z"), indi_z, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1)
-        self.writeApproxObj(tfg, indi_x, indi_y, indi_z, "%s.faces.obj" %output_root)
+        mapAndWrite(self, tfg, "surface", ENGINES["surface"][engine], INDICATOR_DTYPE, pfbPaths, jobs, subgrids,
+                    profile, onMapped=writeFaces)
+
+    @staticmethod
+    def writeSurface(tfg, indi_x, indi_y, indi_z, output_root, subgrids=(1, 1, 1), faceFormat="obj", profile=None):
+        """
+        Writes surface indicators to <output_root>.x.pfb, .y.pfb and .z.pfb, and the approximate faces.
+        The four files are written in parallel.
+        """
+        p, q, r = subgrids
+        profile = profile if profile is not None else Profile()
+
+        def writer(dim, indi):
+            def write():
+                with profile.phase("writePfb"):
+                    writePfb("%s.%s.pfb" %(output_root, dim), indi, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1,
+                             p=p, q=q, r=r)
+            return write
+
+        def writeFaces():
+            with profile.phase("writeFaces"):
+                writeApproxFaces(tfg, indi_x, indi_y, indi_z, "%s.faces.%s" %(output_root, faceFormat), faceFormat)
+
+        runConcurrently(writer("x", indi_x), writer("y", indi_y), writer("z", indi_z), writeFaces)
 
 def getArgs():
-    parser = argparse.ArgumentParser(description="ParFlow Geometry Mapper. A tool for mapping .obj files onto "
-                                    + "a ParFlow-style terrain-following grid.")
-    parser.add_argument('-kind', metavar="k", type=str, required=True,
-                        help="Kind of analysis. Options are 'volume' or 'surface'")
-    parser.add_argument('-tfg', type=str, required=True,
-                        help="json-formatted metadata for terrain-following grid")
-    parser.add_argument('-obj', type=str, required=True,
-                        help="obj-formatted input file. Faces must all be order 3 (triangles)")
-    parser.add_argument('-o', required=True,
-                        help="root name of output file(s)")
+    parser = makeParser()
     args = parser.parse_args()
-    
+
+    modes = [m for m in ["plan", "job", "merge", "serve"] if getattr(args, m) is not None]
+    if len(modes) > 1:
+        exitWith("error: give at most one of -plan, -job, -merge or -serve")
+    required = {"job": [], "merge": ["o"], "plan": ["kind", "tfg", "obj"], "serve": ["tfg"]}.get(modes[0] if modes else None,
+                                                                                ["kind", "tfg", "o"])
+    missing = ["-" + name for name in required if getattr(args, name) is None]
+    if missing:
+        parser.error("the following arguments are required: %s" %", ".join(missing))
+    if args.jobs < 1:
+        exitWith("error: -jobs must be at least 1")
+    if args.subgrids is not None and min(args.subgrids) < 1:
+        exitWith("error: -subgrids must all be at least 1")
+    if args.faces not in FACE_FORMATS:
+        exitWith("error: '%s' is not a valid face format. Choose from %s" %(args.faces, ", ".join(FACE_FORMATS)))
+    if args.vtk not in VTK_FORMATS:
+        exitWith("error: '%s' is not a valid VTK format. Choose from %s" %(args.vtk, ", ".join(VTK_FORMATS)))
+    if args.index is None:
+        args.index = INDEX_KINDS[0]
+    if args.index not in INDEX_KINDS:
+        exitWith("error: '%s' is not an available index. Choose from %s" %(args.index, ", ".join(INDEX_KINDS)))
+    if args.job is not None or args.merge is not None:
+        path = args.job if args.job is not None else args.merge
+        if not os.path.exists(path):
+            exitWith("error: '%s' does not exist" %path)
+        # the kind, grid and engine come with the plan
+        return args
+    if args.serve is not None:
+        # the kind, mesh, output and engine come with each request
+        if args.meshes < 1:
+            exitWith("error: -meshes must be at least 1")
+        if args.cacheSize < 0:
+            exitWith("error: -cacheSize must not be negative")
+        if not os.path.exists(args.tfg):
+            exitWith("error: '%s' does not exist" %args.tfg)
+        return args
+    if args.subgrids is None:
+        args.subgrids = [1, 1, 1]
+
     if args.kind not in ["volume", "surface"]:
         exitWith("error: '%s' is not a valid kind. Choose 'volume' or 'surface'" %args.kind)
+    if args.engine not in ENGINES[args.kind]:
+        exitWith("error: '%s' is not a valid %s engine. Choose from %s" %(args.engine, args.kind, ", ".join(ENGINES[args.kind])))
+    if args.engine == "numba" and not jit.NUMBA:
+        print("numba is not installed. Mapping with the '%s' engine instead" %("column" if args.kind == "volume" else "segment"))
+    if args.cprofile and args.profile is None:
+        exitWith("error: -cprofile requires -profile")
+    if args.cacheSize < 0:
+        exitWith("error: -cacheSize must not be negative")
     if not os.path.exists(args.tfg):
         exitWith("error: '%s' does not exist" %args.tfg)
-    if not os.path.exists(args.obj):
+    if (args.obj is None) == (args.manifest is None):
+        exitWith("error: give exactly one of -obj or -manifest")
+    if args.manifest is not None:
+        if args.kind != "volume":
+            exitWith("error: -manifest only applies to -kind volume")
+        if not os.path.exists(args.manifest):
+            exitWith("error: '%s' does not exist" %args.manifest)
+    elif not os.path.exists(args.obj):
         exitWith("error: '%s' does not exist" %args.obj)
+    elif os.path.splitext(args.obj)[1].lower() not in MESH_READERS:
+        exitWith("error: '%s' is not a known mesh format. Choose from %s" %(args.obj, ", ".join(MESH_READERS)))
+    if args.previous is not None:
+        if args.manifest is not None:
+            exitWith("error: -previous does not apply to -manifest")
+        if args.previousObj is None:
+            exitWith("error: -previous requires -previousObj")
+        for path in [args.previousObj, args.previousTfg]:
+            if path is not None and not os.path.exists(path):
+                exitWith("error: '%s' does not exist" %path)
+    elif args.previousObj is not None or args.previousTfg is not None:
+        exitWith("error: -previousObj and -previousTfg require -previous")
+    if args.plan is not None and (args.manifest is not None or args.previous is not None):
+        exitWith("error: -plan does not apply to -manifest or -previous")
 
     return args
 
-def processVolume(args):
-    ts, err = TriangulatedSurface.fromObj(args.obj)
+def openCache(args):
+    if args.cache is None:
+        return None
+    from .cache import Cache
+    return Cache(args.cache, args.cacheSize << 20)
+
+def readSurface(infile, cache, indexKind, profile):
+    with profile.phase("readObj"):
+        if cache is not None:
+            return cache.loadSurface(infile, indexKind)
+        return TriangulatedSurface.fromFile(infile)
+
+def readTfg(infile, cache, profile):
+    with profile.phase("readTfg"):
+        return cache.loadTfg(infile) if cache is not None else TFG.fromJson(infile)
+
+def readInputs(args, profile):
+    """
+    Reads the surface and the grid concurrently, through the cache when one is given, and prepares the
+    candidate lookup.
+    """
+    cache = openCache(args)
+    (ts, err), (tfg, tfgErr) = runConcurrently(lambda: readSurface(args.obj, cache, args.index, profile),
+                                               lambda: readTfg(args.tfg, cache, profile))
+    for e in [err, tfgErr]:
+        if e != None:
+            exitWith(e)
+
+    ts.indexKind = args.index
+    if cache is not None:
+        with profile.phase("buildIndex"):
+            cache.prepareIndex(ts, tfg, args.kind)
+    return ts, tfg
+
+def processVolume(args, profile):
+    ts, tfg = readInputs(args, profile)
+    ts.processVolume(tfg, args.o, engine=args.engine, jobs=args.jobs, subgrids=args.subgrids, profile=profile,
+                     vtkFormat=args.vtk, vtkInside=args.vtkInside)
+
+def processBatch(args, profile):
+    from .batch import GeometryBatch
+
+    def readManifest():
+        with profile.phase("readObj"):
+            return GeometryBatch.fromManifest(args.manifest, args.index, cache)
+
+    cache = openCache(args)
+    (batch, err), (tfg, tfgErr) = runConcurrently(readManifest, lambda: readTfg(args.tfg, cache, profile))
+    for e in [err, tfgErr]:
+        if e != None:
+            exitWith(e)
+
+    batch.processLabels(tfg, args.o, jobs=args.jobs, subgrids=args.subgrids, profile=profile, vtkFormat=args.vtk,
+                        vtkInside=args.vtkInside)
+
+def processSurface(args, profile):
+    ts, tfg = readInputs(args, profile)
+    ts.processSurface(tfg, args.o, engine=args.engine, jobs=args.jobs, subgrids=args.subgrids,
+                      faceFormat=args.faces, profile=profile)
+
+def processIncremental(args, profile):
+    from .incremental import processIncremental
+
+    ts, tfg = readInputs(args, profile)
+    cache = openCache(args)
+    tasks = [lambda: readSurface(args.previousObj, cache, None, profile)]
+    if args.previousTfg is not None:
+        tasks.append(lambda: readTfg(args.previousTfg, cache, profile))
+    loaded = runConcurrently(*tasks)
+    for _, err in loaded:
+        if err != None:
+            exitWith(err)
+    oldTs = loaded[0][0]
+    oldTfg = loaded[1][0] if args.previousTfg is not None else tfg
+
+    err = processIncremental(ts, tfg, oldTs, oldTfg, args.previous, args.o, args.kind, engine=args.engine,
+                             jobs=args.jobs, subgrids=args.subgrids, faceFormat=args.faces, profile=profile,
+                             vtkFormat=args.vtk, vtkInside=args.vtkInside)
     if err != None:
         exitWith(err)
 
-    tfg, err = TFG.fromJson(args.tfg)
+def processPlan(args, profile):
+    from .distributed import planJobs
+
+    ts, tfg = readInputs(args, profile)
+    err = planJobs(ts, tfg, args.kind, args.tfg, args.plan, subgrids=args.subgrids, profile=profile)
     if err != None:
         exitWith(err)
 
-    ts.processVolume(tfg, args.o)
+def processJob(args, profile):
+    from .distributed import runJob
 
-def processSurface(args):
-    ts, err = TriangulatedSurface.fromObj(args.obj)
+    err = runJob(args.job, engine=args.engine, jobs=args.jobs, indexKind=args.index, profile=profile)
     if err != None:
         exitWith(err)
 
-    tfg, err = TFG.fromJson(args.tfg)
+def processMerge(args, profile):
+    from .distributed import mergeJobs
+
+    err = mergeJobs(args.merge, args.o, subgrids=args.subgrids, faceFormat=args.faces, profile=profile,
+                    vtkFormat=args.vtk, vtkInside=args.vtkInside)
     if err != None:
         exitWith(err)
 
-    ts.processSurface(tfg, args.o)
+def processServe(args, profile):
+    from .server import MappingServer
+
+    tfg, err = readTfg(args.tfg, openCache(args), profile)
+    if err != None:
+        exitWith(err)
+    cacheArgs = (args.cache, args.cacheSize << 20) if args.cache is not None else None
+    server = MappingServer(tfg, args.tfg, args.serve, workers=args.jobs, meshes=args.meshes, indexKind=args.index,
+                           cacheArgs=cacheArgs, queue=args.queue)
+    err = server.checkPath()
+    if err != None:
+        exitWith("error: %s" %err)
+    print("Serving %s on %s with %d workers" %(args.tfg, args.serve, args.jobs))
+    try:
+        err = server.serve()
+    except KeyboardInterrupt:
+        server.shutdown()
+    if err != None:
+        exitWith("error: %s" %err)
 
 if __name__ == "__main__":
     args = getArgs()
-    if args.kind == "volume":
-        processVolume(args)
+    profile = Profile(cprofile=args.cprofile)
+    if args.serve is not None:
+        processServe(args, profile)
+    elif args.plan is not None:
+        processPlan(args, profile)
+    elif args.job is not None:
+        processJob(args, profile)
+    elif args.merge is not None:
+        processMerge(args, profile)
+    elif args.manifest is not None:
+        processBatch(args, profile)
+    elif args.previous is not None:
+        processIncremental(args, profile)
+    elif args.kind == "volume":
+        processVolume(args, profile)
     elif args.kind == "surface":
-        processSurface(args)
+        processSurface(args, profile)
     else:
         print("unknown 'kind' argument. Must be either 'volume' or 'surface'")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    if args.profile is not None:
+        profile.write(args.profile)
\ No newline at end of file
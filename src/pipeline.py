@@ -0,0 +1,190 @@
+# Pipelined execution: loading, mapping and writing overlap.
+#
+# Otherwise a run is strictly sequential: parse the OBJ, read the DEM, build the index, map, then write
+# each output in turn. With the helpers here:
+#   - inputs are loaded in threads of their own, so the OBJ is parsed while the DEM is read;
+#   - mapAndWrite maps the grid one block of columns at a time, a block being the columns of a P by Q
+#     column of output subgrids, and every finished block is written by a background thread per pfb
+#     file while mapping goes on. With -subgrids 1 1 1 there is a single block, so only the outputs
+#     overlap each other;
+#   - surface runs write the x, y and z pfbs and the faces file in parallel.
+#
+# Writers take their work from bounded queues. Mapping waits while a queue is full, so at most
+# QUEUE_SIZE finished subgrids per file are held in memory waiting to be written. Numpy conversion and
+# file writes release the GIL, so the threads overlap for real.
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .parallel import makeTiles, mapTiles
+from .pfbio import PfbWriter
+from .profiling import Profile
+
+# Subgrids that may wait for each background writer
+QUEUE_SIZE = 4
+
+def runConcurrently(*tasks):
+    """
+    Runs callables without arguments in threads of their own and waits for all of them.
+    :return: list of their return values, in order. The first exception raised by a task is re-raised
+    """
+    with ThreadPoolExecutor(max(1, len(tasks))) as pool:
+        futures = [pool.submit(task) for task in tasks]
+        return [f.result() for f in futures]
+
+class BackgroundWriter:
+    def __init__(self, maxPending=QUEUE_SIZE):
+        """
+        Runs submitted jobs in order on a thread of its own.
+        :param maxPending: number of jobs that may wait. submit blocks while that many are waiting
+        """
+        self.queue = queue.Queue(maxPending)
+        self.thread = None
+        self.error = None
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            fn, args = job
+            if self.error is None:
+                try:
+                    fn(*args)
+                except BaseException as e:
+                    self.error = e
+
+    def submit(self, fn, *args):
+        """
+        Queues fn(*args). Raises the error of an earlier job, if any.
+        """
+        if self.error is not None:
+            raise self.error
+        # started on first use, so worker processes forked before that do not inherit a running thread
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        self.queue.put((fn, args))
+
+    def close(self):
+        """
+        Waits for every queued job. Raises the error of a failed job, if any.
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            raise self.error
+
+def columnBlocks(layout):
+    """
+    Groups the subgrids of a pfb layout by the columns they cover.
+    :param layout: subgrid layout, as from subgridLayout
+    :return: list of ((ix0, ix1, iy0, iy1), subgrid numbers) tuples, upper bounds exclusive
+    """
+    blocks = {}
+    for i, (_, (ix, iy, _), (sx, sy, _)) in enumerate(layout):
+        blocks.setdefault((ix, ix+sx, iy, iy+sy), []).append(i)
+    return list(blocks.items())
+
+def mapAndWrite(ts, tfg, kind, method, dtype, paths, jobs=1, subgrids=(1, 1, 1), profile=None, onMapped=None):
+    """
+    Maps a triangulated surface onto a grid block by block, writing every finished block to the output
+    pfb files in the background. Output is the same as mapping first and calling writePfb after.
+    :param ts: the triangulated surface
+    :param tfg: the terrain-following grid
+    :param kind: 'volume' or 'surface'
+    :param method: name of the TriangulatedSurface engine method
+    :param dtype: dtype of the indicator arrays
+    :param paths: pfb filename of each array the engine fills
+    :param jobs: number of worker processes
+    :param subgrids: (P, Q, R) subgrids of the pfb files. Blocks are their P by Q columns
+    :param profile: optional Profile recording the index build, mapping and (background) writing phases
+    :param onMapped: optional callable, called with the indicator arrays once mapping is done, while the
+        last blocks are still being written
+    :return: list of (nz, ny, nx) indicator arrays, one per path
+    """
+    profile = profile if profile is not None else Profile()
+    p, q, r = subgrids
+    shape = (tfg.nz, tfg.ny, tfg.nx)
+    if kind == "volume":
+        nx, ny, nz = tfg.nx, tfg.ny, tfg.nz
+    else:
+        nx, ny, nz = tfg.nx-1, tfg.ny-1, tfg.nz-1
+
+    with profile.phase("buildIndex"):
+        ts.columnIndex(tfg, kind)
+
+    pfbs = [PfbWriter(path, tfg.nx, tfg.ny, tfg.nz, x=tfg.x0, y=tfg.y0, dx=tfg.dx, dy=tfg.dy, dz=1, p=p, q=q, r=r)
+            for path in paths]
+    writers = [BackgroundWriter() for _ in paths]
+    blocks = columnBlocks(pfbs[0].layout)
+    # columns of each block that the engine maps. Surface blocks on the last row or column map one less
+    mapped = [(ix0, min(ix1, nx), iy0, min(iy1, ny)) for (ix0, ix1, iy0, iy1), _ in blocks]
+
+    def writeSubgrid(pfb, i, block):
+        with profile.phase("writePfb"):
+            pfb.writeSubgrid(i, block)
+
+    def writeBlock(arrays, b, ix0=0, iy0=0):
+        # arrays hold columns from (ix0, iy0) on: the whole grid, or a copy of the block
+        for array, pfb, writer in zip(arrays, pfbs, writers):
+            for i in blocks[b][1]:
+                _, (ix, iy, iz), (sx, sy, sz) = pfb.layout[i]
+                writer.submit(writeSubgrid, pfb, i, array[iz:iz+sz, iy-iy0:iy-iy0+sy, ix-ix0:ix-ix0+sx])
+
+    try:
+        profile.start(nx * ny * nz)
+        with profile.phase("map"), profile.hotLoop():
+            if jobs > 1:
+                arrays = mapBlocksParallel(ts, tfg, kind, method, dtype, len(paths), jobs, blocks, mapped,
+                                           writeBlock, profile)
+            else:
+                arrays = [np.zeros(shape, dtype=dtype) for _ in paths]
+                for b, (ix0, ix1, iy0, iy1) in enumerate(mapped):
+                    if ix0 < ix1 and iy0 < iy1:
+                        getattr(ts, method)(tfg, *arrays, (ix0, ix1, iy0, iy1), profile)
+                    writeBlock(arrays, b)
+        if onMapped is not None:
+            onMapped(arrays)
+        for writer in writers:
+            writer.close()
+    finally:
+        for writer in writers:
+            if writer.thread is not None:
+                writer.queue.put(None)
+                writer.thread.join()
+        for pfb in pfbs:
+            pfb.close()
+    return arrays
+
+def mapBlocksParallel(ts, tfg, kind, method, dtype, narrays, jobs, blocks, mapped, writeBlock, profile):
+    """
+    Maps the blocks with a pool of worker processes, handing a copy of each block to writeBlock as soon
+    as all of its tiles are done.
+    """
+    tiles, owners = [], []
+    perBlock = max(1, 16 * jobs // len(blocks))
+    for b, (ix0, ix1, iy0, iy1) in enumerate(mapped):
+        for tx0, tx1, ty0, ty1 in makeTiles(ix1-ix0, iy1-iy0, perBlock):
+            tiles.append((ix0+tx0, ix0+tx1, iy0+ty0, iy0+ty1))
+            owners.append(b)
+    remaining = np.bincount(owners, minlength=len(blocks))
+    owner = dict(zip(tiles, owners))
+
+    def onTile(tile, shared):
+        b = owner[tile]
+        remaining[b] -= 1
+        if remaining[b] == 0:
+            ix0, ix1, iy0, iy1 = blocks[b][0]
+            writeBlock([a[:, iy0:iy1, ix0:ix1].copy() for a in shared], b, ix0, iy0)
+
+    arrays = mapTiles(ts, tfg, kind, method, [dtype]*narrays, jobs, profile, tiles, onTile)
+    # blocks without any column to map are all zeros
+    for b in np.nonzero(np.bincount(owners, minlength=len(blocks)) == 0)[0]:
+        writeBlock(arrays, b)
+    return arrays
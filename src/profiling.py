@@ -0,0 +1,179 @@
+# Run-time instrumentation: progress, phase timings and mapping counters.
+#
+# A Profile is handed to the mapping engines in place of a bare progress ticker. Engines report every
+# column they map (candidate triangles, cells, ray-triangle tests), which drives the percentage ticker
+# and accumulates counters and a histogram of candidates per column. Phases such as reading inputs,
+# building the index, mapping and writing are timed with profile.phase(name). The whole report can be
+# dumped as json, which shows e.g. meshes whose candidate sets blow up.
+#
+# Worker processes map tiles with their own quiet Profile and send back stats(), which the parent
+# merges, so counters are the same for any number of jobs.
+
+import cProfile
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+class Profile:
+    def __init__(self, quiet=False, cprofile=False):
+        """
+        :param quiet: do not print the percentage ticker
+        :param cprofile: capture a cProfile of the mapping loop, see hotLoop
+        """
+        self.quiet = quiet
+        self.phases = {}
+        self.counters = {}
+        # number of candidate triangles -> number of columns
+        self.histogram = {}
+        self.cprofile = cProfile.Profile() if cprofile else None
+        # phases may be timed on several threads at once, e.g. by background writers
+        self.lock = threading.Lock()
+        self.nticks = 0
+        self.tick = 0
+        self.shown = 0
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the wall time of the enclosed block to phase name. Phases running on several threads at once
+        add up, so they may exceed the wall time of the run.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - t0
+
+    @contextmanager
+    def hotLoop(self):
+        """
+        Wraps the mapping loop: shows the ticker, and records a cProfile if one was requested.
+        """
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        try:
+            yield
+        finally:
+            if self.cprofile is not None:
+                self.cprofile.disable()
+            self.stop()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def start(self, nticks):
+        """
+        Starts the percentage ticker for nticks cells.
+        """
+        self.nticks = nticks
+        self.tick = 0
+        self.shown = 0
+
+    def stop(self):
+        if not self.quiet and self.shown > 0:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+        self.shown = 0
+
+    def inc(self, n=1):
+        self.tick += n
+        if self.quiet or self.nticks <= 0:
+            return
+        pct = min(100, 100 * self.tick // self.nticks)
+        if pct > self.shown:
+            self.shown = pct
+            sys.stdout.write(" %d%%" %pct)
+            sys.stdout.flush()
+
+    def column(self, ncandidates, ncells, ntests):
+        """
+        Records one mapped column.
+        :param ncandidates: number of candidate triangles of the column
+        :param ncells: number of cells (or cell pairs, for surfaces) the column covers
+        :param ntests: number of ray-triangle tests made
+        """
+        self.histogram[ncandidates] = self.histogram.get(ncandidates, 0) + 1
+        self.count("columns")
+        if ncandidates == 0:
+            self.count("columnsSkipped")
+        self.count("cells", ncells)
+        self.count("triangleTests", ntests)
+        self.inc(ncells)
+
+    def columns(self, ncandidates, ncells, ntests):
+        """
+        Bulk version of column, for engines that map a whole tile at once.
+        :param ncandidates: array with the number of candidate triangles of each column
+        :param ncells: number of cells each column covers
+        :param ntests: number of ray-triangle tests made for all the columns
+        """
+        counts, ncolumns = np.unique(ncandidates, return_counts=True)
+        for n, c in zip(counts.tolist(), ncolumns.tolist()):
+            self.histogram[n] = self.histogram.get(n, 0) + c
+        self.count("columns", len(ncandidates))
+        if counts.size > 0 and counts[0] == 0:
+            self.count("columnsSkipped", int(ncolumns[0]))
+        self.count("cells", ncells * len(ncandidates))
+        self.count("triangleTests", int(ntests))
+        self.inc(ncells * len(ncandidates))
+
+    def skipTile(self, ncolumns, ncells):
+        """
+        Records a tile without candidate triangles that was never mapped.
+        """
+        self.histogram[0] = self.histogram.get(0, 0) + ncolumns
+        self.count("tilesSkipped")
+        self.count("columns", ncolumns)
+        self.count("columnsSkipped", ncolumns)
+        self.count("cells", ncells)
+        self.inc(ncells)
+
+    def stats(self):
+        """
+        :return: picklable counters and histogram, for merge
+        """
+        return {"counters": self.counters, "histogram": self.histogram}
+
+    def merge(self, stats):
+        """
+        Adds the stats of another profile, e.g. of a worker process.
+        """
+        for name, n in stats["counters"].items():
+            self.count(name, n)
+        for ncandidates, ncolumns in stats["histogram"].items():
+            self.histogram[ncandidates] = self.histogram.get(ncandidates, 0) + ncolumns
+        self.inc(stats["counters"].get("cells", 0))
+
+    def report(self):
+        """
+        :return: dict of phase times in seconds, counters, the candidates-per-column histogram and
+            derived rates
+        """
+        columns = self.counters.get("columns", 0)
+        cells = self.counters.get("cells", 0)
+        seconds = self.phases.get("map", 0.0)
+        candidates = sum(n * c for n, c in self.histogram.items())
+        return {
+            "phases": dict(self.phases),
+            "counters": dict(self.counters),
+            "candidatesPerColumn": {str(n): self.histogram[n] for n in sorted(self.histogram)},
+            "meanCandidatesPerColumn": candidates / columns if columns else 0.0,
+            "maxCandidatesPerColumn": max(self.histogram) if self.histogram else 0,
+            "columnsSkippedFraction": self.counters.get("columnsSkipped", 0) / columns if columns else 0.0,
+            "cellsPerSecond": cells / seconds if seconds > 0 else 0.0,
+            "triangleTestsPerCell": self.counters.get("triangleTests", 0) / cells if cells else 0.0,
+        }
+
+    def write(self, outfile):
+        """
+        Writes the report as json, and the cProfile capture, if any, next to it as <outfile>.pstats.
+        """
+        with open(outfile, "w") as f:
+            json.dump(self.report(), f, indent=4)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(outfile + ".pstats")
@@ -0,0 +1,300 @@
+# Mapping server: maps many small jobs onto one grid without paying for startup, the DEM read and the
+# mesh parse and index build every time.
+#
+# pfgm.py -serve PATH -tfg tfg.json reads the grid once and hands jobs to a pool of -jobs worker
+# processes. Every worker keeps the meshes it mapped recently, with their candidate lookups, in an LRU
+# cache of -meshes entries. Entries are keyed by path, size and modification time, so a changed file is
+# read again. Clients (client.py) send jobs either over a Unix socket at PATH or, where Unix sockets are
+# not available or with -queue, through a job directory at PATH:
+#
+#   socket  the client connects, sends one json request line and reads one json response line
+#   queue   the client writes PATH/<id>.job and waits for PATH/<id>.result. Both are written under a
+#           temporary name and renamed into place, and the server claims a job by renaming it
+#
+# A request holds the options of a pfgm.py run: kind, obj, o, engine, subgrids, faces, vtk and vtkInside,
+# with absolute paths, plus the tfg the client expects. The response holds error, None on success, the
+# mapping time in seconds and whether the mesh was already loaded.
+
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import stat
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from .export import FACE_FORMATS
+from .meshio import MESH_READERS
+from .pfgm import ENGINES, TriangulatedSurface
+from .profiling import Profile
+from .vtkio import VTK_FORMATS
+
+# Seconds between scans of a job directory, by the server for jobs and by clients for results
+QUEUE_POLL_SECONDS = 0.02
+
+# State of each worker process, set by the pool initializer
+_worker = {}
+
+class MeshCache:
+    def __init__(self, capacity):
+        """
+        :param capacity: number of meshes kept. The least recently used one is dropped beyond it
+        """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def get(self, path, load):
+        """
+        :param path: mesh file
+        :param load: called as load(path) on a miss, returns (TriangulatedSurface, error message)
+        :return: the surface, an error message or None, and True when the surface was already loaded
+        """
+        try:
+            stat = os.stat(path)
+        except OSError as e:
+            return None, "error reading %s: %s" %(path, str(e)), False
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key], None, True
+        ts, err = load(path)
+        if err != None:
+            return None, err, False
+        # an older version of the same file is of no further use
+        for old in [k for k in self.entries if k[0] == key[0]]:
+            del self.entries[old]
+        self.entries[key] = ts
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+        return ts, None, False
+
+def checkRequest(request, tfgPath):
+    """
+    :param request: dict sent by a client
+    :param tfgPath: json file of the grid the server maps onto
+    :return: None if the server can run the request, and an error message otherwise
+    """
+    if not isinstance(request, dict):
+        return "a request is a json object"
+    kind = request.get("kind")
+    if kind not in ENGINES:
+        return "'%s' is not a valid kind. Choose 'volume' or 'surface'" %kind
+    engine = request.get("engine", "ray")
+    if engine not in ENGINES[kind]:
+        return "'%s' is not a valid %s engine. Choose from %s" %(engine, kind, ", ".join(ENGINES[kind]))
+    for key in ["obj", "o"]:
+        if not isinstance(request.get(key), str):
+            return "the request needs '%s'" %key
+    if not os.path.exists(request["obj"]):
+        return "'%s' does not exist" %request["obj"]
+    if os.path.splitext(request["obj"])[1].lower() not in MESH_READERS:
+        return "'%s' is not a known mesh format. Choose from %s" %(request["obj"], ", ".join(MESH_READERS))
+    subgrids = request.get("subgrids", [1, 1, 1])
+    if not (isinstance(subgrids, list) and len(subgrids) == 3 and all(isinstance(n, int) and n >= 1 for n in subgrids)):
+        return "subgrids must be three integers of at least 1"
+    if request.get("faces", "obj") not in FACE_FORMATS:
+        return "'%s' is not a valid face format. Choose from %s" %(request.get("faces"), ", ".join(FACE_FORMATS))
+    if request.get("vtk", "tcl") not in VTK_FORMATS:
+        return "'%s' is not a valid VTK format. Choose from %s" %(request.get("vtk"), ", ".join(VTK_FORMATS))
+    tfg = request.get("tfg")
+    if tfg is not None and os.path.abspath(tfg) != os.path.abspath(tfgPath):
+        return "the server maps onto %s, not %s" %(tfgPath, tfg)
+    return None
+
+def _initWorker(tfg, indexKind, meshes, cacheArgs):
+    _worker["tfg"] = tfg
+    _worker["indexKind"] = indexKind
+    _worker["meshes"] = MeshCache(meshes)
+    if cacheArgs is not None:
+        from .cache import Cache
+        _worker["cache"] = Cache(*cacheArgs)
+    else:
+        _worker["cache"] = None
+
+def _loadMesh(path):
+    cache = _worker["cache"]
+    if cache is not None:
+        return cache.loadSurface(path, _worker["indexKind"])
+    return TriangulatedSurface.fromFile(path)
+
+def _runRequest(request):
+    """
+    Maps one checked request in a worker process.
+    :return: the response
+    """
+    t0 = time.perf_counter()
+    tfg = _worker["tfg"]
+    ts, err, cached = _worker["meshes"].get(request["obj"], _loadMesh)
+    if err != None:
+        return {"error": err, "seconds": time.perf_counter() - t0, "cached": False}
+    ts.indexKind = _worker["indexKind"]
+    kind, engine = request["kind"], request.get("engine", "ray")
+    subgrids = request.get("subgrids", [1, 1, 1])
+    profile = Profile(quiet=True)
+    try:
+        if _worker["cache"] is not None:
+            _worker["cache"].prepareIndex(ts, tfg, kind)
+        if kind == "volume":
+            ts.processVolume(tfg, request["o"], engine=engine, subgrids=subgrids, profile=profile,
+                             vtkFormat=request.get("vtk", "tcl"), vtkInside=bool(request.get("vtkInside", False)))
+        else:
+            ts.processSurface(tfg, request["o"], engine=engine, subgrids=subgrids,
+                              faceFormat=request.get("faces", "obj"), profile=profile)
+    except Exception as e:
+        # a failed job must not take the worker down
+        return {"error": "%s: %s" %(type(e).__name__, str(e)), "seconds": time.perf_counter() - t0, "cached": cached}
+    return {"error": None, "seconds": time.perf_counter() - t0, "cached": cached}
+
+class MappingServer:
+    def __init__(self, tfg, tfgPath, path, workers=1, meshes=8, indexKind=None, cacheArgs=None, queue=False):
+        """
+        :param tfg: the terrain-following grid jobs are mapped onto
+        :param tfgPath: json file of the grid. Requests naming another grid are refused
+        :param path: Unix socket to listen on, or job directory with queue
+        :param workers: number of worker processes
+        :param meshes: number of meshes each worker keeps loaded
+        :param indexKind: candidate lookup, one of INDEX_KINDS
+        :param cacheArgs: optional (directory, size cap in bytes) of an on-disk cache meshes are loaded through
+        :param queue: take jobs from a job directory instead of a Unix socket. Always the case where Unix
+            sockets are not available
+        """
+        self.tfgPath = os.path.abspath(tfgPath)
+        self.path = path
+        self.queue = queue or not hasattr(socket, "AF_UNIX")
+        # the pool is started by serve, once the path is known to be usable
+        self.workers = workers
+        self.initargs = (tfg, indexKind, meshes, cacheArgs)
+        self.pool = None
+        self.stopped = threading.Event()
+        # guards socketServer against a shutdown while the socket is being set up
+        self.lock = threading.Lock()
+        self.socketServer = None
+
+    def submit(self, request, callback):
+        """
+        Checks a request and maps it on the pool. callback(response) is called once it is done.
+        """
+        err = checkRequest(request, self.tfgPath)
+        if err != None:
+            callback({"error": err, "seconds": 0.0, "cached": False})
+            return
+        self.pool.apply_async(_runRequest, (request,), callback=callback,
+                              error_callback=lambda e: callback({"error": str(e), "seconds": 0.0, "cached": False}))
+
+    def run(self, request):
+        """
+        Maps a request and waits for it.
+        :return: the response
+        """
+        done = threading.Event()
+        response = {}
+        def finish(r):
+            response.update(r)
+            done.set()
+        self.submit(request, finish)
+        done.wait()
+        return response
+
+    def checkPath(self):
+        """
+        :return: None if the server can take jobs at its path, and an error message otherwise. Only a
+            socket left over from a server that did not shut down is replaced
+        """
+        try:
+            mode = os.lstat(self.path).st_mode
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            return "error reading %s: %s" %(self.path, str(e))
+        if self.queue and not stat.S_ISDIR(mode):
+            return "'%s' exists and is not a directory" %self.path
+        if not self.queue and not stat.S_ISSOCK(mode):
+            return "'%s' exists and is not a socket" %self.path
+        return None
+
+    def serve(self):
+        """
+        Takes jobs until shutdown() is called.
+        :return: None once shut down, and an error message if the server could not start
+        """
+        err = self.checkPath()
+        if err != None:
+            return err
+        self.pool = multiprocessing.Pool(self.workers, initializer=_initWorker, initargs=self.initargs)
+        try:
+            if self.queue:
+                self.serveQueue()
+            else:
+                self.serveSocket()
+        finally:
+            self.pool.close()
+            self.pool.join()
+        return None
+
+    def serveSocket(self):
+        server = self
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline())
+                except ValueError as e:
+                    response = {"error": "invalid request: %s" %str(e), "seconds": 0.0, "cached": False}
+                else:
+                    response = server.run(request)
+                self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+        if os.path.lexists(self.path):
+            # a socket left over from a server that did not shut down, see checkPath
+            os.remove(self.path)
+        with self.lock:
+            if self.stopped.is_set():
+                return
+            self.socketServer = socketserver.ThreadingUnixStreamServer(self.path, Handler)
+        self.socketServer.daemon_threads = True
+        try:
+            self.socketServer.serve_forever(poll_interval=0.1)
+        finally:
+            self.socketServer.server_close()
+            os.remove(self.path)
+
+    def serveQueue(self):
+        os.makedirs(self.path, exist_ok=True)
+        def finish(name, response):
+            os.remove(os.path.join(self.path, name + ".running"))
+            writeJson(os.path.join(self.path, name + ".result"), response)
+
+        while not self.stopped.wait(QUEUE_POLL_SECONDS):
+            for entry in sorted(os.listdir(self.path)):
+                if not entry.endswith(".job"):
+                    continue
+                name = entry[:-len(".job")]
+                running = os.path.join(self.path, name + ".running")
+                try:
+                    os.rename(os.path.join(self.path, entry), running)
+                    with open(running, "r") as f:
+                        request = json.load(f)
+                except (OSError, ValueError) as e:
+                    writeJson(os.path.join(self.path, name + ".result"),
+                              {"error": "invalid request: %s" %str(e), "seconds": 0.0, "cached": False})
+                    continue
+                self.submit(request, lambda response, name=name: finish(name, response))
+
+    def shutdown(self):
+        """
+        Stops taking jobs. serve() returns once the jobs taken are done.
+        """
+        with self.lock:
+            self.stopped.set()
+            socketServer = self.socketServer
+        if socketServer is not None:
+            socketServer.shutdown()
+
+def writeJson(path, value):
+    # written under a temporary name, so readers never see a partial file
+    tmp = "%s.%s.tmp" %(path, uuid.uuid4().hex)
+    with open(tmp, "w") as f:
+        json.dump(value, f)
+    os.replace(tmp, path)
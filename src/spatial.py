@@ -0,0 +1,189 @@
+# Candidate-triangle lookups for grid columns.
+#
+# Mapping engines only need, for each (ix, iy) column, the triangles whose xy bounding boxes reach the
+# column's query region: the column center for volumes, and the rectangle spanned by the centers of
+# (ix, iy) and (ix+1, iy+1) for surfaces. Two lookups provide that:
+#
+#   RtreeColumns  queries an R-tree per column (requires the optional rtree package)
+#   BinnedColumns rasterizes every triangle bounding box onto the grid once and stores the
+#                 cell -> triangle lists in CSR form, so a lookup is an array slice
+
+from importlib.util import find_spec
+
+import numpy as np
+
+# rtree is imported on first use, so that e.g. pfgm.py --help does not pay for it
+INDEX_KINDS = ["rtree", "bins"] if find_spec("rtree") is not None else ["bins"]
+
+def buildRtree(bboxMin, bboxMax, path=None):
+    """
+    Bulk-loads a 2D R-tree with the xy bounding boxes of triangles.
+    :param bboxMin: (M, 3) lower corners of the triangle bounding boxes
+    :param bboxMax: (M, 3) upper corners
+    :param path: optional base name of a disk-backed index (<path>.dat and <path>.idx), see openRtree.
+        The index is kept in memory by default
+    :return: an rtree.index.Index keyed by triangle id
+    """
+    from rtree import index
+    p = index.Property()
+    p.dimension = 2
+    boxes = np.column_stack([bboxMin[:, :2], bboxMax[:, :2]]).tolist()
+    args = [] if path is None else [path]
+    if path is not None:
+        p.overwrite = True
+    if len(boxes) > 0:
+        args.append((tId, box, None) for tId, box in enumerate(boxes))
+    return index.Index(*args, properties=p)
+
+def openRtree(path):
+    """
+    Opens a disk-backed R-tree written by buildRtree.
+    """
+    from rtree import index
+    p = index.Property()
+    p.dimension = 2
+    return index.Index(path, properties=p)
+
+class RtreeColumns:
+    def __init__(self, rtree, tfg, kind):
+        """
+        :param rtree: R-tree of triangle xy bounding boxes, as built by buildRtree
+        :param tfg: the terrain-following grid
+        :param kind: 'volume' or 'surface'
+        """
+        self.rtree = rtree
+        self.tfg = tfg
+        self.kind = kind
+        self.bump = tfg.dx * 0.1
+
+    def extent(self, ix0, ix1, iy0, iy1):
+        """
+        Query rectangle covering columns ix0..ix1-1 and iy0..iy1-1.
+        """
+        tfg = self.tfg
+        if self.kind == "volume":
+            return (tfg.x_mid[ix0], tfg.y_mid[iy0], tfg.x_mid[ix1-1]+self.bump, tfg.y_mid[iy1-1]+self.bump)
+        return (tfg.x_mid[ix0], tfg.y_mid[iy0], tfg.x_mid[ix1], tfg.y_mid[iy1])
+
+    def candidates(self, ix, iy):
+        """
+        :return: int64 array of ids of triangles that may intersect column (ix, iy)
+        """
+        return np.fromiter(self.rtree.intersection(self.extent(ix, ix+1, iy, iy+1)), dtype=np.int64)
+
+    def tileCost(self, tile):
+        """
+        Number of triangles overlapping a tile. Zero means no column of the tile has candidates.
+        """
+        return self.rtree.count(self.extent(*tile))
+
+    def tileCandidates(self, tile):
+        """
+        :return: int64 array of ids of triangles that may intersect any column of a tile
+        """
+        return np.fromiter(self.rtree.intersection(self.extent(*tile)), dtype=np.int64)
+
+    def tileCsr(self, tile):
+        """
+        Candidates of every column of a tile in CSR form, for the compiled engines (see jit.py).
+        :return: (offsets, ids). Candidates of column (ix, iy) are ids[offsets[c]:offsets[c+1]],
+            c = (ix - ix0)*(iy1 - iy0) + iy - iy0
+        """
+        ix0, ix1, iy0, iy1 = tile
+        slices = [self.candidates(ix, iy) for ix in range(ix0, ix1) for iy in range(iy0, iy1)]
+        offsets = np.zeros(len(slices) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in slices], out=offsets[1:])
+        return offsets, np.concatenate(slices + [np.zeros(0, dtype=np.int64)])
+
+class BinnedColumns:
+    def __init__(self, bboxMin, bboxMax, tfg, kind, csr=None):
+        """
+        :param bboxMin: (M, 3) lower corners of the triangle bounding boxes
+        :param bboxMax: (M, 3) upper corners
+        :param tfg: the terrain-following grid
+        :param kind: 'volume' bins onto the grid cells. 'surface' bins onto the lattice whose cells span
+            neighboring cell centers, i.e. [xMid(ix), xMid(ix+1)] by [yMid(iy), yMid(iy+1)]
+        :param csr: optional (offsets, ids) arrays from an earlier rasterize on the same lattice, e.g.
+            reloaded from a cache. The bounding boxes are not rasterized again when given
+        """
+        if kind == "volume":
+            x0, y0 = tfg.x_min[0], tfg.y_min[0]
+            self.nx, self.ny = tfg.nx, tfg.ny
+        else:
+            x0, y0 = tfg.x_mid[0], tfg.y_mid[0]
+            self.nx, self.ny = max(0, tfg.nx-1), max(0, tfg.ny-1)
+        if csr is not None:
+            self.offsets, self.ids = csr
+        else:
+            self.offsets, self.ids = self.rasterize(bboxMin, bboxMax, x0, y0, tfg.dx, tfg.dy, self.nx, self.ny)
+
+    @staticmethod
+    def rasterize(bboxMin, bboxMax, x0, y0, dx, dy, nx, ny):
+        """
+        Bins triangles onto every lattice cell their closed xy bounding box touches. A small tolerance
+        keeps boxes that touch a cell edge in both neighboring cells, so lookups never miss a candidate.
+        :return: CSR arrays. Candidates of cell (ix, iy) are ids[offsets[c]:offsets[c+1]], c = ix*ny + iy
+        """
+        TOLERANCE = 1e-9
+        ix0 = np.ceil((bboxMin[:, 0] - x0) / dx - TOLERANCE).astype(np.int64) - 1
+        ix1 = np.floor((bboxMax[:, 0] - x0) / dx + TOLERANCE).astype(np.int64)
+        iy0 = np.ceil((bboxMin[:, 1] - y0) / dy - TOLERANCE).astype(np.int64) - 1
+        iy1 = np.floor((bboxMax[:, 1] - y0) / dy + TOLERANCE).astype(np.int64)
+        ix0, ix1 = np.maximum(ix0, 0), np.minimum(ix1, nx-1)
+        iy0, iy1 = np.maximum(iy0, 0), np.minimum(iy1, ny-1)
+        tIds = np.nonzero((ix0 <= ix1) & (iy0 <= iy1))[0]
+        ix0, ix1, iy0, iy1 = ix0[tIds], ix1[tIds], iy0[tIds], iy1[tIds]
+
+        # expand every triangle into the cells of its footprint
+        widths, heights = ix1 - ix0 + 1, iy1 - iy0 + 1
+        counts = widths * heights
+        owner = np.repeat(np.arange(len(tIds)), counts)
+        local = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        cells = (ix0[owner] + local // heights[owner]) * ny + iy0[owner] + local % heights[owner]
+
+        order = np.argsort(cells, kind="stable")
+        ids = tIds[owner[order]].astype(np.int64)
+        offsets = np.zeros(nx*ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cells, minlength=nx*ny), out=offsets[1:])
+        return offsets, ids
+
+    def candidates(self, ix, iy):
+        """
+        :return: int64 array of ids of triangles that may intersect column (ix, iy)
+        """
+        c = ix*self.ny + iy
+        return self.ids[self.offsets[c]:self.offsets[c+1]]
+
+    def tileCost(self, tile):
+        """
+        Number of (column, triangle) candidate pairs in a tile. Zero means no column has candidates.
+        """
+        ix0, ix1, iy0, iy1 = tile
+        rows = np.arange(ix0, ix1) * self.ny
+        return int(np.sum(self.offsets[rows + iy1] - self.offsets[rows + iy0]))
+
+    def tileCandidates(self, tile):
+        """
+        :return: sorted int64 array of ids of triangles that may intersect any column of a tile
+        """
+        ix0, ix1, iy0, iy1 = tile
+        rows = np.arange(ix0, ix1) * self.ny
+        slices = [self.ids[self.offsets[r+iy0]:self.offsets[r+iy1]] for r in rows]
+        return np.unique(np.concatenate(slices + [np.zeros(0, dtype=np.int64)]))
+
+    def tileCsr(self, tile):
+        """
+        Candidates of every column of a tile in CSR form, for the compiled engines (see jit.py).
+        :return: (offsets, ids). Candidates of column (ix, iy) are ids[offsets[c]:offsets[c+1]],
+            c = (ix - ix0)*(iy1 - iy0) + iy - iy0
+        """
+        ix0, ix1, iy0, iy1 = tile
+        if ix0 == 0 and iy0 == 0 and ix1 == self.nx and iy1 == self.ny:
+            return self.offsets, self.ids
+        rows = np.arange(ix0, ix1) * self.ny
+        starts, ends = self.offsets[rows + iy0], self.offsets[rows + iy1]
+        # rows of the tile are contiguous runs of ids, and so are their offsets
+        offsets = (self.offsets[rows[:, None] + np.arange(iy0, iy1)[None, :]] - starts[:, None]
+                   + np.cumsum(ends - starts)[:, None] - (ends - starts)[:, None]).ravel()
+        offsets = np.append(offsets, np.sum(ends - starts)).astype(np.int64)
+        return offsets, np.concatenate([self.ids[s:e] for s, e in zip(starts, ends)] + [np.zeros(0, dtype=np.int64)])
@@ -1,34 +1,139 @@
 import json
-import sys
-sys.path.append("/modeling/al/bin")
-
 import numpy as np
-from parflow.tools.io import write_pfb, read_pfb
+
+from .pfbio import readPfb
 
 class TFG:
-    def __init__(self, x0, y0, dx, dy, nx, ny, dzs, demPfb):
-        # dz comes in from bottom to top
+    def __init__(self, x0, y0, dx, dy, nx, ny, dzs, demPfb=None, dem=None, ix0=0, iy0=0):
+        # dz comes in from bottom to top. dem, when given, is the (1, ny, nx) or (ny, nx) elevation array,
+        # and demPfb is then not read. Otherwise only the columns of this grid are read from demPfb.
+        # demPfb may be None for grids built in memory, see fromDem.
+        # ix0 and iy0 place a window of a larger grid, see window: column (ix, iy) of this grid is column
+        # (ix0+ix, iy0+iy) of the grid with origin (x0, y0), and of demPfb
+        if demPfb is None and dem is None:
+            raise ValueError("a terrain-following grid needs a DEM array or a DEM pfb file")
         self.x0 = x0
         self.y0 = y0
         self.dx = dx
         self.dy = dy
         self.nx = nx
         self.ny = ny
+        self.ix0 = ix0
+        self.iy0 = iy0
         self.nz = len(dzs)
         self.dzs = dzs
         self.totalThickness = np.sum(dzs)
-        self.zBottoms = [self.totalThickness]
+        zBottoms = [self.totalThickness]
         for i, dzThickness in enumerate(dzs):
             if i < self.nz - 1:
-                self.zBottoms.append(self.zBottoms[-1] - dzThickness)   
+                zBottoms.append(zBottoms[-1] - dzThickness)
+        # depth of each layer bottom below the land surface
+        self.zBottoms = np.array(zBottoms, dtype=np.float64)
+        self.dzArray = np.array(dzs, dtype=np.float64)
         self.demPfb = demPfb         
-        self.dem = read_pfb(demPfb)
+        if dem is None:
+            dem = readPfb(demPfb, (ix0, ix0+nx, iy0, iy0+ny))
+        elif np.ndim(dem) == 2:
+            dem = np.asarray(dem, dtype=np.float64)[None]
+        self.dem = dem
+        self._x_mid = None
+        self._y_mid = None
+        self._z_min = None
+        self._z_max = None
+        self._z_mid = None
+
+    # Vectorized geometry. Mid-point arrays are built on first use; the (nz, ny, nx) elevation arrays are
+    # built only when requested, and the *Column methods compute single columns for grids too big to
+    # hold them. Values are identical to the scalar accessors.
+
+    @property
+    def x_min(self):
+        return self.x0 + self.dx*np.arange(self.ix0, self.ix0+self.nx)
+
+    @property
+    def x_max(self):
+        return self.x_min + self.dx
+
+    @property
+    def x_mid(self):
+        if self._x_mid is None:
+            self._x_mid = (self.x_min + self.x_max) / 2.0
+        return self._x_mid
+
+    @property
+    def y_min(self):
+        return self.y0 + self.dy*np.arange(self.iy0, self.iy0+self.ny)
+
+    @property
+    def y_max(self):
+        return self.y_min + self.dy
+
+    @property
+    def y_mid(self):
+        if self._y_mid is None:
+            self._y_mid = (self.y_min + self.y_max) / 2.0
+        return self._y_mid
+
+    @property
+    def z_min(self):
+        if self._z_min is None:
+            self._z_min = self.dem[0][None, :self.ny, :self.nx] - self.zBottoms[:, None, None]
+        return self._z_min
+
+    @property
+    def z_max(self):
+        if self._z_max is None:
+            self._z_max = self.z_min + self.dzArray[:, None, None]
+            self._z_max[-1] = self.dem[0][:self.ny, :self.nx]
+        return self._z_max
+
+    @property
+    def z_mid(self):
+        if self._z_mid is None:
+            self._z_mid = (self.z_min + self.z_max) / 2.0
+        return self._z_mid
+
+    def zMinColumn(self, ix, iy):
+        """
+        Cell bottom elevations of a whole column, bottom to top. Values match zMin for each iz.
+        """
+        if self._z_min is not None:
+            return self._z_min[:, iy, ix]
+        return self.dem[0][iy][ix] - self.zBottoms
+
+    def zMaxColumn(self, ix, iy):
+        """
+        Cell top elevations of a whole column, bottom to top. Values match zMax for each iz.
+        """
+        if self._z_max is not None:
+            return self._z_max[:, iy, ix]
+        zMax = self.zMinColumn(ix, iy) + self.dzArray
+        zMax[-1] = self.dem[0][iy][ix]
+        return zMax
+
+    def zMinCells(self, ix, iy, iz):
+        """
+        Bulk version of zMin for index arrays ix, iy and iz of the same shape.
+        """
+        return self.dem[0][iy, ix] - self.zBottoms[iz]
+
+    def zMaxCells(self, ix, iy, iz):
+        """
+        Bulk version of zMax for index arrays ix, iy and iz of the same shape.
+        """
+        return np.where(iz == self.nz-1, self.dem[0][iy, ix], self.zMinCells(ix, iy, iz) + self.dzArray[iz])
+
+    def zMidCells(self, ix, iy, iz):
+        """
+        Bulk version of zMid for index arrays ix, iy and iz of the same shape (or broadcastable).
+        """
+        return (self.zMinCells(ix, iy, iz) + self.zMaxCells(ix, iy, iz)) / 2.0
 
     def cellCenter(self, ix, iy, iz):
         return self.xMid(ix), self.yMid(iy), self.zMid(ix, iy, iz)
 
     def xMin(self, ix):
-        return self.x0 + self.dx*ix
+        return self.x0 + self.dx*(self.ix0+ix)
 
     def xMax(self, ix):
         return self.xMin(ix) + self.dx
@@ -40,7 +145,7 @@ class TFG:
         return self.xMin(0), self.xMax(self.nx-1)
     
     def yMin(self, iy):
-        return self.y0 + self.dy*iy
+        return self.y0 + self.dy*(self.iy0+iy)
     
     def yMax(self, iy):
         return self.yMin(iy) + self.dy
@@ -62,38 +167,102 @@ class TFG:
     
     def zMid(self, ix, iy, iz):
         return (self.zMin(ix, iy, iz) + self.zMax(ix, iy, iz)) / 2.0
+
+    def zMidColumn(self, ix, iy):
+        """
+        Cell center elevations of a whole column, bottom to top. Values match zMid for each iz.
+        """
+        if self._z_mid is not None:
+            return self._z_mid[:, iy, ix]
+        return (self.zMinColumn(ix, iy) + self.zMaxColumn(ix, iy)) / 2.0
         
     def cellVolume(self, iz):
         return self.dx * self.dy * self.dzs[iz]
 
     def cellIndexFromPosition2D(self, x, y):
-        ix = int(np.floor((x - self.x_origin) / self.dx)) # 0-indexed
-        iy = int(np.floor((y - self.y_origin) / self.dy)) # 0-indexed
-        
-        if self.isValidIndex(ix, iy, 0):
-            return (ix, iy)
-        else:
+        ix, iy = self.cellIndicesFromPositions2D(np.array([x]), np.array([y]))
+        if ix[0] < 0:
             return None
+        return (int(ix[0]), int(iy[0]))
 
     def cellIndexFromPosition3D(self, x, y, z):
-        cell_idx_2d = self.cellIndexFromPosition2D(x, y)
-        
-        if cell_idx_2d is None:
+        ix, iy, iz = self.cellIndicesFromPositions3D(np.array([x]), np.array([y]), np.array([z]))
+        if ix[0] < 0:
             return None
-        else:
-            ix, iy = cell_idx_2d
+        return (int(ix[0]), int(iy[0]), int(iz[0]))
 
-        for iz in range(0, self.nz):
-            if self.zMin(ix, iy, iz) <= z and z < self.zMax(ix, iy, iz):
-                return (ix, iy, iz)
-        return None
+    def cellIndicesFromPositions2D(self, xs, ys):
+        """
+        Bulk version of cellIndexFromPosition2D.
+        :param xs: array of x-coordinates
+        :param ys: array of y-coordinates, same shape as xs
+        :return: arrays ix and iy (0-indexed), both -1 for points outside the grid
+        """
+        ix = np.floor((np.asarray(xs, dtype=np.float64) - self.x0) / self.dx).astype(np.int64) - self.ix0
+        iy = np.floor((np.asarray(ys, dtype=np.float64) - self.y0) / self.dy).astype(np.int64) - self.iy0
+        outside = (ix < 0) | (ix >= self.nx) | (iy < 0) | (iy >= self.ny)
+        ix[outside] = -1
+        iy[outside] = -1
+        return ix, iy
+
+    def cellIndicesFromPositions3D(self, xs, ys, zs):
+        """
+        Bulk version of cellIndexFromPosition3D. A point is in layer iz when zMin <= z < zMax.
+        :param xs: array of x-coordinates
+        :param ys: array of y-coordinates, same shape as xs
+        :param zs: array of elevations, same shape as xs
+        :return: arrays ix, iy and iz (0-indexed), all -1 for points outside the grid
+        """
+        zs = np.asarray(zs, dtype=np.float64)
+        ix, iy = self.cellIndicesFromPositions2D(xs, ys)
+        inside = ix >= 0
+        dem = np.where(inside, self.dem[0][np.maximum(iy, 0), np.maximum(ix, 0)], np.nan)
+
+        # zMin decreases with depth below the surface, so the layer is found by a search over zBottoms,
+        # then confirmed (or moved by one) with the same arithmetic as zMin and zMax
+        iz = len(self.zBottoms) - np.searchsorted(self.zBottoms[::-1], dem - zs, side="left") - 1
+        located = np.zeros(ix.shape, dtype=bool)
+        for shift in (0, -1, 1):
+            candidate = np.clip(iz + shift, 0, self.nz-1)
+            zMin = dem - self.zBottoms[candidate]
+            zMax = np.where(candidate == self.nz-1, dem, zMin + self.dzArray[candidate])
+            found = inside & ~located & (zMin <= zs) & (zs < zMax)
+            iz[found] = candidate[found]
+            located |= found
+        ix[~located], iy[~located], iz[~located] = -1, -1, -1
+        return ix, iy, iz
     
+    def window(self, ix0, ix1, iy0, iy1):
+        """
+        The grid of columns ix0..ix1-1 by iy0..iy1-1, with the matching window of the DEM. Coordinates are
+        computed from the same origin, so they are bitwise the same as those of the columns here.
+        """
+        dem = self.dem[:, iy0:iy1, ix0:ix1]
+        return TFG(self.x0, self.y0, self.dx, self.dy, ix1-ix0, iy1-iy0, self.dzs, dem=dem,
+                   ix0=self.ix0+ix0, iy0=self.iy0+iy0)
+
+    @staticmethod
+    def fromDem(dem, x0, y0, dx, dy, dzs):
+        """
+        Builds a terrain-following grid in memory, without a DEM file. The grid has one column per DEM cell.
+        :param dem: (ny, nx) or (1, ny, nx) array of land surface elevations
+        :param dzs: layer thicknesses, bottom to top
+        :return: the terrain-following grid. Tcl scripts for VTKs are not written for it, as they read
+            the DEM from a file
+        """
+        ny, nx = np.shape(dem)[-2:]
+        return TFG(x0, y0, dx, dy, nx, ny, list(dzs), dem=dem)
+
     @staticmethod
-    def fromJson(infile):
+    def fromJson(infile, dem=None, window=None, demPfb=None):
         """
         Read a terrain-following grid from json specification. Specification format will be intuitive from
         source code below
         :param infile: input filename
+        :param dem: optional DEM array, already read from the pfb named in the specification
+        :param window: optional (ix0, ix1, iy0, iy1) columns of the grid to return, as TFG.window does. Only
+            that part of the DEM pfb is read
+        :param demPfb: optional DEM pfb to read instead of the one named in the specification
         :return: the first value is the terrain-following grid class instance on success, and None and failure.
             The second return value is None on success, and an error message on failure.
         """
@@ -107,8 +276,14 @@ class TFG:
                 nx = j["nx"]
                 ny = j["ny"]
                 dzs = j["dzs"]
-                demPfb = j["dem"]
-                tfg = TFG(x0, y0, dx, dy, nx, ny, dzs, demPfb)
+                demPfb = demPfb if demPfb is not None else j["dem"]
+                if window is not None:
+                    ix0, ix1, iy0, iy1 = window
+                    if not (0 <= ix0 <= ix1 <= nx and 0 <= iy0 <= iy1 <= ny):
+                        raise ValueError("window %s is outside the %d by %d columns of the grid" %(window, nx, ny))
+                    tfg = TFG(x0, y0, dx, dy, ix1-ix0, iy1-iy0, dzs, demPfb, dem, ix0, iy0)
+                else:
+                    tfg = TFG(x0, y0, dx, dy, nx, ny, dzs, demPfb, dem)
                 return tfg, None
             except Exception as e:
                 error_message = str(e)
@@ -0,0 +1,211 @@
+# Writers for VTK files of mapped volumes, draped on the terrain-following grid.
+#
+# Cells are written as hexahedra with the geometry the engines classify: the x and y bounds of the
+# column and, in z, the layer bounds below the DEM elevation of that column (TFG.zMinCells and
+# zMaxCells). Neighboring columns have their own corners, so each column is a flat-topped prism, as in
+# the approximate faces of export.py. The four corners of a layer boundary are shared by the cells above
+# and below it.
+#
+# Points and cells are built with array operations a block of layers at a time and streamed to disk, so
+# the indicator array is the only full-size input. With insideOnly, only cells with a nonzero value are
+# written, with the points they use; otherwise cells are written in the order of the pfb file.
+#
+#   vtk  legacy binary (big endian) unstructured grid
+#   vtu  XML unstructured grid with raw appended data (little endian, 64-bit offsets)
+#   tcl  no VTK: the tcl script that has ParFlow's pfvtksave build one, see pfb2vtk.py
+
+import numpy as np
+
+from .pfb2vtk import renderVtkGen
+
+VTK_FORMATS = ["tcl", "vtk", "vtu"]
+
+# Cells built per block. Blocks are whole layers, at least one
+CHUNK_CELLS = 1 << 20
+
+# Point indices of legacy files are 32-bit. Larger grids need vtu, which has 64-bit ones
+LEGACY_MAX_POINTS = 1 << 31
+
+VTK_HEXAHEDRON = 12
+
+# Corners of a layer boundary in VTK hexahedron order as (x, y) flags: 0 selects the column's lower
+# bound, 1 its upper bound
+BOUNDARY_CORNERS = np.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+
+LEGACY_TYPES = {"u1": "unsigned_char", "i1": "char", "u2": "unsigned_short", "i2": "short",
+                "u4": "unsigned_int", "i4": "int", "u8": "vtktypeuint64", "i8": "vtktypeint64",
+                "f4": "float", "f8": "double"}
+XML_TYPES = {"u1": "UInt8", "i1": "Int8", "u2": "UInt16", "i2": "Int16", "u4": "UInt32", "i4": "Int32",
+             "u8": "UInt64", "i8": "Int64", "f4": "Float32", "f8": "Float64"}
+
+class DrapedCells:
+    def __init__(self, tfg, values, insideOnly=False):
+        """
+        :param tfg: the terrain-following grid
+        :param values: (nz, ny, nx) cell values, e.g. indicators or labels
+        :param insideOnly: write only cells with a nonzero value
+        """
+        self.tfg = tfg
+        self.values = values
+        nz = tfg.nz
+        self.selected = values != 0 if insideOnly else np.ones(values.shape, dtype=bool)
+        # layer boundaries of each column that selected cells use, bottom (0) to top (nz)
+        self.boundaries = np.zeros((nz+1, tfg.ny, tfg.nx), dtype=bool)
+        self.boundaries[:-1] |= self.selected
+        self.boundaries[1:] |= self.selected
+        counts = np.count_nonzero(self.boundaries.reshape(nz+1, -1), axis=1)
+        # index of the first used boundary of each level, in order of level, iy and ix
+        self.boundaryStart = np.concatenate([[0], np.cumsum(counts)])
+        self.npoints = 4*int(self.boundaryStart[-1])
+        self.ncells = int(np.count_nonzero(self.selected))
+        self.layersPerBlock = max(1, CHUNK_CELLS // (tfg.nx*tfg.ny))
+
+    def pointBlocks(self):
+        """
+        :return: generator of (n, 3) point coordinates, four per used layer boundary
+        """
+        tfg = self.tfg
+        for k0 in range(0, tfg.nz+1, self.layersPerBlock):
+            k, iy, ix = np.nonzero(self.boundaries[k0:k0+self.layersPerBlock])
+            k += k0
+            z = np.where(k < tfg.nz, tfg.zMinCells(ix, iy, np.minimum(k, tfg.nz-1)), tfg.dem[0][iy, ix])
+            points = np.empty((len(k), 4, 3))
+            points[:, :, 0] = tfg.x_min[ix][:, None] + tfg.dx*BOUNDARY_CORNERS[:, 0]
+            points[:, :, 1] = tfg.y_min[iy][:, None] + tfg.dy*BOUNDARY_CORNERS[:, 1]
+            points[:, :, 2] = z[:, None]
+            yield points.reshape(-1, 3)
+
+    def cellBlocks(self):
+        """
+        :return: generator of (n, 8) zero-based point indices of hexahedra, in VTK order
+        """
+        tfg = self.tfg
+        for iz0 in range(0, tfg.nz, self.layersPerBlock):
+            iz1 = min(iz0 + self.layersPerBlock, tfg.nz)
+            iz, iy, ix = np.nonzero(self.selected[iz0:iz1])
+            window = self.boundaries[iz0:iz1+1]
+            ids = np.zeros(window.shape, dtype=np.int64)
+            ids[window] = np.arange(self.boundaryStart[iz0], self.boundaryStart[iz1+1])
+            bottom, top = ids[iz, iy, ix], ids[iz+1, iy, ix]
+            yield np.concatenate([4*bottom[:, None] + np.arange(4), 4*top[:, None] + np.arange(4)], axis=1)
+
+    def valueBlocks(self):
+        """
+        :return: generator of the values of the cells of each block of cellBlocks
+        """
+        for iz0 in range(0, self.tfg.nz, self.layersPerBlock):
+            iz1 = iz0 + self.layersPerBlock
+            yield self.values[iz0:iz1][self.selected[iz0:iz1]]
+
+def writeLegacyVtk(outfile, cells, name):
+    """
+    Writes draped cells as a binary legacy VTK file.
+    :param outfile: output filename
+    :param cells: DrapedCells
+    :param name: name of the cell values
+    """
+    if cells.npoints > LEGACY_MAX_POINTS:
+        raise ValueError("%d points do not fit the 32-bit indices of a legacy VTK file. Use -vtk vtu, or "
+                         "-vtkInside" %cells.npoints)
+    code = cells.values.dtype.str[1:]
+    with open(outfile, "wb") as f:
+        f.write(("# vtk DataFile Version 3.0\n"
+                 "%s\n"
+                 "BINARY\n"
+                 "DATASET UNSTRUCTURED_GRID\n"
+                 "POINTS %d double\n" %(name, cells.npoints)).encode("ascii"))
+        for points in cells.pointBlocks():
+            f.write(points.astype(">f8").tobytes())
+        f.write(("\nCELLS %d %d\n" %(cells.ncells, 9*cells.ncells)).encode("ascii"))
+        for hexes in cells.cellBlocks():
+            records = np.empty((len(hexes), 9), dtype=">i4")
+            records[:, 0] = 8
+            records[:, 1:] = hexes
+            f.write(records.tobytes())
+        f.write(("\nCELL_TYPES %d\n" %cells.ncells).encode("ascii"))
+        for values in cells.valueBlocks():
+            f.write(np.full(len(values), VTK_HEXAHEDRON, dtype=">i4").tobytes())
+        f.write(("\nCELL_DATA %d\n"
+                 "SCALARS %s %s 1\n"
+                 "LOOKUP_TABLE default\n" %(cells.ncells, name, LEGACY_TYPES[code])).encode("ascii"))
+        for values in cells.valueBlocks():
+            f.write(values.astype(">" + code).tobytes())
+        f.write(b"\n")
+
+def writeVtu(outfile, cells, name):
+    """
+    Writes draped cells as an XML unstructured grid with raw appended data. Arguments are the same as
+    for writeLegacyVtk.
+    """
+    code = cells.values.dtype.str[1:]
+    itemsize = cells.values.dtype.itemsize
+    # each appended array is its size in bytes as a UInt64 followed by the data
+    sizes = [24*cells.npoints, 64*cells.ncells, 8*cells.ncells, cells.ncells, itemsize*cells.ncells]
+    offsets = np.concatenate([[0], np.cumsum(np.array(sizes) + 8)])
+    header = ('<?xml version="1.0"?>\n'
+              '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+              '  <UnstructuredGrid>\n'
+              '    <Piece NumberOfPoints="%d" NumberOfCells="%d">\n'
+              '      <Points>\n'
+              '        <DataArray type="Float64" NumberOfComponents="3" format="appended" offset="%d"/>\n'
+              '      </Points>\n'
+              '      <Cells>\n'
+              '        <DataArray type="Int64" Name="connectivity" format="appended" offset="%d"/>\n'
+              '        <DataArray type="Int64" Name="offsets" format="appended" offset="%d"/>\n'
+              '        <DataArray type="UInt8" Name="types" format="appended" offset="%d"/>\n'
+              '      </Cells>\n'
+              '      <CellData Scalars="%s">\n'
+              '        <DataArray type="%s" Name="%s" format="appended" offset="%d"/>\n'
+              '      </CellData>\n'
+              '    </Piece>\n'
+              '  </UnstructuredGrid>\n'
+              '  <AppendedData encoding="raw">\n'
+              '   _') %(cells.npoints, cells.ncells, offsets[0], offsets[1], offsets[2], offsets[3],
+                         name, XML_TYPES[code], name, offsets[4])
+
+    with open(outfile, "wb") as f:
+        def size(i):
+            f.write(np.array([sizes[i]], dtype="<u8").tobytes())
+
+        f.write(header.encode("ascii"))
+        size(0)
+        for points in cells.pointBlocks():
+            f.write(points.astype("<f8").tobytes())
+        size(1)
+        for hexes in cells.cellBlocks():
+            f.write(hexes.astype("<i8").tobytes())
+        size(2)
+        written = 0
+        for values in cells.valueBlocks():
+            f.write((8*np.arange(written+1, written+len(values)+1, dtype="<i8")).tobytes())
+            written += len(values)
+        size(3)
+        for values in cells.valueBlocks():
+            f.write(np.full(len(values), VTK_HEXAHEDRON, dtype="u1").tobytes())
+        size(4)
+        for values in cells.valueBlocks():
+            f.write(values.astype("<" + code).tobytes())
+        f.write(b"\n  </AppendedData>\n</VTKFile>\n")
+
+def writeVolumeVtk(tfg, values, output_root, vtkFormat="tcl", insideOnly=False, name="indicator"):
+    """
+    Writes the VTK of a mapped volume whose values were written to <output_root>.pfb.
+    :param tfg: the terrain-following grid
+    :param values: (nz, ny, nx) cell values
+    :param output_root: root name of the output files. Writes <output_root>.vtk or .vtu, or with 'tcl' the
+        script <output_root>.gen_vtk.tcl that builds <output_root>.vtk. The script needs the DEM pfb, so
+        grids built in memory get none
+    :param vtkFormat: one of VTK_FORMATS
+    :param insideOnly: write only cells with a nonzero value. Does not apply to 'tcl'
+    :param name: name of the cell values
+    """
+    if vtkFormat == "tcl":
+        if tfg.demPfb is not None:
+            renderVtkGen("%s.pfb" %output_root, "%s.vtk" %output_root, tfg.demPfb, tfg.dzs,
+                         "%s.gen_vtk.tcl" %output_root)
+        return
+    cells = DrapedCells(tfg, values, insideOnly)
+    if vtkFormat == "vtu":
+        writeVtu("%s.vtu" %output_root, cells, name)
+    else:
+        writeLegacyVtk("%s.vtk" %output_root, cells, name)
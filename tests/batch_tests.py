@@ -0,0 +1,86 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.batch import GeometryBatch, readManifest
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+
+class TestGeometryBatch(unittest.TestCase):
+    def setUp(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        self.tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        dodecahedron, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        shifted = TriangulatedSurface(dodecahedron.verts + [0.9, 0.6, -0.3], dodecahedron.faces)
+        self.surfaces = [dodecahedron, shifted]
+        self.entries = [
+            {"obj": "a.obj", "id": 3, "priority": 0, "name": "a", "indicator": True},
+            {"obj": "b.obj", "id": 7, "priority": 1, "name": "b", "indicator": False},
+        ]
+
+    def test_labels_match_single_runs(self):
+        a, b = [ts.mapVolume(self.tfg, "column") for ts in self.surfaces]
+        self.assertGreater(np.sum(a * b), 0, "geometries should overlap")
+        batch = GeometryBatch(self.surfaces, self.entries)
+        labels, indicators = batch.mapLabels(self.tfg)
+        # b has the higher priority, so it wins the overlap
+        expected = np.where(b == 1, 7, np.where(a == 1, 3, 0))
+        self.assertTrue(np.array_equal(labels, expected))
+        self.assertEqual(list(indicators.keys()), ["a"])
+        self.assertTrue(np.array_equal(indicators["a"], a))
+
+    def test_priority_tie_goes_to_first(self):
+        self.entries[1]["priority"] = 0
+        labels, _ = GeometryBatch(self.surfaces, self.entries).mapLabels(self.tfg)
+        a = self.surfaces[0].mapVolume(self.tfg, "column")
+        self.assertTrue(np.all(labels[a == 1] == 3))
+
+    def test_read_manifest(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name in ["a.obj", "b.obj"]:
+                open(os.path.join(tmp, name), "w").close()
+            manifest = os.path.join(tmp, "manifest.json")
+            with open(manifest, "w") as f:
+                json.dump({"geometries": [{"obj": "a.obj", "indicator": True}, {"obj": "b.obj", "id": 9}]}, f)
+            entries, err = readManifest(manifest)
+            self.assertIsNone(err)
+            self.assertEqual([e["id"] for e in entries], [1, 9])
+            self.assertEqual([e["name"] for e in entries], ["a", "b"])
+            self.assertEqual(entries[1]["obj"], os.path.join(tmp, "b.obj"))
+
+            # indicators are written to <root>.<name>.pfb, so their names must differ
+            os.mkdir(os.path.join(tmp, "other"))
+            open(os.path.join(tmp, "other", "a.obj"), "w").close()
+            with open(manifest, "w") as f:
+                json.dump({"geometries": [{"obj": "a.obj", "indicator": True},
+                                          {"obj": "other/a.obj", "indicator": True}]}, f)
+            entries, err = readManifest(manifest)
+            self.assertIsNone(entries)
+            self.assertIn("named 'a'", err)
+            with open(manifest, "w") as f:
+                json.dump({"geometries": [{"obj": "a.obj", "indicator": True}, {"obj": "b.obj", "name": "a"}]}, f)
+            _, err = readManifest(manifest)
+            self.assertIsNone(err)
+            with open(manifest, "w") as f:
+                json.dump({"geometries": [{"obj": "a.obj", "name": "x", "indicator": True},
+                                          {"obj": "b.obj", "name": "x", "indicator": True}]}, f)
+            _, err = readManifest(manifest)
+            self.assertIn("named 'x'", err)
+
+            with open(manifest, "w") as f:
+                json.dump({"geometries": [{"obj": "missing.obj"}]}, f)
+            entries, err = readManifest(manifest)
+            self.assertIsNone(entries)
+            self.assertIsNotNone(err)
+
+if __name__ == "__main__":
+    unittest.main()
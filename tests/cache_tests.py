@@ -0,0 +1,86 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.cache import Cache
+from src.pfgm import TriangulatedSurface
+from src.spatial import INDEX_KINDS
+from src.tfg import TFG
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        self.obj = os.path.join(self.exampleDir, "dodecahedron.obj")
+        self.cache = Cache(os.path.join(self.dir.name, "cache"))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_surface_roundtrip(self):
+        expected, _ = TriangulatedSurface.fromObj(self.obj)
+        first, err = self.cache.loadSurface(self.obj)
+        self.assertIsNone(err)
+        second, err = self.cache.loadSurface(self.obj)
+        self.assertIsNone(err)
+        self.assertEqual(first.cacheKey, second.cacheKey)
+        # reloaded arrays are read-only views of the memory-mapped files
+        self.assertFalse(second.verts.flags.owndata)
+        self.assertFalse(second.verts.flags.writeable)
+        for ts in [first, second]:
+            self.assertTrue(np.array_equal(ts.verts, expected.verts))
+            self.assertTrue(np.array_equal(ts.faces, expected.faces))
+
+    def test_missing_obj(self):
+        ts, err = self.cache.loadSurface(os.path.join(self.dir.name, "missing.obj"))
+        self.assertIsNone(ts)
+        self.assertIsNotNone(err)
+
+    def test_tfg_roundtrip(self):
+        cwd = os.getcwd()
+        os.chdir(self.exampleDir)
+        try:
+            expected, _ = TFG.fromJson("tfg.json")
+            self.cache.loadTfg("tfg.json")
+            tfg, err = self.cache.loadTfg("tfg.json")
+        finally:
+            os.chdir(cwd)
+        self.assertIsNone(err)
+        self.assertIsInstance(tfg.dem, np.memmap)
+        self.assertTrue(np.array_equal(tfg.z_mid, expected.z_mid))
+
+    def test_index_roundtrip(self):
+        tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(self.exampleDir, "dem.pfb"))
+        for indexKind in INDEX_KINDS:
+            for kind in ["volume", "surface"]:
+                expected, _ = TriangulatedSurface.fromObj(self.obj)
+                expected.indexKind = indexKind
+                for _ in range(2):
+                    ts, _ = self.cache.loadSurface(self.obj, indexKind)
+                    self.cache.prepareIndex(ts, tfg, kind)
+                    self.assertIn(ts.columnIndexKey(tfg, kind), ts.columnIndexes)
+                    for ix in range(tfg.nx-1):
+                        for iy in range(tfg.ny-1):
+                            self.assertEqual(sorted(ts.columnIndex(tfg, kind).candidates(ix, iy)),
+                                             sorted(expected.columnIndex(tfg, kind).candidates(ix, iy)))
+
+    def test_evicts_least_recently_used(self):
+        cache = Cache(os.path.join(self.dir.name, "small"), maxBytes=2000)
+        for key in ["a", "b", "c"]:
+            # about 900 bytes each
+            cache.store(key, {"x": np.zeros(100)})
+            time.sleep(0.01)
+        self.assertIsNone(cache.lookup("a"))
+        self.assertIsNotNone(cache.lookup("c"))
+
+if __name__ == "__main__":
+    unittest.main()
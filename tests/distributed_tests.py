@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from parflow.tools.io import read_pfb
+
+from src.distributed import PLAN_FILE, mergeJobs, planJobs, runJob
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+
+def writeTfg(path, demPath, nx, ny, dzs, x0, y0, dx, dy):
+    with open(path, "w") as f:
+        json.dump({"x": x0, "y": y0, "nx": nx, "ny": ny, "dx": dx, "dy": dy, "dzs": dzs, "dem": demPath}, f)
+    tfg, _ = TFG.fromJson(path)
+    return tfg
+
+class TestDistributed(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.planDir = os.path.join(self.dir.name, "plan")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def runPlan(self, ts, tfg, kind, subgrids, engine):
+        self.assertIsNone(planJobs(ts, tfg, kind, os.path.join(self.dir.name, "tfg.json"), self.planDir, subgrids))
+        with open(os.path.join(self.planDir, PLAN_FILE), "r") as f:
+            plan = json.load(f)
+        for job in plan["jobs"]:
+            self.assertIsNone(runJob(os.path.join(self.planDir, job["job"]), engine, indexKind="bins"))
+        return plan
+
+    def test_volume_matches_single_run(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        tfg = writeTfg(os.path.join(self.dir.name, "tfg.json"), os.path.join(exampleDir, "dem.pfb"),
+                       23, 19, [0.3]*20, -3.0, -3.0, 0.3, 0.3)
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        expected = ts.mapVolume(tfg, "column")
+
+        plan = self.runPlan(ts, tfg, "volume", (3, 2, 1), "voxel")
+        self.assertGreater(len(plan["jobs"]), 1)
+        root = os.path.join(self.dir.name, "merged")
+        self.assertIsNone(mergeJobs(self.planDir, root, (1, 1, 1)))
+        self.assertTrue(np.array_equal(read_pfb(root + ".pfb"), expected))
+
+        # the plan's own subgrids by default
+        self.assertIsNone(mergeJobs(self.planDir, root))
+        with open(root + ".pfb.dist", "r") as f:
+            self.assertEqual(len(f.readlines()), 6)
+        self.assertTrue(np.array_equal(read_pfb(root + ".pfb"), expected))
+
+    def test_surface_matches_single_run(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "wavy")
+        tfg = writeTfg(os.path.join(self.dir.name, "tfg.json"), os.path.join(exampleDir, "dem.pfb"),
+                       12, 9, [0.25]*12, -1.5, -1.1, 0.27, 0.26)
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "wavy.obj"))
+        expected = ts.mapSurface(tfg, "segment")
+
+        self.runPlan(ts, tfg, "surface", (4, 3, 1), "segment")
+        root = os.path.join(self.dir.name, "merged")
+        self.assertIsNone(mergeJobs(self.planDir, root, (1, 1, 1)))
+        self.assertGreater(np.sum(expected[2]), 0)
+        for dim, indi in zip(["x", "y", "z"], expected):
+            self.assertTrue(np.array_equal(read_pfb("%s.%s.pfb" %(root, dim)), indi))
+
+    def test_relative_dem(self):
+        # the json names its DEM relative to the directory the plan is made in, the merge runs elsewhere
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        shutil.copy(os.path.join(exampleDir, "dem.pfb"), os.path.join(self.dir.name, "dem.pfb"))
+        cwd = os.getcwd()
+        self.addCleanup(os.chdir, cwd)
+        os.chdir(self.dir.name)
+        tfg = writeTfg("tfg.json", "dem.pfb", 23, 19, [0.3]*20, -3.0, -3.0, 0.3, 0.3)
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        self.runPlan(ts, tfg, "volume", (2, 2, 1), "voxel")
+
+        os.chdir(self.planDir)
+        root = os.path.join(self.dir.name, "merged")
+        self.assertIsNone(mergeJobs(self.planDir, root, (1, 1, 1)))
+        self.assertTrue(np.array_equal(read_pfb(root + ".pfb"), ts.mapVolume(tfg, "column")))
+
+    def test_missing_result(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        tfg = writeTfg(os.path.join(self.dir.name, "tfg.json"), os.path.join(exampleDir, "dem.pfb"),
+                       20, 20, [0.3]*20, -3.0, -3.0, 0.3, 0.3)
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        self.assertIsNone(planJobs(ts, tfg, "volume", os.path.join(self.dir.name, "tfg.json"), self.planDir, (2, 2, 1)))
+        err = mergeJobs(self.planDir, os.path.join(self.dir.name, "merged"))
+        self.assertIn("missing", err)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+sys.path.append(ROOT_DIR)
+
+from src.export import approxFaces, writeApproxFaces
+from src.tfg import TFG
+
+class TestApproxFaces(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.tfg = TFG(0.0, 1.0, 1.0, 1.0, 3, 4, [2, 1, 0.5, 0.2], os.path.join(TEST_DIR, "test_dem.pfb"))
+        shape = (self.tfg.nz, self.tfg.ny, self.tfg.nx)
+        self.indi = [np.zeros(shape, dtype=np.uint8) for _ in range(3)]
+        # a barrier between columns 0 and 1 of the bottom two layers, then capping column (1, 1)
+        self.indi[0][0:2, 1, 0] = 1
+        self.indi[0][0:2, 2, 0] = 1
+        self.indi[2][1, 1, 1] = 1
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def perCellQuads(self):
+        # quads as written by the original per-cell exporter, 4 corners each
+        tfg = self.tfg
+        quads = []
+        for ix in range(tfg.nx):
+            for iy in range(tfg.ny):
+                for iz in range(tfg.nz):
+                    xmin, xmax = tfg.xMin(ix), tfg.xMax(ix)
+                    ymin, ymax = tfg.yMin(iy), tfg.yMax(iy)
+                    zmin, zmax = tfg.zMin(ix, iy, iz), tfg.zMax(ix, iy, iz)
+                    if self.indi[0][iz, iy, ix] == 1:
+                        quads.append([(xmax, ymin, zmin), (xmax, ymin, zmax), (xmax, ymax, zmax), (xmax, ymax, zmin)])
+                    if self.indi[1][iz, iy, ix] == 1:
+                        quads.append([(xmin, ymax, zmin), (xmin, ymax, zmax), (xmax, ymax, zmax), (xmax, ymax, zmin)])
+                    if self.indi[2][iz, iy, ix] == 1:
+                        quads.append([(xmin, ymin, zmax), (xmax, ymin, zmax), (xmax, ymax, zmax), (xmin, ymax, zmax)])
+        return np.array(quads)
+
+    def test_matches_per_cell(self):
+        verts, quads = approxFaces(self.tfg, *self.indi)
+        self.assertTrue(np.array_equal(verts[quads], self.perCellQuads()))
+        self.assertEqual(len(np.unique(verts, axis=0)), len(verts))
+        self.assertLess(len(verts), 4 * len(quads))
+
+    def test_write_obj(self):
+        path = os.path.join(self.dir.name, "faces.obj")
+        writeApproxFaces(self.tfg, *self.indi, path)
+        verts, faces = [], []
+        with open(path, "r") as f:
+            for line in f:
+                tokens = line.split()
+                if tokens[0] == "v":
+                    verts.append([float(t) for t in tokens[1:]])
+                else:
+                    faces.append([int(t) - 1 for t in tokens[1:]])
+        self.assertTrue(np.allclose(np.array(verts)[faces], self.perCellQuads(), atol=1e-6))
+
+    def test_write_ply(self):
+        path = os.path.join(self.dir.name, "faces.ply")
+        writeApproxFaces(self.tfg, *self.indi, path, "ply")
+        verts, quads = approxFaces(self.tfg, *self.indi)
+        with open(path, "rb") as f:
+            data = f.read()
+        end = data.index(b"end_header\n") + len(b"end_header\n")
+        header = data[:end].decode("ascii")
+        self.assertIn("element vertex %d\n" %len(verts), header)
+        self.assertIn("element face %d\n" %len(quads), header)
+        plyVerts = np.frombuffer(data, dtype="<f8", count=3*len(verts), offset=end).reshape(-1, 3)
+        faceType = np.dtype([("n", "u1"), ("v", "<i4", (4,))])
+        plyFaces = np.frombuffer(data, dtype=faceType, offset=end + plyVerts.nbytes)
+        self.assertTrue(np.array_equal(plyVerts, verts))
+        self.assertTrue(np.array_equal(plyFaces["v"], quads))
+
+if __name__ == "__main__":
+    unittest.main()
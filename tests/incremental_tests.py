@@ -0,0 +1,106 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.incremental import affectedColumns, changedTriangles, columnTiles, remap
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+
+def readExample(name, obj):
+    cwd = os.getcwd()
+    os.chdir(os.path.join(EXAMPLES_DIR, name))
+    try:
+        ts, _ = TriangulatedSurface.fromObj(obj)
+        tfg, _ = TFG.fromJson("tfg.json")
+    finally:
+        os.chdir(cwd)
+    return ts, tfg
+
+def withDem(tfg, dem):
+    return TFG(tfg.x0, tfg.y0, tfg.dx, tfg.dy, tfg.nx, tfg.ny, tfg.dzs, tfg.demPfb, dem)
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.ts, self.tfg = readExample("dodecahedron", "dodecahedron.obj")
+
+    def test_reordered_faces_unchanged(self):
+        reordered = TriangulatedSurface(self.ts.verts, self.ts.faces[::-1])
+        removed, added = changedTriangles(self.ts, reordered)
+        self.assertFalse(np.any(removed))
+        self.assertFalse(np.any(added))
+        mask, reason = affectedColumns(self.ts, self.tfg, reordered, self.tfg, "volume")
+        self.assertIsNone(reason)
+        self.assertFalse(np.any(mask))
+
+    def test_moved_vertex(self):
+        verts = self.ts.verts.copy()
+        i = np.argmin(verts[:, 2])
+        verts[i, 0] += 0.3
+        moved = TriangulatedSurface(verts, self.ts.faces)
+        removed, added = changedTriangles(self.ts, moved)
+        expected = np.any(self.ts.faces == i, axis=1)
+        self.assertTrue(np.array_equal(removed, expected))
+        self.assertTrue(np.array_equal(added, expected))
+
+    def test_layout_change_remaps_everything(self):
+        tfg = TFG(self.tfg.x0, self.tfg.y0, self.tfg.dx, self.tfg.dy, self.tfg.nx, self.tfg.ny,
+                  self.tfg.dzs[1:], self.tfg.demPfb, self.tfg.dem)
+        mask, reason = affectedColumns(self.ts, self.tfg, self.ts, tfg, "volume")
+        self.assertIsNotNone(reason)
+        self.assertTrue(np.all(mask))
+
+    def test_column_tiles(self):
+        mask = np.zeros((4, 5), dtype=bool)
+        mask[0, 1:3] = True
+        mask[2, 0] = mask[2, 4] = True
+        mask[3, :] = True
+        self.assertEqual(columnTiles(mask), [(0, 1, 1, 3), (2, 3, 0, 1), (2, 3, 4, 5), (3, 4, 0, 5)])
+
+class TestRemap(unittest.TestCase):
+    def test_volume_matches_full_run(self):
+        ts, tfg = readExample("dodecahedron", "dodecahedron.obj")
+        previous = ts.mapVolume(tfg, "column")
+
+        verts = ts.verts.copy()
+        verts[np.argmin(verts[:, 2])] += [0.3, -0.2, 0.1]
+        moved = TriangulatedSurface(verts, ts.faces)
+        dem = np.array(tfg.dem)
+        dem[0, 40:45, 50:60] += 0.07
+        changed = withDem(tfg, dem)
+
+        mask, reason = affectedColumns(ts, tfg, moved, changed, "volume")
+        self.assertIsNone(reason)
+        self.assertLess(np.count_nonzero(mask), mask.size // 10)
+        expected = moved.mapVolume(changed, "column")
+        for jobs in [1, 2]:
+            indi, = remap(moved, changed, "volume", [previous.copy()], mask, "column", jobs)
+            self.assertTrue(np.array_equal(indi, expected))
+
+    def test_surface_matches_full_run(self):
+        ts, tfg = readExample("wavy", "wavy.obj")
+        ts.indexKind = "bins"
+        previous = ts.mapSurface(tfg, "segment")
+
+        verts = ts.verts.copy()
+        verts[(np.abs(verts[:, 0]) < 0.3) & (np.abs(verts[:, 1]) < 0.3), 2] += 0.15
+        moved = TriangulatedSurface(verts, ts.faces, "bins")
+        dem = np.array(tfg.dem)
+        dem[0, 10:12, 20:22] += 0.2
+        changed = withDem(tfg, dem)
+
+        mask, reason = affectedColumns(ts, tfg, moved, changed, "surface")
+        self.assertIsNone(reason)
+        expected = moved.mapSurface(changed, "segment")
+        patched = remap(moved, changed, "surface", [a.copy() for a in previous], mask, "segment")
+        for indi, full in zip(patched, expected):
+            self.assertTrue(np.array_equal(indi, full))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from parflow.tools.io import read_pfb
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src import jit
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+
+# The 'numba' engines fall back to the NumPy engines without numba, so these tests pass either way but
+# only cover the compiled kernels when numba is installed
+
+class TestKernels(unittest.TestCase):
+    def test_segment_hits(self):
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(EXAMPLES_DIR, "dodecahedron", "dodecahedron.obj"))
+        rng = np.random.default_rng(7)
+        origins = rng.uniform(-2, 2, (200, 3))
+        ends = rng.uniform(-2, 2, (200, 3))
+        # vertical and axis-aligned segments, as the engines cast them
+        ends[:50, :2] = origins[:50, :2]
+        ends[50:100, 1:] = origins[50:100, 1:]
+        tIds = np.arange(len(ts.faces), dtype=np.int64)
+        expected = np.count_nonzero(ts.segmentsIntersect(origins, ends, tIds), axis=1)
+        self.assertGreater(np.sum(expected), 0)
+        for i in range(len(origins)):
+            self.assertEqual(jit.segmentHits(*origins[i], *ends[i], tIds, ts.v0, ts.edge1, ts.edge2), expected[i])
+
+class TestNumbaEngines(unittest.TestCase):
+    def test_dodecahedron(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        expected = ts.mapVolume(tfg, "ray")
+        self.assertGreater(np.sum(expected), 0)
+        for indexKind in ["rtree", "bins"]:
+            ts.indexKind = indexKind
+            self.assertTrue(np.array_equal(ts.mapVolume(tfg, "numba"), expected))
+        self.assertTrue(np.array_equal(ts.mapVolume(tfg, "numba", jobs=2), expected))
+
+    def test_gourd_window(self):
+        # columns through the middle of the gourd on the example's own grid
+        exampleDir = os.path.join(EXAMPLES_DIR, "gourd")
+        full, _ = TFG.fromJson(os.path.join(exampleDir, "tfg.json"), dem=read_pfb(os.path.join(exampleDir, "dem.pfb")))
+        tfg = full.window(140, 152, 190, 205)
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "gourd.obj"))
+        ts.indexKind = "bins"
+        expected = ts.mapVolume(tfg, "column")
+        self.assertGreater(np.sum(expected), 0)
+        self.assertTrue(np.array_equal(ts.mapVolume(tfg, "numba"), expected))
+        self.assertTrue(np.array_equal(ts.mapVolume(tfg, "ray")[::10], expected[::10]))
+
+    def test_wavy(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "wavy")
+        tfg = TFG(-1.5, -1.1, 0.27, 0.26, 12, 9, [0.25]*12, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "wavy.obj"))
+        expected = ts.mapSurface(tfg, "ray")
+        self.assertGreater(np.sum(expected[2]), 0)
+        for indexKind in ["rtree", "bins"]:
+            ts.indexKind = indexKind
+            for indi, expectedIndi in zip(ts.mapSurface(tfg, "numba"), expected):
+                self.assertTrue(np.array_equal(indi, expectedIndi))
+        for indi, expectedIndi in zip(ts.mapSurface(tfg, "numba", jobs=2), expected):
+            self.assertTrue(np.array_equal(indi, expectedIndi))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.meshio import STL_RECORD, fanTriangles, readMesh, readObj, writeNpz
+from src.pfgm import TriangulatedSurface
+
+# unit square split into two triangles, and the same square as one quad
+SQUARE = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], dtype=np.float64)
+TRIANGLES = np.array([[0, 1, 2], [0, 2, 3]])
+
+def readLines(infile):
+    # reference reader for plain triangle OBJs, one line at a time
+    verts, faces = [], []
+    with open(infile, "r") as f:
+        for line in f:
+            if line.startswith("v "):
+                verts.append(list(map(float, line.split()[1:4])))
+            if line.startswith("f "):
+                faces.append([int(n) - 1 for n in line.split()[1:]])
+    return np.array(verts), np.array(faces)
+
+class TestObj(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def read(self, text):
+        path = os.path.join(self.dir.name, "mesh.obj")
+        with open(path, "w") as f:
+            f.write(text)
+        return readObj(path)
+
+    def test_examples(self):
+        for name in ["dodecahedron", "gourd", "wavy"]:
+            path = os.path.join(EXAMPLES_DIR, name, name + ".obj")
+            (verts, faces), err = readObj(path)
+            self.assertIsNone(err)
+            expectedVerts, expectedFaces = readLines(path)
+            self.assertTrue(np.array_equal(verts, expectedVerts))
+            self.assertTrue(np.array_equal(faces, expectedFaces))
+
+    def test_quad_slashes_negative(self):
+        text = ("# square\nvn 0 0 1\nvt 0 0\n"
+                "v 0 0 0\nv 1 0 0 1.0\nv\t1 1 0\r\nv 0 1 0 0.5 0.5 0.5\n"
+                "f 1/1/1 2/1/1 3//1 4/1\n")
+        (verts, faces), err = self.read(text)
+        self.assertIsNone(err)
+        self.assertTrue(np.array_equal(verts, SQUARE))
+        self.assertTrue(np.array_equal(faces, TRIANGLES))
+
+        # negative indices count back from the vertices read so far
+        (verts, faces), err = self.read("v 0 0 0\nv 1 0 0\nv 1 1 0\nf -3 -2 -1\nv 0 1 0\nf 1 -2 -1")
+        self.assertIsNone(err)
+        self.assertTrue(np.array_equal(faces, TRIANGLES))
+
+    def test_pentagon_fan(self):
+        self.assertTrue(np.array_equal(fanTriangles(np.array([5, 6, 7, 8, 9, 1, 2, 3]), [5, 3]),
+                                       [[5, 6, 7], [5, 7, 8], [5, 8, 9], [1, 2, 3]]))
+
+    def test_errors(self):
+        _, err = self.read("v 0 0 0\nv 1 0\n")
+        self.assertIn("line 2", err)
+        _, err = self.read("v 0 0 0\nv 1 0 0\nf 1 2\n")
+        self.assertIn("line 3", err)
+        _, err = self.read("v 0 0 0\nv 1 0 0\nv 1 1 0\nf 1 2 4\n")
+        self.assertIn("line 4", err)
+        _, err = self.read("v 0 0 0\nv 1 0 0\nv 1 1 0\nf 1 2 x\n")
+        self.assertIn("line 4", err)
+        _, err = readObj(os.path.join(self.dir.name, "missing.obj"))
+        self.assertIsNotNone(err)
+
+class TestBinaryFormats(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.dir.name, name)
+
+    def writePly(self, name, order, faceCounts, indices):
+        endian = {"<": "binary_little_endian", ">": "binary_big_endian"}[order]
+        header = ("ply\nformat %s 1.0\ncomment test\nelement vertex %d\nproperty float x\nproperty float y\n"
+                  "property float z\nproperty uchar red\nelement face %d\nproperty list uchar int vertex_indices\n"
+                  "property uchar flags\nend_header\n") %(endian, len(SQUARE), len(faceCounts))
+        vertex = np.dtype([("xyz", order + "f4", (3,)), ("red", "u1")])
+        verts = np.zeros(len(SQUARE), dtype=vertex)
+        verts["xyz"] = SQUARE
+        with open(self.path(name), "wb") as f:
+            f.write(header.encode("ascii"))
+            f.write(verts.tobytes())
+            start = 0
+            for n in faceCounts:
+                f.write(np.uint8(n).tobytes())
+                f.write(np.array(indices[start:start+n], dtype=order + "i4").tobytes())
+                f.write(np.uint8(7).tobytes())
+                start += n
+        return self.path(name)
+
+    def test_ply(self):
+        for order in ["<", ">"]:
+            for counts, indices in [([3, 3], TRIANGLES.ravel()), ([4], [0, 1, 2, 3]), ([3, 4], [0, 1, 2, 0, 1, 2, 3])]:
+                (verts, faces), err = readMesh(self.writePly("mesh.ply", order, counts, indices))
+                self.assertIsNone(err)
+                self.assertTrue(np.array_equal(verts, SQUARE))
+                self.assertTrue(np.array_equal(faces, fanTriangles(np.array(indices), counts)))
+
+    def test_stl(self):
+        records = np.zeros(2, dtype=STL_RECORD)
+        records["verts"] = SQUARE[TRIANGLES]
+        with open(self.path("mesh.stl"), "wb") as f:
+            f.write(b"solid but binary".ljust(80))
+            f.write(np.uint32(2).tobytes())
+            f.write(records.tobytes())
+        (verts, faces), err = readMesh(self.path("mesh.stl"))
+        self.assertIsNone(err)
+        self.assertTrue(np.array_equal(verts[faces], SQUARE[TRIANGLES]))
+
+        with open(self.path("ascii.stl"), "w") as f:
+            f.write("solid square\nendsolid square\n")
+        _, err = readMesh(self.path("ascii.stl"))
+        self.assertIn("ASCII", err)
+
+    def test_npz(self):
+        writeNpz(self.path("mesh.npz"), SQUARE, TRIANGLES)
+        (verts, faces), err = readMesh(self.path("mesh.npz"))
+        self.assertIsNone(err)
+        self.assertTrue(np.array_equal(verts, SQUARE))
+        self.assertTrue(np.array_equal(faces, TRIANGLES))
+
+    def test_unknown_extension(self):
+        _, err = readMesh(self.path("mesh.vtk"))
+        self.assertIn("unknown mesh format", err)
+
+    def test_surface_from_file(self):
+        expected, _ = TriangulatedSurface.fromObj(os.path.join(EXAMPLES_DIR, "wavy", "wavy.obj"))
+        writeNpz(self.path("wavy.npz"), expected.verts, expected.faces)
+        ts, err = TriangulatedSurface.fromFile(self.path("wavy.npz"))
+        self.assertIsNone(err)
+        self.assertTrue(np.array_equal(ts.verts, expected.verts))
+        self.assertTrue(np.array_equal(ts.faces, expected.faces))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+from parflow.tools.io import read_pfb, write_pfb
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+sys.path.append(ROOT_DIR)
+
+from src import pfbio
+
+class TestPfbWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        self.indi = (rng.random((7, 11, 13)) > 0.5).astype(np.uint8)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def readBytes(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_matches_parflow(self):
+        expected = os.path.join(self.dir.name, "expected.pfb")
+        actual = os.path.join(self.dir.name, "actual.pfb")
+        for p, q, r in [(1, 1, 1), (2, 3, 1), (5, 4, 3)]:
+            write_pfb(expected, self.indi.astype(np.float64), p, q, r, x=1.5, y=-2.0, dx=0.3, dy=0.4, dz=1)
+            pfbio.writePfb(actual, self.indi, x=1.5, y=-2.0, dx=0.3, dy=0.4, dz=1, p=p, q=q, r=r)
+            self.assertEqual(self.readBytes(expected), self.readBytes(actual))
+            self.assertEqual(self.readBytes(expected + ".dist"), self.readBytes(actual + ".dist"))
+
+    def test_small_slabs(self):
+        path = os.path.join(self.dir.name, "slabs.pfb")
+        slabBytes = pfbio.SLAB_BYTES
+        try:
+            # smaller than one layer, so layers are written a few rows at a time
+            pfbio.SLAB_BYTES = 8 * 13 * 2
+            pfbio.writePfb(path, self.indi, p=2, q=2)
+        finally:
+            pfbio.SLAB_BYTES = slabBytes
+        self.assertTrue(np.array_equal(read_pfb(path), self.indi))
+
+    def test_subgrids_any_order(self):
+        path = os.path.join(self.dir.name, "order.pfb")
+        nz, ny, nx = self.indi.shape
+        with pfbio.PfbWriter(path, nx, ny, nz, p=3, q=2) as w:
+            for i in reversed(range(len(w.layout))):
+                _, (ix, iy, iz), (sx, sy, sz) = w.layout[i]
+                w.writeSubgrid(i, self.indi[iz:iz+sz, iy:iy+sy, ix:ix+sx])
+        self.assertTrue(np.array_equal(read_pfb(path), self.indi))
+
+class TestPfbReader(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(1)
+        self.values = rng.normal(size=(5, 9, 11))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_matches_parflow(self):
+        path = os.path.join(self.dir.name, "values.pfb")
+        for p, q, r in [(1, 1, 1), (2, 3, 1), (4, 2, 3)]:
+            write_pfb(path, self.values, p, q, r, dist=False)
+            header = pfbio.readPfbHeader(path)
+            self.assertEqual((header["nx"], header["ny"], header["nz"]), (11, 9, 5))
+            self.assertEqual(header["subgrids"], pfbio.subgridLayout(11, 9, 5, p, q, r))
+            self.assertTrue(np.array_equal(pfbio.readPfb(path), read_pfb(path)))
+            for window in [(0, 11, 0, 9), (3, 8, 2, 7), (10, 11, 0, 1), (4, 4, 0, 9)]:
+                ix0, ix1, iy0, iy1 = window
+                self.assertTrue(np.array_equal(pfbio.readPfb(path, window), self.values[:, iy0:iy1, ix0:ix1]))
+
+    def test_indicators(self):
+        # bool and uint8 indicators are written and read back without float64 arrays of the whole grid
+        path = os.path.join(self.dir.name, "indi.pfb")
+        indi = self.values > 0
+        pfbio.writePfb(path, indi, p=2, q=2, r=2)
+        self.assertTrue(np.array_equal(read_pfb(path), indi))
+        actual = pfbio.readPfb(path, dtype=np.uint8)
+        self.assertEqual(actual.dtype, np.uint8)
+        self.assertTrue(np.array_equal(actual, indi))
+
+    def test_errors(self):
+        path = os.path.join(self.dir.name, "values.pfb")
+        pfbio.writePfb(path, self.values, p=2)
+        with self.assertRaises(ValueError):
+            pfbio.readPfb(path, (0, 12, 0, 9))
+        with open(path, "rb") as f:
+            data = f.read()
+        with open(path, "wb") as f:
+            f.write(data[:-8])
+        with self.assertRaises(ValueError):
+            pfbio.readPfb(path)
+
+if __name__ == "__main__":
+    unittest.main()
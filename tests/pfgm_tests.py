@@ -0,0 +1,200 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.pfgm import INDICATOR_DTYPE, TriangulatedSurface
+from src.tfg import TFG
+
+class TestTriangulatedSurface(unittest.TestCase):
+    def setUp(self):
+        # unit square in the z=0 plane split into two triangles
+        verts = [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]]
+        self.ts = TriangulatedSurface(verts, [[0, 1, 2], [0, 2, 3]])
+
+    def test_arrays(self):
+        self.assertEqual(self.ts.verts.shape, (4, 3))
+        self.assertEqual(self.ts.faces.dtype, np.int32)
+        self.assertTrue(np.array_equal(self.ts.edge1[0], [1, 0, 0]))
+        self.assertTrue(np.array_equal(self.ts.bboxMax[1], [1, 1, 0]))
+        self.assertEqual(self.ts.zMax, 0)
+
+    def test_segments_intersect(self):
+        origins = np.array([[0.75, 0.25, -1], [0.25, 0.75, -1], [0.25, 0.75, 0.5], [2, 2, -1]])
+        ends = origins + [0, 0, 2]
+        tIds = np.array([0, 1])
+        hits = self.ts.segmentsIntersect(origins, ends, tIds)
+        expected = [[True, False], [False, True], [False, False], [False, False]]
+        self.assertTrue(np.array_equal(hits, expected))
+        for i in range(len(origins)):
+            self.assertTrue(np.array_equal(self.ts.segmentsIntersect(origins[i], ends[i], tIds), hits[i]))
+            for j, tId in enumerate(tIds):
+                self.assertEqual(self.ts.rayIntersectsTriangle(origins[i], tId, rayEnd=ends[i]), hits[i][j])
+
+    def test_segment_pairs_intersect(self):
+        origins = np.array([[0.75, 0.25, -1], [0.75, 0.25, -1], [0.25, 0.75, 0.5]])
+        ends = origins + [0, 0, 2]
+        tIds = np.array([0, 1, 1])
+        hits = self.ts.segmentPairsIntersect(origins, ends, tIds)
+        self.assertEqual(list(hits), [True, False, False])
+
+class TestVolumeEngines(unittest.TestCase):
+    def setUp(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        demPath = os.path.join(exampleDir, "dem.pfb")
+        self.tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, demPath)
+        self.ts, self.setupErr = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+
+    def test_read_ok(self):
+        self.assertIsNone(self.setupErr)
+
+    def test_column_matches_ray(self):
+        expected = self.ts.mapVolume(self.tfg, "ray")
+        actual = self.ts.mapVolume(self.tfg, "column")
+        self.assertEqual(actual.dtype, np.uint8)
+        self.assertGreater(np.sum(expected), 0)
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_voxel_matches_ray(self):
+        expected = self.ts.mapVolume(self.tfg, "ray")
+        for indexKind in ["rtree", "bins"]:
+            self.ts.indexKind = indexKind
+            actual = self.ts.mapVolume(self.tfg, "voxel")
+            self.assertTrue(np.array_equal(expected, actual))
+        actual = self.ts.mapVolume(self.tfg, "voxel", jobs=2)
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_voxel_tall_grid(self):
+        # layers far below and above the geometry stay outside the parity window
+        demPath = os.path.join(EXAMPLES_DIR, "dodecahedron", "dem.pfb")
+        tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.5]*40 + [0.1]*20, demPath)
+        expected = self.ts.mapVolume(tfg, "column")
+        self.assertGreater(np.sum(expected), 0)
+        self.assertTrue(np.array_equal(expected, self.ts.mapVolume(tfg, "voxel")))
+
+    def test_count_below(self):
+        from src.pfgm import countBelow
+        rows = np.array([[0.0, 1.0, 2.0], [5.0, 6.0, 7.0]])
+        counts = countBelow(rows, np.array([0, 0, 0, 1, 1, 1]), np.array([-1.0, 1.0, 9.0, 5.5, 7.0, 4.0]))
+        self.assertEqual(list(counts), [0, 1, 3, 1, 2, 0])
+
+    def test_column_crossings_sorted(self):
+        x, y = self.tfg.xMid(10), self.tfg.yMid(10)
+        tIds = np.arange(len(self.ts.faces))
+        zCrossings, _, _ = self.ts.columnCrossings(x, y, tIds)
+        self.assertEqual(len(zCrossings) % 2, 0)
+        self.assertTrue(np.all(np.diff(zCrossings) >= 0))
+
+    def test_bins_match_rtree(self):
+        expected = self.ts.mapVolume(self.tfg, "column")
+        self.ts.indexKind = "bins"
+        actual = self.ts.mapVolume(self.tfg, "column")
+        self.assertTrue(np.array_equal(expected, actual))
+
+    def test_parallel_matches_serial(self):
+        expected = self.ts.mapVolume(self.tfg, "column")
+        actual = self.ts.mapVolume(self.tfg, "column", jobs=2)
+        self.assertTrue(np.array_equal(expected, actual))
+
+class TestSurfaceEngines(unittest.TestCase):
+    def setUp(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "wavy")
+        demPath = os.path.join(exampleDir, "dem.pfb")
+        self.tfg = TFG(-1.2, -0.8, 0.3, 0.3, 8, 6, [0.5]*8, demPath)
+        self.ts, self.setupErr = TriangulatedSurface.fromObj(os.path.join(exampleDir, "wavy.obj"))
+
+    def test_segment_matches_ray(self):
+        expected = self.ts.mapSurface(self.tfg, "ray")
+        actual = self.ts.mapSurface(self.tfg, "segment")
+        self.assertGreater(np.sum(expected[2]), 0)
+        for e, a in zip(expected, actual):
+            self.assertTrue(np.array_equal(e, a))
+
+    def test_parallel_matches_serial(self):
+        expected = self.ts.mapSurface(self.tfg, "segment")
+        actual = self.ts.mapSurface(self.tfg, "segment", jobs=3)
+        for e, a in zip(expected, actual):
+            self.assertTrue(np.array_equal(e, a))
+
+    def test_triangle_matches_ray(self):
+        expected = self.ts.mapSurface(self.tfg, "ray")
+        for indexKind in ["rtree", "bins"]:
+            self.ts.indexKind = indexKind
+            for e, a in zip(expected, self.ts.mapSurface(self.tfg, "triangle")):
+                self.assertTrue(np.array_equal(e, a))
+        for e, a in zip(expected, self.ts.mapSurface(self.tfg, "triangle", jobs=3)):
+            self.assertTrue(np.array_equal(e, a))
+
+    def test_triangle_fault_sheet(self):
+        # a dipping sheet of long triangles under a sloped DEM, mapped in several chunks
+        x, y = np.meshgrid(np.arange(40)*10.0, np.arange(30)*10.0)
+        tfg = TFG.fromDem(100 + 0.05*x + 0.1*y, 0.0, 0.0, 10.0, 10.0, [4.0]*25)
+        steps = np.linspace(0.0, 1.0, 21)
+        line = np.column_stack([30 + 320*steps, 20 + 250*steps])
+        verts = np.concatenate([np.column_stack([line + 0.4*z, np.full(len(line), z)]) for z in [0.0, 110.0]])
+        bottom, top = np.arange(20), np.arange(20) + len(line)
+        faces = np.concatenate([np.column_stack([bottom, bottom+1, top]), np.column_stack([bottom+1, top+1, top])])
+        ts = TriangulatedSurface(verts, faces, "bins")
+        expected = ts.mapSurface(tfg, "segment")
+        self.assertGreater(np.sum(expected[0]), 0)
+        import src.pfgm
+        chunk = src.pfgm.TRIANGLE_CHUNK_TRIPLES
+        try:
+            src.pfgm.TRIANGLE_CHUNK_TRIPLES = 100
+            for e, a in zip(expected, ts.mapSurface(tfg, "triangle")):
+                self.assertTrue(np.array_equal(e, a))
+        finally:
+            src.pfgm.TRIANGLE_CHUNK_TRIPLES = chunk
+
+class TestInMemory(unittest.TestCase):
+    def test_matches_file_inputs(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        expected = ts.mapVolume(tfg, "column")
+
+        memTfg = TFG.fromDem(np.array(tfg.dem[0][:20, :20]), -3.0, -3.0, 0.3, 0.3, [0.3]*20)
+        memTs = TriangulatedSurface(ts.verts.tolist(), ts.faces.tolist())
+        actual = memTs.mapVolume(memTfg, "column")
+        self.assertEqual(actual.dtype, INDICATOR_DTYPE)
+        self.assertTrue(np.array_equal(actual, expected))
+
+        # writing is a separate step. Without a DEM file there is no tcl script for the VTK
+        with tempfile.TemporaryDirectory() as tmp:
+            root = os.path.join(tmp, "out")
+            TriangulatedSurface.writeVolume(memTfg, actual, root)
+            self.assertFalse(os.path.exists(root + ".gen_vtk.tcl"))
+            self.assertTrue(os.path.exists(root + ".pfb"))
+
+    def test_package_imports(self):
+        # the package imports from the repository root as is, and pfgm.py still runs as a script
+        code = "from src import TFG, TriangulatedSurface, ENGINES; print(sorted(ENGINES))"
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip(), "['surface', 'volume']")
+        out = subprocess.run([sys.executable, os.path.join(ROOT_DIR, "src", "pfgm.py"), "--help"],
+                             capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0, out.stderr)
+
+    def test_lazy_imports(self):
+        # ParFlow, numba and rtree are only imported when used, and --help does not even import numpy
+        code = "import sys, src.pfgm; print([m for m in ['parflow', 'numba', 'rtree'] if m in sys.modules])"
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip(), "[]")
+        code = ("import runpy, sys\nsys.argv = ['pfgm.py', '--help']\ntry:\n    runpy.run_path('src/pfgm.py', "
+                "run_name='__main__')\nexcept SystemExit:\n    pass\nprint('numpy' in sys.modules)")
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, capture_output=True, text=True)
+        self.assertEqual(out.returncode, 0, out.stderr)
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "False")
+
+if __name__ == "__main__":
+    unittest.main()
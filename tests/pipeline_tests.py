@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.pfbio import writePfb
+from src.pfgm import ENGINES, INDICATOR_DTYPE, TriangulatedSurface
+from src.pipeline import BackgroundWriter, mapAndWrite, runConcurrently
+from src.tfg import TFG
+
+class TestBackgroundWriter(unittest.TestCase):
+    def test_jobs_run_in_order(self):
+        done = []
+        writer = BackgroundWriter(maxPending=2)
+        for i in range(20):
+            writer.submit(done.append, i)
+        writer.close()
+        self.assertEqual(done, list(range(20)))
+
+    def test_error_is_raised(self):
+        def fail():
+            raise IOError("disk full")
+        writer = BackgroundWriter()
+        writer.submit(fail)
+        with self.assertRaises(IOError):
+            writer.close()
+
+    def test_run_concurrently(self):
+        # both tasks must be running at the same time for either to finish
+        barrier = threading.Barrier(2, timeout=10)
+        def task(value):
+            def run():
+                barrier.wait()
+                return value
+            return run
+        results = runConcurrently(task(1), task(2))
+        self.assertEqual(results, [1, 2])
+
+class TestMapAndWrite(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        self.tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        self.ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def readBytes(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_matches_map_then_write(self):
+        expected = self.ts.mapVolume(self.tfg, "column")
+        for subgrids in [(1, 1, 1), (3, 2, 2)]:
+            reference = os.path.join(self.dir.name, "reference.pfb")
+            writePfb(reference, expected, x=self.tfg.x0, y=self.tfg.y0, dx=self.tfg.dx, dy=self.tfg.dy, dz=1,
+                     p=subgrids[0], q=subgrids[1], r=subgrids[2])
+            for jobs in [1, 2]:
+                path = os.path.join(self.dir.name, "pipelined.pfb")
+                indi, = mapAndWrite(self.ts, self.tfg, "volume", ENGINES["volume"]["column"], INDICATOR_DTYPE,
+                                    [path], jobs, subgrids)
+                self.assertTrue(np.array_equal(indi, expected))
+                self.assertEqual(self.readBytes(path), self.readBytes(reference))
+                self.assertEqual(self.readBytes(path + ".dist"), self.readBytes(reference + ".dist"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.pfgm import TriangulatedSurface
+from src.profiling import Profile
+from src.tfg import TFG
+
+class TestProfile(unittest.TestCase):
+    def test_ticker_few_ticks(self):
+        # fewer than 100 ticks used to divide by zero
+        out = io.StringIO()
+        with redirect_stdout(out):
+            profile = Profile()
+            profile.start(7)
+            for _ in range(7):
+                profile.inc()
+            profile.stop()
+        self.assertTrue(out.getvalue().strip().endswith("100%"))
+
+    def test_columns_and_merge(self):
+        profile = Profile(quiet=True)
+        profile.column(0, 10, 0)
+        profile.column(3, 10, 30)
+        worker = Profile(quiet=True)
+        worker.column(3, 10, 30)
+        profile.merge(worker.stats())
+        profile.skipTile(4, 40)
+        report = profile.report()
+        self.assertEqual(report["counters"]["columns"], 7)
+        self.assertEqual(report["counters"]["cells"], 70)
+        self.assertEqual(report["counters"]["triangleTests"], 60)
+        self.assertEqual(report["candidatesPerColumn"], {"0": 5, "3": 2})
+        self.assertAlmostEqual(report["columnsSkippedFraction"], 5/7)
+        self.assertEqual(profile.tick, 70)
+
+    def test_bulk_columns(self):
+        bulk = Profile(quiet=True)
+        bulk.columns(np.array([0, 3, 3, 0, 1]), 10, 7)
+        single = Profile(quiet=True)
+        for n in [0, 3, 3, 0, 1]:
+            single.column(n, 10, 0)
+        single.count("triangleTests", 7)
+        self.assertEqual(bulk.report(), single.report())
+
+class TestMappingProfile(unittest.TestCase):
+    def setUp(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        self.tfg = TFG(-3.0, -3.0, 0.3, 0.3, 20, 20, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        self.ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+
+    def test_counters(self):
+        serial, parallel = Profile(quiet=True), Profile(quiet=True)
+        self.ts.mapVolume(self.tfg, "column", profile=serial)
+        self.ts.mapVolume(self.tfg, "column", jobs=2, profile=parallel)
+        for profile in [serial, parallel]:
+            self.assertEqual(profile.counters["columns"], self.tfg.nx * self.tfg.ny)
+            self.assertEqual(profile.counters["cells"], self.tfg.nx * self.tfg.ny * self.tfg.nz)
+            self.assertIn("map", profile.phases)
+        self.assertEqual(serial.histogram, parallel.histogram)
+        self.assertEqual(serial.counters["triangleTests"], parallel.counters["triangleTests"])
+
+    def test_write(self):
+        profile = Profile(quiet=True, cprofile=True)
+        self.ts.mapVolume(self.tfg, "column", profile=profile)
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "report.json")
+            profile.write(path)
+            with open(path, "r") as f:
+                report = json.load(f)
+            self.assertGreater(report["cellsPerSecond"], 0)
+            self.assertTrue(os.path.exists(path + ".pstats"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,177 @@
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from parflow.tools.io import read_pfb
+
+from src.cli import makeParser
+from src.client import makeRequest, sendRequest
+from src.pfgm import TriangulatedSurface
+from src.server import MappingServer, MeshCache, checkRequest
+from src.tfg import TFG
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        # cleanups run last in first out, so servers stop before the directory goes
+        self.addCleanup(self.dir.cleanup)
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        self.obj = os.path.join(exampleDir, "dodecahedron.obj")
+        self.tfgPath = os.path.join(self.dir.name, "tfg.json")
+        with open(self.tfgPath, "w") as f:
+            json.dump({"x": -3.0, "y": -3.0, "nx": 23, "ny": 19, "dx": 0.3, "dy": 0.3, "dzs": [0.3]*20,
+                       "dem": os.path.join(exampleDir, "dem.pfb")}, f)
+        self.tfg, _ = TFG.fromJson(self.tfgPath)
+        self.ts, _ = TriangulatedSurface.fromObj(self.obj)
+
+    def startServer(self, path, queue=False):
+        server = MappingServer(self.tfg, self.tfgPath, path, workers=2, meshes=2, indexKind="bins", queue=queue)
+        thread = threading.Thread(target=server.serve)
+        thread.start()
+        if queue:
+            os.makedirs(path, exist_ok=True)
+        else:
+            # the socket listens once it is set, connections made before serving starts wait in its backlog
+            while server.socketServer is None:
+                time.sleep(0.01)
+
+        def stop():
+            server.shutdown()
+            thread.join()
+        self.addCleanup(stop)
+
+    def request(self, kind, o, **options):
+        request = {"kind": kind, "obj": self.obj, "o": os.path.join(self.dir.name, o), "tfg": self.tfgPath}
+        request.update(options)
+        return request
+
+    def test_socket(self):
+        path = os.path.join(self.dir.name, "server.sock")
+        self.startServer(path)
+
+        response, err = sendRequest(path, self.request("volume", "a", engine="column"))
+        self.assertIsNone(err)
+        self.assertIsNone(response["error"])
+        self.assertTrue(np.array_equal(read_pfb(os.path.join(self.dir.name, "a.pfb")), self.ts.mapVolume(self.tfg)))
+
+        response, err = sendRequest(path, self.request("surface", "b", engine="segment", faces="ply"))
+        self.assertIsNone(response["error"])
+        for dim, indi in zip(["x", "y", "z"], self.ts.mapSurface(self.tfg)):
+            self.assertTrue(np.array_equal(read_pfb(os.path.join(self.dir.name, "b.%s.pfb" %dim)), indi))
+        self.assertTrue(os.path.exists(os.path.join(self.dir.name, "b.faces.ply")))
+
+    def test_queue(self):
+        path = os.path.join(self.dir.name, "jobs")
+        self.startServer(path, queue=True)
+
+        responses = [sendRequest(path, self.request("volume", o, engine="voxel", subgrids=[2, 2, 1]), timeout=60)
+                     for o in ["a", "b", "c"]]
+        expected = self.ts.mapVolume(self.tfg)
+        for (response, err), o in zip(responses, ["a", "b", "c"]):
+            self.assertIsNone(err)
+            self.assertIsNone(response["error"])
+            self.assertTrue(np.array_equal(read_pfb(os.path.join(self.dir.name, o + ".pfb")), expected))
+        # with two workers, the mesh is loaded at most twice
+        self.assertTrue(any(response["cached"] for response, _ in responses))
+        self.assertEqual(os.listdir(path), [])
+
+    def test_errors(self):
+        path = os.path.join(self.dir.name, "server.sock")
+        self.startServer(path)
+        response, err = sendRequest(path, self.request("volume", "a", engine="segment"))
+        self.assertIsNone(err)
+        self.assertIn("not a valid volume engine", response["error"])
+
+        self.assertIn("maps onto", checkRequest(self.request("volume", "a", tfg="other.json"), self.tfgPath))
+        self.assertIn("does not exist", checkRequest(dict(self.request("volume", "a"), obj="missing.obj"), self.tfgPath))
+        self.assertIn("subgrids", checkRequest(self.request("volume", "a", subgrids=[1, 0, 1]), self.tfgPath))
+        self.assertIn("needs 'o'", checkRequest({"kind": "volume", "obj": self.obj}, self.tfgPath))
+        self.assertIsNone(checkRequest(self.request("surface", "a", engine="triangle"), self.tfgPath))
+
+        _, err = sendRequest(os.path.join(self.dir.name, "missing.sock"), self.request("volume", "a"))
+        self.assertIn("no response", err)
+
+    def test_path_not_replaced(self):
+        # only a stale socket is replaced, never a file or directory someone passed by mistake
+        path = os.path.join(self.dir.name, "precious.txt")
+        with open(path, "w") as f:
+            f.write("keep")
+        server = MappingServer(self.tfg, self.tfgPath, path)
+        self.assertIn("is not a socket", server.serve())
+        with open(path, "r") as f:
+            self.assertEqual(f.read(), "keep")
+        self.assertIn("is not a directory", MappingServer(self.tfg, self.tfgPath, path, queue=True).serve())
+        self.assertIn("is not a socket", MappingServer(self.tfg, self.tfgPath, self.dir.name).serve())
+
+        # a socket left over from a server that did not shut down
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(os.path.join(self.dir.name, "stale.sock"))
+        stale.close()
+        self.startServer(os.path.join(self.dir.name, "stale.sock"))
+        response, err = sendRequest(os.path.join(self.dir.name, "stale.sock"), self.request("volume", "a"))
+        self.assertIsNone(err)
+        self.assertIsNone(response["error"])
+
+    def test_make_request(self):
+        def request(*argv):
+            return makeRequest(makeParser().parse_args(["-kind", "volume", "-obj", self.obj, "-o", "out"] + list(argv)))
+        r, err = request("-engine", "voxel", "-vtk", "vtu")
+        self.assertIsNone(err)
+        self.assertEqual((r["engine"], r["vtk"], r["o"]), ("voxel", "vtu", os.path.abspath("out")))
+        # options of the server are not silently dropped
+        for argv in [["-jobs", "8"], ["-index", "bins"], ["-cache", "dir"], ["-meshes", "2"], ["-queue"]]:
+            _, err = request(*argv)
+            self.assertIn("only be set when the server is started", err)
+        for argv in [["-cprofile"], ["-previous", "old"], ["-plan", "dir"]]:
+            _, err = request(*argv)
+            self.assertIn("not supported", err)
+
+    def test_mesh_cache(self):
+        loads = []
+        def load(path):
+            loads.append(path)
+            return TriangulatedSurface.fromFile(path)
+
+        objs = []
+        for name in ["a.obj", "b.obj"]:
+            objs.append(os.path.join(self.dir.name, name))
+            shutil.copy(self.obj, objs[-1])
+        cache = MeshCache(1)
+        first, err, cached = cache.get(objs[0], load)
+        self.assertIsNone(err)
+        self.assertFalse(cached)
+        again, _, cached = cache.get(objs[0], load)
+        self.assertTrue(cached)
+        self.assertIs(again, first)
+
+        # the least recently used mesh is dropped
+        cache.get(objs[1], load)
+        _, _, cached = cache.get(objs[0], load)
+        self.assertFalse(cached)
+        self.assertEqual(len(cache.entries), 1)
+
+        # a changed file is read again
+        stat = os.stat(objs[0])
+        os.utime(objs[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        _, _, cached = cache.get(objs[0], load)
+        self.assertFalse(cached)
+        self.assertEqual(loads, [objs[0], objs[1], objs[0], objs[0]])
+
+        _, err, _ = cache.get(os.path.join(self.dir.name, "missing.obj"), load)
+        self.assertIn("error reading", err)
+
+if __name__ == "__main__":
+    unittest.main()
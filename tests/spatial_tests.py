@@ -0,0 +1,61 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src.pfgm import TriangulatedSurface
+from src.spatial import BinnedColumns
+from src.tfg import TFG
+
+class TestBinnedColumns(unittest.TestCase):
+    def test_rasterize(self):
+        # one box inside cell (1, 0), one touching the edge between columns 0 and 1, one off the grid
+        bboxMin = np.array([[1.2, 0.2, 0], [0.5, 0.5, 0], [5.0, 5.0, 0]])
+        bboxMax = np.array([[1.8, 0.8, 0], [1.0, 1.5, 0], [6.0, 6.0, 0]])
+        offsets, ids = BinnedColumns.rasterize(bboxMin, bboxMax, 0.0, 0.0, 1.0, 1.0, 3, 2)
+        cell = lambda ix, iy: sorted(ids[offsets[ix*2+iy]:offsets[ix*2+iy+1]])
+        self.assertEqual(cell(0, 0), [1])
+        self.assertEqual(cell(0, 1), [1])
+        self.assertEqual(cell(1, 0), [0, 1])
+        self.assertEqual(cell(1, 1), [1])
+        self.assertEqual(cell(2, 0), [])
+        self.assertEqual(offsets[-1], len(ids))
+
+    def test_covers_rtree_candidates(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "gourd")
+        tfg = TFG(-2.0, -2.0, 0.05, 0.05, 60, 80, [0.05]*60, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "gourd.obj"))
+        for kind in ["volume", "surface"]:
+            ts.indexKind = "rtree"
+            rtreeColumns = ts.columnIndex(tfg, kind)
+            ts.indexKind = "bins"
+            binnedColumns = ts.columnIndex(tfg, kind)
+            for ix in range(0, tfg.nx-1):
+                for iy in range(0, tfg.ny-1):
+                    expected = set(rtreeColumns.candidates(ix, iy))
+                    self.assertTrue(expected.issubset(binnedColumns.candidates(ix, iy)))
+
+    def test_tile_csr(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "gourd")
+        tfg = TFG(-2.0, -2.0, 0.05, 0.05, 60, 80, [0.05]*60, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "gourd.obj"))
+        for indexKind in ["rtree", "bins"]:
+            ts.indexKind = indexKind
+            columns = ts.columnIndex(tfg, "volume")
+            for tile in [(0, 60, 0, 80), (25, 37, 30, 51), (10, 10, 0, 80)]:
+                ix0, ix1, iy0, iy1 = tile
+                offsets, ids = columns.tileCsr(tile)
+                self.assertEqual(len(offsets), (ix1-ix0)*(iy1-iy0) + 1)
+                for ix in range(ix0, ix1):
+                    for iy in range(iy0, iy1):
+                        c = (ix-ix0)*(iy1-iy0) + iy - iy0
+                        self.assertTrue(np.array_equal(ids[offsets[c]:offsets[c+1]], columns.candidates(ix, iy)))
+
+if __name__ == "__main__":
+    unittest.main()
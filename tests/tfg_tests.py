@@ -1,15 +1,18 @@
+import json
 import math
 import os
 import sys
+import tempfile
 import unittest
 
+import numpy as np
+
 TEST_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.join(TEST_DIR, "..")
-SRC_DIR = os.path.join(ROOT_DIR, "src")
 EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
-sys.path.append(SRC_DIR)
+sys.path.append(ROOT_DIR)
 
-from tfg import TFG
+from src.tfg import TFG
 
 class TestTfg(unittest.TestCase):
     @staticmethod
@@ -49,5 +52,87 @@ class TestTfg(unittest.TestCase):
         ok = self.approxEquals(self.tfg.zMin(2, 1, 0), -2.5) and self.approxEquals(self.tfg.zMin(2, 1, 1), -0.5)
         self.assertTrue(ok)
 
+class TestTfgArrays(unittest.TestCase):
+    def setUp(self):
+        demPath = os.path.join(TEST_DIR, "test_dem.pfb")
+        self.tfg = TFG(0.0, 1.0, 1.0, 1.0, 3, 4, [2, 1, 0.5, 0.2], demPath)
+
+    def test_mid_arrays(self):
+        tfg = self.tfg
+        self.assertEqual(list(tfg.x_mid), [tfg.xMid(ix) for ix in range(tfg.nx)])
+        self.assertEqual(list(tfg.y_mid), [tfg.yMid(iy) for iy in range(tfg.ny)])
+
+    def test_z_arrays(self):
+        tfg = self.tfg
+        self.assertEqual(tfg.z_mid.shape, (tfg.nz, tfg.ny, tfg.nx))
+        for ix in range(tfg.nx):
+            for iy in range(tfg.ny):
+                for iz in range(tfg.nz):
+                    self.assertEqual(tfg.z_min[iz, iy, ix], tfg.zMin(ix, iy, iz))
+                    self.assertEqual(tfg.z_max[iz, iy, ix], tfg.zMax(ix, iy, iz))
+                    self.assertEqual(tfg.z_mid[iz, iy, ix], tfg.zMid(ix, iy, iz))
+
+    def test_z_columns(self):
+        tfg = self.tfg
+        self.assertEqual(list(tfg.zMidColumn(2, 1)), [tfg.zMid(2, 1, iz) for iz in range(tfg.nz)])
+        self.assertEqual(list(tfg.zMaxColumn(2, 1)), [tfg.zMax(2, 1, iz) for iz in range(tfg.nz)])
+
+    def test_z_cells(self):
+        tfg = self.tfg
+        ix, iy, iz = np.meshgrid(np.arange(tfg.nx), np.arange(tfg.ny), np.arange(tfg.nz), indexing="ij")
+        self.assertTrue(np.array_equal(tfg.zMinCells(ix, iy, iz), tfg.z_min[iz, iy, ix]))
+        self.assertTrue(np.array_equal(tfg.zMaxCells(ix, iy, iz), tfg.z_max[iz, iy, ix]))
+        self.assertTrue(np.array_equal(tfg.zMidCells(ix, iy, iz), tfg.z_mid[iz, iy, ix]))
+
+    def test_cell_indices(self):
+        ix, iy, iz = self.tfg.cellIndicesFromPositions3D([1.5, 2.5, 1.5, 7.0], [2.5, 2.5, 2.5, 2.5], [1.9, -2.0, 2.1, 0.0])
+        self.assertEqual(list(ix), [1, 2, -1, -1])
+        self.assertEqual(list(iy), [1, 1, -1, -1])
+        self.assertEqual(list(iz), [3, 0, -1, -1])
+        self.assertEqual(self.tfg.cellIndexFromPosition2D(0.5, 4.5), (0, 3))
+        self.assertIsNone(self.tfg.cellIndexFromPosition2D(0.5, 0.5))
+
+class TestTfgFromDem(unittest.TestCase):
+    def setUp(self):
+        demPath = os.path.join(TEST_DIR, "test_dem.pfb")
+        self.tfg = TFG(0.0, 1.0, 1.0, 1.0, 3, 4, [2, 1, 0.5, 0.2], demPath)
+
+    def test_matches_pfb(self):
+        dem = np.array(self.tfg.dem[0][:4, :3])
+        tfg = TFG.fromDem(dem, 0.0, 1.0, 1.0, 1.0, [2, 1, 0.5, 0.2])
+        self.assertIsNone(tfg.demPfb)
+        self.assertEqual(tfg.shape(), self.tfg.shape())
+        self.assertEqual(tfg.dem.shape, (1, 4, 3))
+        self.assertTrue(np.array_equal(tfg.z_min, self.tfg.z_min))
+        self.assertTrue(np.array_equal(tfg.z_max, self.tfg.z_max))
+
+    def test_window(self):
+        window = self.tfg.window(1, 3, 2, 4)
+        self.assertEqual((window.nx, window.ny, window.nz), (2, 2, 4))
+        self.assertEqual(list(window.x_mid), list(self.tfg.x_mid[1:3]))
+        self.assertEqual(list(window.y_mid), list(self.tfg.y_mid[2:4]))
+        self.assertEqual(window.xMin(1), self.tfg.xMin(2))
+        self.assertTrue(np.array_equal(window.z_mid, self.tfg.z_mid[:, 2:4, 1:3]))
+        self.assertEqual(window.cellIndexFromPosition2D(2.5, 4.5), (1, 1))
+
+    def test_json_window(self):
+        # only the window's columns of the DEM pfb are read
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, "tfg.json")
+            with open(path, "w") as f:
+                json.dump({"x": 0.0, "y": 1.0, "nx": 3, "ny": 4, "dx": 1.0, "dy": 1.0, "dzs": [2, 1, 0.5, 0.2],
+                           "dem": os.path.join(TEST_DIR, "test_dem.pfb")}, f)
+            tfg, err = TFG.fromJson(path, window=(1, 3, 2, 4))
+            self.assertIsNone(err)
+            self.assertEqual(tfg.dem.shape, (1, 2, 2))
+            self.assertEqual(list(tfg.x_mid), list(self.tfg.x_mid[1:3]))
+            self.assertTrue(np.array_equal(tfg.z_mid, self.tfg.window(1, 3, 2, 4).z_mid))
+            _, err = TFG.fromJson(path, window=(1, 4, 2, 4))
+            self.assertIn("outside", err)
+
+    def test_dem_required(self):
+        with self.assertRaises(ValueError):
+            TFG(0.0, 1.0, 1.0, 1.0, 3, 4, [2, 1, 0.5, 0.2])
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+ROOT_DIR = os.path.join(TEST_DIR, "..")
+EXAMPLES_DIR = os.path.join(ROOT_DIR, "examples")
+sys.path.append(ROOT_DIR)
+
+from src import vtkio
+from src.pfgm import TriangulatedSurface
+from src.tfg import TFG
+from src.vtkio import writeVolumeVtk
+
+def readLegacyVtk(path):
+    """
+    :return: points, (C, 8) hexahedra, cell types and cell values of a file written by writeLegacyVtk
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    def section(keyword, start):
+        begin = data.index(keyword, start)
+        end = data.index(b"\n", begin)
+        return data[begin:end].split(), end + 1
+    words, pos = section(b"POINTS", 0)
+    npoints = int(words[1])
+    points = np.frombuffer(data, ">f8", 3*npoints, pos).reshape(-1, 3)
+    words, pos = section(b"CELLS", pos + 24*npoints)
+    ncells = int(words[1])
+    cells = np.frombuffer(data, ">i4", 9*ncells, pos).reshape(-1, 9)
+    _, pos = section(b"CELL_TYPES", pos + 36*ncells)
+    types = np.frombuffer(data, ">i4", ncells, pos)
+    words, pos = section(b"SCALARS", pos + 4*ncells)
+    _, pos = section(b"LOOKUP_TABLE", pos)
+    values = np.frombuffer(data, ">u1", ncells, pos)
+    assert (words[1], words[2]) == (b"indicator", b"unsigned_char")
+    assert np.all(cells[:, 0] == 8)
+    return points, cells[:, 1:], types, values
+
+def readVtu(path):
+    """
+    :return: points, (C, 8) hexahedra, cell types and cell values of a file written by writeVtu
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    start = data.index(b"_", data.index(b"<AppendedData")) + 1
+    arrays = []
+    for dtype in ["<f8", "<i8", "<i8", "u1", "u1"]:
+        size = int(np.frombuffer(data, "<u8", 1, start)[0])
+        arrays.append(np.frombuffer(data, dtype, size // np.dtype(dtype).itemsize, start + 8))
+        start += 8 + size
+    points, connectivity, offsets, types, values = arrays
+    assert np.array_equal(offsets, 8*np.arange(1, len(types)+1))
+    return points.reshape(-1, 3), connectivity.reshape(-1, 8), types, values
+
+class TestVtkio(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        dem = np.array([[3.0, 2.5, 2.0, 2.2], [3.1, 2.9, 1.5, 1.0], [2.0, 2.0, 2.4, 2.6]])
+        self.tfg = TFG(10.0, 20.0, 2.0, 1.5, 4, 3, [1.0, 0.5, 0.25], dem=dem)
+        self.indi = np.zeros((3, 3, 4), dtype=np.uint8)
+        self.indi[0, 1, 1:3] = 1
+        self.indi[1, 1, 1] = 1
+        self.indi[2, 2, 3] = 1
+        self.root = os.path.join(self.dir.name, "out")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def assertDraped(self, points, hexes, types, values, iz, iy, ix):
+        tfg = self.tfg
+        self.assertTrue(np.all(types == vtkio.VTK_HEXAHEDRON))
+        self.assertTrue(np.array_equal(values, self.indi[iz, iy, ix]))
+        corners = points[hexes]
+        self.assertTrue(np.allclose(corners[:, :, 0].min(axis=1), tfg.x_min[ix]))
+        self.assertTrue(np.allclose(corners[:, :, 0].max(axis=1), tfg.x_max[ix]))
+        self.assertTrue(np.allclose(corners[:, :, 1].min(axis=1), tfg.y_min[iy]))
+        self.assertTrue(np.allclose(corners[:, :, 1].max(axis=1), tfg.y_max[iy]))
+        self.assertTrue(np.allclose(corners[:, :4, 2], tfg.zMinCells(ix, iy, iz)[:, None]))
+        self.assertTrue(np.allclose(corners[:, 4:, 2], tfg.zMaxCells(ix, iy, iz)[:, None]))
+        # VTK order: bottom corners counterclockwise from (xmin, ymin), then the top ones above them
+        self.assertTrue(np.allclose(corners[:, 1, 0] - corners[:, 0, 0], self.tfg.dx))
+        self.assertTrue(np.allclose(corners[:, 2, 1] - corners[:, 1, 1], self.tfg.dy))
+        self.assertTrue(np.allclose(corners[:, 4:, :2], corners[:, :4, :2]))
+
+    def test_legacy_all_cells(self):
+        writeVolumeVtk(self.tfg, self.indi, self.root, "vtk")
+        points, hexes, types, values = readLegacyVtk(self.root + ".vtk")
+        # all cells, in the order of the pfb file
+        iz, iy, ix = [a.ravel() for a in np.indices(self.indi.shape)]
+        self.assertEqual(len(points), 4*(self.tfg.nz+1)*self.tfg.ny*self.tfg.nx)
+        self.assertDraped(points, hexes, types, values, iz, iy, ix)
+
+    def test_legacy_point_limit(self):
+        cells = vtkio.DrapedCells(self.tfg, self.indi)
+        cells.npoints = vtkio.LEGACY_MAX_POINTS + 4
+        with self.assertRaisesRegex(ValueError, "vtu"):
+            vtkio.writeLegacyVtk(self.root + ".vtk", cells, "indicator")
+        self.assertFalse(os.path.exists(self.root + ".vtk"))
+
+    def test_vtu_inside_only(self):
+        writeVolumeVtk(self.tfg, self.indi, self.root, "vtu", insideOnly=True)
+        points, hexes, types, values = readVtu(self.root + ".vtu")
+        iz, iy, ix = np.nonzero(self.indi)
+        self.assertDraped(points, hexes, types, values, iz, iy, ix)
+        # only the boundaries of the cells written, and the stacked cells of column (1, 1) share one
+        self.assertEqual(len(points), 4*(2*len(iz) - 1))
+
+        # blocks of one layer write the same file
+        with open(self.root + ".vtu", "rb") as f:
+            expected = f.read()
+        chunk = vtkio.CHUNK_CELLS
+        vtkio.CHUNK_CELLS = 1
+        try:
+            writeVolumeVtk(self.tfg, self.indi, self.root, "vtu", insideOnly=True)
+        finally:
+            vtkio.CHUNK_CELLS = chunk
+        with open(self.root + ".vtu", "rb") as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_tcl(self):
+        # the tcl script needs the DEM pfb, which grids built in memory do not have
+        writeVolumeVtk(self.tfg, self.indi, self.root)
+        self.assertEqual(os.listdir(self.dir.name), [])
+
+    def test_process_volume(self):
+        exampleDir = os.path.join(EXAMPLES_DIR, "dodecahedron")
+        tfg = TFG(-3.0, -3.0, 0.3, 0.3, 23, 19, [0.3]*20, os.path.join(exampleDir, "dem.pfb"))
+        ts, _ = TriangulatedSurface.fromObj(os.path.join(exampleDir, "dodecahedron.obj"))
+        ts.processVolume(tfg, self.root, engine="column", vtkFormat="vtu", vtkInside=True)
+        _, _, _, values = readVtu(self.root + ".vtu")
+        self.assertEqual(len(values), np.count_nonzero(ts.mapVolume(tfg, "column")))
+        self.assertFalse(os.path.exists(self.root + ".gen_vtk.tcl"))
+
+if __name__ == "__main__":
+    unittest.main()